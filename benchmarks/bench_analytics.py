@@ -0,0 +1,141 @@
+"""播放统计基准：在百万行 playback_history 上测量管理后台各统计指标的耗时
+
+用法: python benchmarks/bench_analytics.py [--rows N] [--users N] [--days N] [--rounds N]
+
+写入跨 --days 天的测试数据后执行迁移（由迁移 v6 初始化汇总表），分别测量各指标在 7/30/365 天范围内
+不使用缓存与命中缓存时的耗时；并以直接在 playback_history 上 GROUP BY 的“本月用户排行”作为对照。
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from analytics import METRICS, PlaybackAnalytics, parse_day_range  # noqa: E402
+from database import DatabaseManager  # noqa: E402
+from schema_migrations import apply_migrations  # noqa: E402
+from sqlite_manager import SQLiteConnectionManager  # noqa: E402
+
+CLIENTS = [('Emby Web', 'Chrome'), ('Emby for Android', 'Pixel'), ('Emby Theater', 'Living Room'),
+           ('Infuse', 'Apple TV'), ('Emby for iOS', 'iPhone'), ('Kodi', 'NUC')]
+
+# 对照：不使用汇总表时“本月用户排行”需要扫描时间范围内的全部播放记录
+RAW_TOP_USERS_SQL = '''
+    SELECT user_id, MAX(username), COUNT(*), SUM(duration)
+    FROM playback_history
+    WHERE start_time >= ? AND start_time < ? AND end_time IS NOT NULL
+    GROUP BY user_id
+    ORDER BY 4 DESC
+    LIMIT 10
+'''
+
+
+def _populate(manager, rows, users, days):
+    rng = random.Random(42)
+    # 最后一天的数据截止到当前时刻之前，避免产生未来的会话
+    first = datetime.combine(date.today(), datetime.min.time()) - timedelta(days=days - 1)
+    span = (days - 1) * 86400 + max(int((datetime.now() - datetime.combine(date.today(), datetime.min.time())).total_seconds()) - 7200, 1)
+    # 少量用户贡献大部分观看时长
+    weights = [1 / (rank + 1) for rank in range(users)]
+
+    def history():
+        for i, user in enumerate(rng.choices(range(users), weights=weights, k=rows)):
+            start_time = first + timedelta(seconds=rng.randrange(span))
+            duration = rng.randrange(300, 7200)
+            client, device = CLIENTS[user % len(CLIENTS)]
+            yield (
+                f'session-{i}', f'user-{user}', f'name-{user}', f'10.0.{user % 256}.{i % 256}', device, client,
+                f'media-{int(rng.paretovariate(1.2)) % 20000}', start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                (start_time + timedelta(seconds=duration)).strftime('%Y-%m-%d %H:%M:%S'), duration, '中国',
+            )
+
+    with manager.connect(write=True) as conn:
+        conn.executemany(
+            '''
+            INSERT INTO playback_history (
+                session_id, user_id, username, ip_address, device_name, client_type, media_name,
+                start_time, end_time, duration, location
+            ) VALUES (?,?,?,?,?,?,?,?,?,?,?)
+            ''',
+            history(),
+        )
+
+
+def _percentile(samples, ratio):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * ratio), len(samples) - 1)]
+
+
+def _measure(func, rounds):
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), _percentile(samples, 0.95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manager = SQLiteConnectionManager(os.path.join(tmp_dir, 'bench.db'))
+        apply_migrations(manager, target_version=5)
+
+        started = time.perf_counter()
+        _populate(manager, args.rows, args.users, args.days)
+        print(f'写入 {args.rows} 行播放记录（{args.days} 天）: {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        version = apply_migrations(manager)
+        print(f'迁移到 v{version}（初始化汇总表）: {time.perf_counter() - started:.1f}s')
+
+        # 统计只用到连接管理器和归档目录（此处没有归档库）
+        store = SimpleNamespace(_db=manager, archive_dir=os.path.join(tmp_dir, 'archive'))
+        for name in dir(DatabaseManager):
+            if name.startswith('get_'):
+                setattr(store, name, getattr(DatabaseManager, name).__get__(store))
+        analytics = PlaybackAnalytics(store)
+
+        print(f"\n{'指标':<14}{'范围':>8}{'无缓存 p50':>14}{'无缓存 p95':>14}{'命中缓存 p50':>16}")
+        for range_days in (7, 30, 365):
+            start = (date.today() - timedelta(days=range_days - 1)).isoformat()
+            for metric in METRICS:
+                if range_days > METRICS[metric]:
+                    continue
+
+                def uncached():
+                    analytics.clear_cache()
+                    analytics.query(metric, start=start, limit=10)
+
+                p50, p95 = _measure(uncached, args.rounds)
+                cached_p50, _ = _measure(lambda: analytics.query(metric, start=start, limit=10), args.rounds)
+                print(f'{metric:<14}{range_days:>7}d{p50:>12.2f}ms{p95:>12.2f}ms{cached_p50:>14.3f}ms')
+
+        start_day, end_day = parse_day_range(date.today().replace(day=1).isoformat(), None, max_days=31)
+
+        def raw_top_users():
+            with manager.connect() as conn:
+                conn.execute(RAW_TOP_USERS_SQL, (start_day, end_day)).fetchall()
+
+        raw_p50, _ = _measure(raw_top_users, args.rounds)
+        rollup_p50, _ = _measure(lambda: store.get_top_users(start_day, end_day, 10), args.rounds)
+        print(f'\n本月用户排行: 扫描播放记录 {raw_p50:.2f}ms，读取汇总表 {rollup_p50:.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
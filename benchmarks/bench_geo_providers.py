@@ -0,0 +1,74 @@
+"""IP 归属地查询后端基准：进程内调用 vs 每次查询启动子进程
+
+用法: python benchmarks/bench_geo_providers.py [--provider ip138|hiofd] [--rounds N] [--ips IP ...]
+
+- spawn: 仅启动 CLI（--help）所需时间，即子进程方式每次查询额外付出的固定开销，不依赖网络
+- lookup: 实际查询的单次耗时（需要能访问对应的查询站点）
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from geo_providers import InProcessBackend, SubprocessBackend  # noqa: E402
+
+COMMANDS = {'ip138': 'qoo-ip138', 'hiofd': 'ip-hiofd'}
+
+
+def _timed(func, rounds):
+    samples = []
+    errors = 0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        try:
+            func()
+        except Exception:
+            errors += 1
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples, errors
+
+
+def _report(name, samples, errors):
+    samples = sorted(samples)
+    p95 = samples[min(int(len(samples) * 0.95), len(samples) - 1)]
+    print(f"{name:<28} p50 {statistics.median(samples):>9.1f}ms  p95 {p95:>9.1f}ms  max {samples[-1]:>9.1f}ms  errors {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--provider', choices=sorted(COMMANDS), default='ip138')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--ips', nargs='*', default=['114.114.114.114', '223.5.5.5'])
+    args = parser.parse_args()
+
+    command = COMMANDS[args.provider]
+    samples, errors = _timed(
+        lambda: subprocess.run([command, '--help'], capture_output=True, check=False), args.rounds
+    )
+    _report(f'spawn {command}', samples, errors)
+
+    backends = [SubprocessBackend(timeout_sec=45)]
+    try:
+        backends.append(InProcessBackend(timeout_sec=45))
+    except ImportError as exc:
+        print(f'进程内后端不可用: {exc}')
+
+    for backend in backends:
+        query = backend.query_ip138 if args.provider == 'ip138' else backend.query_hiofd
+        samples, errors = [], 0
+        for ip in args.ips:
+            ip_samples, ip_errors = _timed(lambda: query(ip), args.rounds)
+            samples.extend(ip_samples)
+            errors += ip_errors
+        _report(f'lookup {backend.name}', samples, errors)
+
+
+if __name__ == '__main__':
+    main()
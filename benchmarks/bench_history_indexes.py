@@ -0,0 +1,138 @@
+"""播放记录索引基准：在百万行 playback_history 上对比迁移 v4（热点查询索引）前后的查询耗时
+
+用法: python benchmarks/bench_history_indexes.py [--rows N] [--users N] [--rounds N]
+
+先建立 v3 结构并写入测试数据，测量各查询耗时；再执行剩余迁移（计入建索引耗时），重新测量。
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from database import DatabaseManager  # noqa: E402
+from schema_migrations import apply_migrations  # noqa: E402
+from sqlite_manager import SQLiteConnectionManager  # noqa: E402
+
+PENDING_LOCATION = '解析中'
+
+
+def _populate(manager, rows, users):
+    started = datetime(2023, 1, 1)
+
+    def history():
+        for i in range(rows):
+            user = i % users
+            start_time = started + timedelta(seconds=i * 30)
+            # 约 0.1% 的会话尚未结束，约 0.1% 的归属地仍为占位值
+            ended = i % 1000 != 0
+            yield (
+                f'session-{i}', f'user-{user}', f'name-{user}', f'10.{user % 256}.{i % 256}.{i % 200}',
+                'device', 'client', f'media-{i % 5000}', start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                (start_time + timedelta(minutes=45)).strftime('%Y-%m-%d %H:%M:%S') if ended else None,
+                2700 if ended else None, PENDING_LOCATION if i % 1000 == 500 else '中国',
+            )
+
+    def security():
+        for i in range(rows // 20):
+            user = i % users
+            yield (
+                (started + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S'), f'user-{user}', f'name-{user}',
+                '10.0.0.1', 2, 'DISABLE' if i % 3 else 'ENABLE',
+            )
+
+    with manager.connect(write=True) as conn:
+        conn.executemany(
+            '''
+            INSERT INTO playback_history (
+                session_id, user_id, username, ip_address, device_name, client_type, media_name,
+                start_time, end_time, duration, location
+            ) VALUES (?,?,?,?,?,?,?,?,?,?,?)
+            ''',
+            history(),
+        )
+        conn.executemany(
+            '''
+            INSERT INTO security_log (timestamp, user_id, username, trigger_ip, active_sessions, action)
+            VALUES (?,?,?,?,?,?)
+            ''',
+            security(),
+        )
+
+
+def _bench(store, manager, open_sessions, users, rounds):
+    rng = random.Random(42)
+
+    def end_session():
+        with manager.connect(write=True) as conn:
+            conn.execute(DatabaseManager.SESSION_END_SQL, ('2024-01-01 00:00:00', 60, next(open_sessions)))
+
+    cases = [
+        ('record_session_end', end_session),
+        ('get_user_playback_records',
+         lambda: DatabaseManager.get_user_playback_records(store, f'user-{rng.randrange(users)}', 10)),
+        ('get_playback_records_by_username',
+         lambda: DatabaseManager.get_playback_records_by_username(store, f'name-{rng.randrange(users)}', 10)),
+        ('get_user_ban_info', lambda: DatabaseManager.get_user_ban_info(store, f'user-{rng.randrange(users)}')),
+        ('get_ban_info_by_username',
+         lambda: DatabaseManager.get_ban_info_by_username(store, f'name-{rng.randrange(users)}')),
+        ('get_security_logs', lambda: DatabaseManager.get_security_logs(store, 100)),
+        ('get_pending_location_ips', lambda: DatabaseManager.get_pending_location_ips(store, PENDING_LOCATION)),
+    ]
+    results = {}
+    for name, func in cases:
+        samples = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - started) * 1000)
+        results[name] = statistics.median(samples)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manager = SQLiteConnectionManager(os.path.join(tmp_dir, 'bench.db'))
+        apply_migrations(manager, target_version=3)
+
+        started = time.perf_counter()
+        _populate(manager, args.rows, args.users)
+        print(f'写入 {args.rows} 行播放记录: {time.perf_counter() - started:.1f}s')
+
+        # 只读方法只用到连接管理器和归档目录（此处没有归档库），直接以 DatabaseManager 的方法在未建索引的库上测量
+        store = SimpleNamespace(_db=manager, archive_dir=os.path.join(tmp_dir, 'archive'))
+        for name, attr in vars(DatabaseManager).items():
+            if callable(attr) and not name.startswith('__'):
+                setattr(store, name, attr.__get__(store))
+        # 两轮测量共用同一批未结束的会话，每次结束一个不同的会话
+        open_sessions = iter(f'session-{i}' for i in range(0, args.rows, 1000))
+        before = _bench(store, manager, open_sessions, args.users, args.rounds)
+
+        started = time.perf_counter()
+        version = apply_migrations(manager)
+        print(f'迁移到 v{version}（建立索引）: {time.perf_counter() - started:.1f}s')
+        after = _bench(store, manager, open_sessions, args.users, args.rounds)
+
+    print(f"{'查询':<34}{'无索引 p50':>14}{'有索引 p50':>14}{'加速':>10}")
+    for name, before_ms in before.items():
+        after_ms = after[name]
+        print(f'{name:<34}{before_ms:>12.2f}ms{after_ms:>12.3f}ms{before_ms / max(after_ms, 1e-6):>9.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""ip_utils 与原 EmbyMonitor 中 IP 解析函数的微基准
+
+用法: python benchmarks/bench_ip_utils.py [--rounds N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import socket
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+import ip_utils  # noqa: E402
+
+ENDPOINTS = [
+    '192.168.1.10:52314',
+    '10.0.0.8:8096',
+    '[2409:8a55:9429:9a90:1c2d:3e4f:5a6b:7c8d]:8096',
+    '2408:8207:28c:3c01:8c5e:7cff:fe2e:2c8e:8096',
+    'fe80::1%eth0',
+    '240e:3b7:3270:e0d0::1',
+]
+
+
+class LegacyParser:
+    """原 EmbyMonitor 中的实现，原样保留以作对照"""
+
+    def __init__(self, ipv6_prefix_length=64):
+        self.ipv6_prefix_length = ipv6_prefix_length
+
+    def _extract_ip_address(self, remote_endpoint):
+        """智能提取IP地址，支持IPv4和IPv6"""
+        if not remote_endpoint:
+            return ""
+        
+        # 处理IPv6地址格式：[IPv6]:port 或 IPv6%interface:port
+        ipv6_pattern = r'^\[(.*?)\](?::(\d+))?$|^([^%]:*)(?:%[^:]*)?:(?:(\d+))?$'
+        match = re.match(ipv6_pattern, remote_endpoint)
+        
+        if match:
+            # 方括号格式（IPv6）
+            if match.group(1):  # [IPv6]:port格式
+                return match.group(1)
+            # 冒号格式（可能是IPv6）
+            ip_part = match.group(3)
+            if ip_part and self._is_ipv6(ip_part):
+                return ip_part
+            elif ip_part:
+                return ip_part
+        
+        # 如果上面没匹配到，尝试其他方法
+        # 对于IPv6格式2408:8207:28c:3c01:8c5e:7cff:fe2e:2c8e:8096
+        parts = remote_endpoint.split(':')
+        if len(parts) >= 8:  # IPv6至少有8个部分（16进制）
+            # 尝试前8个部分组成IPv6地址
+            potential_ipv6 = ':'.join(parts[:8])
+            if self._is_ipv6(potential_ipv6):
+                return potential_ipv6
+        
+        # 处理IPv4格式
+        ipv4_pattern = r'^(\d+\.\d+\.\d+\.\d+):(\d+)$'
+        match = re.match(ipv4_pattern, remote_endpoint)
+        if match:
+            return match.group(1)
+        
+        # 如果都匹配不到，返回原始值（可能是IPv6直接格式）
+        return remote_endpoint.split('%')[0]  # 移除接口标识
+    
+    def _is_ipv6(self, ip_str):
+        """检查是否为有效的IPv6地址"""
+        try:
+            socket.inet_pton(socket.AF_INET6, ip_str)
+            return True
+        except (socket.error, ValueError):
+            return False
+    
+    def _is_ipv4(self, ip_str):
+        """检查是否为有效的IPv4地址"""
+        try:
+            socket.inet_pton(socket.AF_INET, ip_str)
+            return True
+        except (socket.error, ValueError):
+            return False
+    
+    def _get_ipv6_prefix(self, ipv6_address, prefix_length):
+        """获取IPv6地址的前缀
+        
+        Args:
+            ipv6_address: IPv6地址字符串
+            prefix_length: 前缀长度（比特）
+            
+        Returns:
+            前缀字符串，例如 "2409:8a55:9429:9a90::"（64位前缀）
+        """
+        if not ipv6_address or not self._is_ipv6(ipv6_address):
+            return ipv6_address
+            
+        try:
+            # 将IPv6地址转换为二进制数据
+            binary_data = socket.inet_pton(socket.AF_INET6, ipv6_address)
+            
+            # 计算需要保留的字节数
+            prefix_bytes = prefix_length // 8
+            if prefix_length % 8 != 0:
+                prefix_bytes += 1
+            
+            # 获取前缀字节
+            prefix_binary = binary_data[:prefix_bytes]
+            
+            # 计算需要保留的段数（每个段16位=2字节）
+            prefix_segments = prefix_length // 16
+            if prefix_length % 16 != 0:
+                prefix_segments += 1
+            
+            # 将前缀字节转换回IPv6地址字符串
+            prefix_address = socket.inet_ntop(socket.AF_INET6, prefix_binary.ljust(16, b'\x00'))
+            
+            # 提取前缀部分
+            segments = prefix_address.split(':')
+            prefix_segments = segments[:prefix_segments]
+            
+            # 确保格式正确（添加::如果需要）
+            if len(prefix_segments) < 8:
+                prefix_segments.append('')
+            
+            return ':'.join(prefix_segments)
+            
+        except Exception:
+            return ipv6_address
+    
+    def _is_same_network(self, ip1, ip2):
+        """判断两个IP地址是否属于同一网络
+        
+        Args:
+            ip1: 第一个IP地址
+            ip2: 第二个IP地址
+            
+        Returns:
+            True如果属于同一网络，否则False
+        """
+        if ip1 == ip2:
+            return True
+            
+        # 检查是否都是IPv6地址
+        if self._is_ipv6(ip1) and self._is_ipv6(ip2):
+            # 比较前缀
+            prefix1 = self._get_ipv6_prefix(ip1, self.ipv6_prefix_length)
+            prefix2 = self._get_ipv6_prefix(ip2, self.ipv6_prefix_length)
+            return prefix1 == prefix2
+        
+        # 检查是否都是IPv4地址（直接比较）
+        if self._is_ipv4(ip1) and self._is_ipv4(ip2):
+            return ip1 == ip2
+        
+        # 混合类型，认为不是同一网络
+        return False
+
+
+def _legacy_session_start(parser, endpoint):
+    ip = parser._extract_ip_address(endpoint)
+    ip_type = "IPv6" if parser._is_ipv6(ip) else "IPv4" if parser._is_ipv4(ip) else "未知"
+    network = parser._get_ipv6_prefix(ip, parser.ipv6_prefix_length) if parser._is_ipv6(ip) else ip
+    return ip, ip_type, network
+
+
+def _new_session_start(endpoint):
+    parsed = ip_utils.parse_endpoint(endpoint, 64)
+    return parsed.ip, ip_utils.ip_type_label(parsed.ip), parsed.network
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    legacy = LegacyParser(64)
+    ips = [legacy._extract_ip_address(endpoint) for endpoint in ENDPOINTS]
+    pairs = list(zip(ips, ips[1:] + ips[:1]))
+
+    # 两种实现的 IP 提取结果必须一致
+    for endpoint in ENDPOINTS:
+        assert legacy._extract_ip_address(endpoint) == ip_utils.extract_ip(endpoint), endpoint
+    for ip1, ip2 in pairs:
+        assert legacy._is_same_network(ip1, ip2) == ip_utils.is_same_network(ip1, ip2, 64), (ip1, ip2)
+
+    cases = [
+        ('extract_ip', lambda: [legacy._extract_ip_address(e) for e in ENDPOINTS],
+         lambda: [ip_utils.extract_ip(e) for e in ENDPOINTS]),
+        ('session_start', lambda: [_legacy_session_start(legacy, e) for e in ENDPOINTS],
+         lambda: [_new_session_start(e) for e in ENDPOINTS]),
+        ('is_same_network', lambda: [legacy._is_same_network(a, b) for a, b in pairs],
+         lambda: [ip_utils.is_same_network(a, b, 64) for a, b in pairs]),
+    ]
+
+    print(f"{'case':<16} {'legacy us/op':>14} {'ip_utils us/op':>16} {'speedup':>9}")
+    for name, legacy_fn, new_fn in cases:
+        ops = args.rounds * len(ENDPOINTS)
+        legacy_us = timeit.timeit(legacy_fn, number=args.rounds) / ops * 1e6
+        new_us = timeit.timeit(new_fn, number=args.rounds) / ops * 1e6
+        print(f"{name:<16} {legacy_us:>14.3f} {new_us:>16.3f} {legacy_us / new_us:>8.1f}x")
+
+    print(ip_utils.cache_stats())
+
+
+if __name__ == '__main__':
+    main()
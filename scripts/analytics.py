@@ -0,0 +1,180 @@
+"""管理后台的播放统计
+
+除并发峰值外的指标都读取观看时长汇总表（见 rollups），耗时只与时间范围内的天数有关，与历史记录总量无关。
+并发峰值需要逐条会话计算：按 start_time 索引读取时间范围内（向前多取 session_lookback_hours 以包含跨天会话）
+的会话，包括对应月份的归档库，再按时间扫描开始/结束事件。
+结果按 (指标, 时间范围, limit) 缓存 cache_ttl 秒。各指标在百万条播放记录下的耗时见 benchmarks/bench_analytics.py。
+"""
+
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+# 指标 -> 允许查询的最大天数
+METRICS = {
+    'summary': 3660,
+    'top_users': 3660,
+    'top_media': 3660,
+    'clients': 3660,
+    'daily': 3660,
+    'hourly': 3660,
+    'concurrency': 93,
+}
+
+
+def parse_day_range(start=None, end=None, default_days=30, max_days=366):
+    """把 YYYY-MM-DD 的起止日期（含结束日）转换为 [开始, 结束) 日期字符串，默认最近 default_days 天"""
+    try:
+        end_day = datetime.strptime(end, '%Y-%m-%d').date() if end else date.today()
+        start_day = datetime.strptime(start, '%Y-%m-%d').date() if start else end_day - timedelta(days=default_days - 1)
+    except ValueError:
+        raise ValueError('日期格式应为 YYYY-MM-DD')
+    if start_day > end_day:
+        raise ValueError('开始日期不能晚于结束日期')
+    if (end_day - start_day).days + 1 > max_days:
+        raise ValueError(f'时间范围不能超过 {max_days} 天')
+    return start_day.isoformat(), (end_day + timedelta(days=1)).isoformat()
+
+
+def _hours(seconds):
+    return round((seconds or 0) / 3600, 2)
+
+
+class PlaybackAnalytics:
+    def __init__(self, db_manager, cache_ttl=60, cache_size=256, session_lookback_hours=24):
+        self.db = db_manager
+        self.cache_ttl = cache_ttl
+        self.cache_size = max(int(cache_size), 1)
+        self.session_lookback_hours = session_lookback_hours
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def query(self, metric, start=None, end=None, limit=10):
+        """计算指标，返回 {'metric', 'start', 'end', 'result', 'elapsed_ms', 'cached'}；参数不合法时抛出 ValueError"""
+        if metric not in METRICS:
+            raise ValueError(f'不支持的统计指标: {metric}')
+        start_day, end_day = parse_day_range(start, end, max_days=METRICS[metric])
+        limit = min(max(int(limit), 1), 100)
+        key = (metric, start_day, end_day, limit)
+
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > now:
+                self.cache_hits += 1
+                return {**cached[1], 'cached': True}
+            self.cache_misses += 1
+
+        started = time.perf_counter()
+        result = getattr(self, f'_{metric}')(start_day, end_day, limit)
+        payload = {
+            'metric': metric,
+            'start': start_day,
+            'end': (date.fromisoformat(end_day) - timedelta(days=1)).isoformat(),
+            'result': result,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+        }
+        with self._cache_lock:
+            if len(self._cache) >= self.cache_size:
+                self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+                if len(self._cache) >= self.cache_size:
+                    self._cache.pop(next(iter(self._cache)))
+            self._cache[key] = (now + self.cache_ttl, payload)
+        return {**payload, 'cached': False}
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+    def cache_stats(self):
+        with self._cache_lock:
+            return {
+                'size': len(self._cache),
+                'ttl': self.cache_ttl,
+                'hits': self.cache_hits,
+                'misses': self.cache_misses,
+            }
+
+    def _summary(self, start_day, end_day, limit):
+        sessions, watch_seconds, active_users = self.db.get_watch_totals(start_day, end_day)
+        return {'sessions': sessions, 'watch_hours': _hours(watch_seconds), 'active_users': active_users}
+
+    def _top_users(self, start_day, end_day, limit):
+        return [
+            {
+                'user_id': user_id,
+                'username': username,
+                'sessions': sessions,
+                'watch_hours': _hours(watch_seconds),
+                'active_days': active_days,
+            }
+            for user_id, username, sessions, watch_seconds, active_days in self.db.get_top_users(
+                start_day, end_day, limit
+            )
+        ]
+
+    def _top_media(self, start_day, end_day, limit):
+        return [
+            {'media_name': media_name, 'sessions': sessions, 'watch_hours': _hours(watch_seconds)}
+            for media_name, sessions, watch_seconds in self.db.get_top_media(start_day, end_day, limit)
+        ]
+
+    def _clients(self, start_day, end_day, limit):
+        return [
+            {
+                'client_type': client_type,
+                'device_name': device_name,
+                'sessions': sessions,
+                'watch_hours': _hours(watch_seconds),
+            }
+            for client_type, device_name, sessions, watch_seconds in self.db.get_client_mix(start_day, end_day, limit)
+        ]
+
+    def _daily(self, start_day, end_day, limit):
+        return [
+            {'day': day, 'active_users': active_users, 'sessions': sessions, 'watch_hours': _hours(watch_seconds)}
+            for day, active_users, sessions, watch_seconds in self.db.get_daily_activity(start_day, end_day)
+        ]
+
+    def _hourly(self, start_day, end_day, limit):
+        return [
+            {'hour': hour, 'sessions': sessions, 'watch_hours': _hours(watch_seconds)}
+            for hour, sessions, watch_seconds in self.db.get_hourly_distribution(start_day, end_day)
+        ]
+
+    def _concurrency(self, start_day, end_day, limit):
+        """时间范围内的并发播放峰值及出现时间，以及每天的峰值"""
+        lookback_start = (
+            datetime.fromisoformat(start_day) - timedelta(hours=self.session_lookback_hours)
+        ).strftime('%Y-%m-%d %H:%M:%S')
+        range_start, range_end = f'{start_day} 00:00:00', f'{end_day} 00:00:00'
+        now_text = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        events = []
+        for _id, session_start, session_end in self.db.get_session_intervals(range_start, range_end, lookback_start):
+            # 仍在进行中的会话视为持续到当前时刻（遗留的未结束记录已由查询排除）；事件时间截取到查询范围内
+            session_start = max(session_start, range_start)
+            session_end = min(session_end or now_text, range_end)
+            if session_end > session_start:
+                events.append((session_start, 1))
+                events.append((session_end, -1))
+        # 同一时刻先处理结束再处理开始，首尾相接的会话不算并发
+        events.sort()
+
+        current = peak = 0
+        peak_at = None
+        daily_peaks = {}
+        for timestamp, delta in events:
+            current += delta
+            if delta > 0:
+                day = timestamp[:10]
+                if current > daily_peaks.get(day, 0):
+                    daily_peaks[day] = current
+                if current > peak:
+                    peak, peak_at = current, timestamp
+        return {
+            'peak': peak,
+            'peak_at': peak_at,
+            'daily_peaks': [{'day': day, 'peak': value} for day, value in sorted(daily_peaks.items())],
+        }
@@ -0,0 +1,131 @@
+import threading
+import time
+from collections import deque
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """熔断器：连续失败次数或滚动窗口失败率超过阈值时熔断
+
+    熔断（open）期间 allow() 直接返回 False；经过 reset_timeout 秒后进入半开（half_open），
+    只放行一次试探请求，成功则恢复，失败则重新熔断。
+    最近 window_size 次调用中至少有 min_calls 次、且失败率达到 failure_rate_threshold 时也会熔断。
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60, window_size=20, failure_rate_threshold=0.5,
+                 min_calls=10):
+        self.name = name
+        self.failure_threshold = max(int(failure_threshold), 1)
+        self.reset_timeout = reset_timeout
+        self.failure_rate_threshold = failure_rate_threshold
+        self.min_calls = max(int(min_calls), 1)
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self.rejected = 0
+        self._window = deque(maxlen=max(int(window_size), 1))
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def available(self):
+        """是否可以发起调用（不占用半开状态的试探名额）"""
+        with self._lock:
+            return self.state != STATE_OPEN or time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def allow(self):
+        with self._lock:
+            if self.state == STATE_OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = STATE_HALF_OPEN
+                self._probing = False
+            if self.state == STATE_HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    return False
+                self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                # 恢复后重新统计失败率，避免熔断前的失败记录立即再次触发熔断
+                self._window.clear()
+            self._window.append(True)
+            self.state = STATE_CLOSED
+            self.consecutive_failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._window.append(False)
+            self.consecutive_failures += 1
+            if self.state == STATE_HALF_OPEN or self.consecutive_failures >= self.failure_threshold or self._rate_exceeded():
+                if self.state != STATE_OPEN:
+                    self.trips += 1
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def _rate_exceeded(self):
+        if not self.failure_rate_threshold or len(self._window) < self.min_calls:
+            return False
+        return self._failure_rate() >= self.failure_rate_threshold
+
+    def _failure_rate(self):
+        if not self._window:
+            return 0.0
+        return sum(1 for ok in self._window if not ok) / len(self._window)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'failure_rate': round(self._failure_rate(), 3),
+                'window_calls': len(self._window),
+                'trips': self.trips,
+                'rejected': self.rejected,
+                'open_remaining': (
+                    max(round(self.reset_timeout - (time.monotonic() - self.opened_at), 1), 0)
+                    if self.state == STATE_OPEN else 0
+                ),
+            }
+
+
+class AdaptiveTimeout:
+    """根据最近成功调用的耗时计算超时时间：p95 × multiplier，限制在 [min_timeout, max_timeout] 之间
+
+    样本不足 min_samples 时使用 max_timeout。min_timeout 与 max_timeout 相同时即固定超时。
+    """
+
+    def __init__(self, min_timeout=3, max_timeout=45, multiplier=3, window_size=50, min_samples=5):
+        self.max_timeout = max_timeout
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=max(int(window_size), 1))
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed_sec):
+        with self._lock:
+            self._samples.append(elapsed_sec)
+
+    def current(self):
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return self.max_timeout
+            samples = sorted(self._samples)
+        p95 = samples[min(int(len(samples) * 0.95), len(samples) - 1)]
+        return min(max(p95 * self.multiplier, self.min_timeout), self.max_timeout)
+
+    def to_dict(self):
+        with self._lock:
+            samples = len(self._samples)
+        return {'timeout_sec': round(self.current(), 2), 'samples': samples}
@@ -25,15 +25,40 @@ DEFAULT_CONFIG = {
         'server_url': 'https://emby.example.com',
         'external_url': 'https://emby.example.com',
         'api_key': 'your_api_key_here',
+        'user_cache_ttl': 300,
     },
     'service': {
         'external_url': 'https://embyq.example.com:5000',
     },
     'database': {
         'name': 'emby_playback.db',
+        'busy_timeout_ms': 5000,
+        'mmap_size_mb': 256,
+        'cache_size_mb': 16,
+    },
+    'archive': {
+        'enabled': False,
+        'playback_retention_days': 365,
+        'security_retention_days': 365,
+        'interval': 3600,
+        'batch_size': 500,
+        'max_batches': 200,
+        'batch_pause': 0.05,
     },
     'monitor': {
         'check_interval': 10,
+        'enrich_workers': 4,
+        'enrich_queue_size': 64,
+        'mode': 'poll',
+        'reconcile_interval': 60,
+        'checkpoint_interval': 30,
+        'write_behind': True,
+        'expiry_workers': 4,
+        'expiry_check_interval': 600,
+        'ip_cache_cleanup_interval': 36000,
+        'metrics_log_interval': 600,
+        'rollup_rebuild_interval': 86400,
+        'rollup_rebuild_days': 3,
     },
     'notifications': {
         'enable_alerts': True,
@@ -56,6 +81,30 @@ DEFAULT_CONFIG = {
     },
     'ip_location': {
         'use_geocache': False,
+        'cache_size': 10000,
+        'cache_ttl': 86400,
+        'negative_cache_ttl': 300,
+        'prefix_match': True,
+        'prefix_min_samples': 2,
+        'backend': 'auto',
+        'lookup_workers': 4,
+        'geocache_url': '',
+        'tiers': ['sqlite', 'prefix', 'geocache', 'provider'],
+        'geocache_timeout': 2,
+        'geocache_failure_threshold': 5,
+        'geocache_reset_timeout': 60,
+        'warmup_size': 5000,
+        'breaker_failure_threshold': 5,
+        'breaker_failure_rate': 0.5,
+        'breaker_window': 20,
+        'breaker_reset_timeout': 60,
+        'adaptive_timeout': True,
+        'min_timeout': 3,
+        'timeout_multiplier': 3,
+        'pending_retry_interval': 30,
+        'deferred_location': True,
+        'backfill_interval': 10,
+        'backfill_batch_size': 100,
     },
     'tmdb': {
         'enabled': True,
@@ -69,6 +118,7 @@ DEFAULT_CONFIG = {
     'web': {
         'admin_username': 'admin',
         'admin_password': 'admin123',
+        'analytics_cache_ttl': 60,
     },
     'proxy': {
         'enabled': False,
@@ -1,8 +1,16 @@
+import json
 import os
 import secrets
 import sqlite3
 import string
+import threading
 from datetime import datetime, timedelta
+from itertools import groupby
+
+from history_archive import connect_archive, list_archives
+from rollups import ROLLUP_TABLES, rollup_aggregate_sql
+from schema_migrations import apply_migrations
+from sqlite_manager import get_connection_manager
 
 
 def get_data_dir():
@@ -10,256 +18,324 @@ def get_data_dir():
 
 
 class DatabaseManager:
-    def __init__(self, db_name=None):
+    SESSION_START_SQL = '''
+        INSERT INTO playback_history (
+            session_id, user_id, username, ip_address,
+            device_name, client_type, media_name,
+            start_time, location
+        ) VALUES (?,?,?,?,?,?,?,?,?)
+    '''
+    SESSION_END_SQL = '''
+        UPDATE playback_history
+        SET end_time = ?, duration = ?
+        WHERE session_id = ? AND end_time IS NULL
+    '''
+    SECURITY_EVENT_SQL = '''
+        INSERT INTO security_log
+        (timestamp, user_id, username, trigger_ip, active_sessions, action)
+        VALUES (?,?,?,?,?,?)
+    '''
+    LOCATION_BACKFILL_SQL = '''
+        UPDATE playback_history
+        SET location = ?
+        WHERE ip_address = ? AND location = ?
+    '''
+
+    def __init__(self, db_name=None, sqlite_options=None):
         data_dir = get_data_dir()
         os.makedirs(data_dir, exist_ok=True)
         self.db_path = os.path.join(data_dir, db_name) if db_name else os.path.join(data_dir, 'emby_playback.db')
+        # 超过保留期的播放记录/安全日志按月归档到此目录（见 history_archive）
+        self.archive_dir = os.path.join(os.path.dirname(self.db_path), 'archive')
+        # 与 ShadowLibrary / WishStore 共用同一个连接管理器（每线程持久连接、WAL）
+        self._db = get_connection_manager(self.db_path, **(sqlite_options or {}))
+
+        # 写后缓冲：开启后会话开始/结束、安全日志、归属地回填按发生顺序以 (sql, 参数) 存入内存，
+        # 由 flush_writes 在一个事务内按原顺序批量写入
+        self.write_behind = False
+        self._write_lock = threading.Lock()
+        self._pending_writes = []
         self.init_db()
 
-    def init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                '''
-                CREATE TABLE IF NOT EXISTS playback_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id TEXT NOT NULL,
-                    user_id TEXT NOT NULL,
-                    username TEXT NOT NULL,
-                    ip_address TEXT NOT NULL,
-                    device_name TEXT,
-                    client_type TEXT,
-                    media_name TEXT,
-                    start_time DATETIME NOT NULL,
-                    end_time DATETIME,
-                    duration INTEGER,
-                    location TEXT
-                )
-                '''
-            )
+    def set_write_behind(self, enabled):
+        """开启/关闭写后缓冲，关闭时立即写入已缓冲的记录"""
+        self.write_behind = bool(enabled)
+        if not self.write_behind:
+            self.flush_writes()
 
-            conn.execute(
-                '''
-                CREATE TABLE IF NOT EXISTS security_log (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp DATETIME,
-                    user_id TEXT,
-                    username TEXT,
-                    trigger_ip TEXT,
-                    active_sessions INTEGER,
-                    action TEXT
-                )
-                '''
-            )
+    def connection_stats(self):
+        return self._db.stats()
 
-            try:
-                cursor = conn.execute('PRAGMA table_info(security_log)')
-                columns = [row[1] for row in cursor.fetchall()]
-                if 'username' not in columns:
-                    conn.execute('ALTER TABLE security_log ADD COLUMN username TEXT')
-            except sqlite3.OperationalError:
-                pass
+    def close(self):
+        """停止服务时调用：写入缓冲记录后关闭连接管理器中所有线程的连接，返回关闭的连接数"""
+        try:
+            self.flush_writes()
+        finally:
+            closed = self._db.close_all()
+        return closed
+
+    def pending_write_count(self):
+        with self._write_lock:
+            return len(self._pending_writes)
+
+    def _write(self, sql, params):
+        if self.write_behind:
+            with self._write_lock:
+                self._pending_writes.append((sql, params))
+            return
+        with self._db.connect(write=True) as conn:
+            conn.execute(sql, params)
+            conn.commit()
 
-            conn.execute(
-                '''
-                CREATE TABLE IF NOT EXISTS user_expiry (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL UNIQUE,
-                    expiry_date DATE,
-                    never_expire INTEGER DEFAULT 0,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-                '''
-            )
+    def flush_writes(self):
+        """在一个事务内按写入顺序写入所有缓冲记录，返回写入条数
 
-            try:
-                conn.execute('SELECT never_expire FROM user_expiry LIMIT 1')
-            except sqlite3.OperationalError:
-                conn.execute('ALTER TABLE user_expiry ADD COLUMN never_expire INTEGER DEFAULT 0')
+        必须保持原顺序：Emby 可能在同一批次内复用会话 Id（结束 A 后立即以同一 Id 开始下一集），
+        若先写入全部会话开始再写入结束，结束语句会更新到新插入的记录上。
+        连续的同类语句合并为一次 executemany。写入失败时记录放回缓冲区，等待下次重试。
+        """
+        with self._write_lock:
+            writes, self._pending_writes = self._pending_writes, []
+        if not writes:
+            return 0
+
+        try:
+            with self._db.connect(write=True) as conn:
+                for sql, run in groupby(writes, key=lambda write: write[0]):
+                    conn.executemany(sql, [params for _sql, params in run])
                 conn.commit()
+        except Exception:
+            with self._write_lock:
+                self._pending_writes[:0] = writes
+            raise
+        return len(writes)
 
-            conn.execute(
-                '''
-                CREATE TABLE IF NOT EXISTS user_groups (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    group_id TEXT NOT NULL UNIQUE,
-                    name TEXT NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-                '''
+    def init_db(self):
+        """创建/升级表结构（见 schema_migrations）"""
+        return apply_migrations(self._db)
+
+    def save_active_sessions(self, sessions, saved_at):
+        """用当前活跃会话整体替换检查点（单个事务）"""
+        saved_at_text = saved_at.strftime('%Y-%m-%d %H:%M:%S')
+        rows = [
+            (
+                session['session_id'],
+                session['user_id'],
+                session.get('username'),
+                session.get('ip'),
+                session.get('device'),
+                session.get('client'),
+                session.get('media'),
+                session['start_time'].strftime('%Y-%m-%d %H:%M:%S'),
+                session.get('location'),
+                session.get('playback_duration', 0),
+                session.get('last_position_ticks', 0),
+                saved_at_text,
             )
-
-            conn.execute(
-                '''
-                CREATE TABLE IF NOT EXISTS user_group_members (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    group_id TEXT NOT NULL,
-                    user_id TEXT NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(group_id, user_id)
-                )
-                '''
+            for session in sessions
+        ]
+        with self._db.connect(write=True) as conn:
+            conn.execute('DELETE FROM active_session_checkpoint')
+            conn.executemany(
+                '''
+                INSERT INTO active_session_checkpoint (
+                    session_id, user_id, username, ip_address, device_name, client_type,
+                    media_name, start_time, location, playback_duration, last_position_ticks, saved_at
+                ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+                ''',
+                rows,
             )
+            conn.commit()
 
-            conn.execute(
-                '''
-                CREATE TABLE IF NOT EXISTS invites (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    code TEXT NOT NULL UNIQUE,
-                    expires_at DATETIME NOT NULL,
-                    max_uses INTEGER NOT NULL,
-                    used_count INTEGER DEFAULT 0,
-                    group_id TEXT,
-                    account_expiry_date DATE,
-                    is_active INTEGER DEFAULT 1,
-                    created_by TEXT,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-                '''
-            )
+    def close_orphaned_sessions(self):
+        """把不在活跃会话检查点中的未结束播放记录标记为结束，返回条数
 
-            conn.execute(
+        启动时、开始记录新会话之前调用：写入这些记录的进程已经退出，无法确定结束时间，
+        结束时间记为开始时间、时长记为 0，之后不再视为进行中。检查点中的会话由首次快照对账处理。
+        """
+        with self._db.connect(write=True) as conn:
+            cursor = conn.execute(
                 '''
-                CREATE TABLE IF NOT EXISTS ip_location_cache (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ip_address TEXT NOT NULL UNIQUE,
-                    provider TEXT NOT NULL,
-                    location TEXT,
-                    district TEXT,
-                    street TEXT,
-                    isp TEXT,
-                    latitude REAL,
-                    longitude REAL,
-                    formatted TEXT,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                UPDATE playback_history SET end_time = start_time, duration = 0
+                WHERE end_time IS NULL AND NOT EXISTS (
+                    SELECT 1 FROM active_session_checkpoint c
+                    WHERE c.session_id = playback_history.session_id AND c.start_time = playback_history.start_time
                 )
                 '''
             )
+            return cursor.rowcount
 
-            conn.commit()
-
-    def record_session_start(self, session_data):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                '''
-                INSERT INTO playback_history (
-                    session_id, user_id, username, ip_address,
-                    device_name, client_type, media_name,
-                    start_time, location
-                ) VALUES (?,?,?,?,?,?,?,?,?)
-                ''',
-                (
-                    session_data['session_id'],
-                    session_data['user_id'],
-                    session_data['username'],
-                    session_data['ip'],
-                    session_data['device'],
-                    session_data['client'],
-                    session_data['media'],
-                    session_data['start_time'].strftime('%Y-%m-%d %H:%M:%S'),
-                    session_data.get('location', '未知位置'),
-                ),
-            )
-            conn.commit()
-
-    def get_user_playback_records(self, user_id, limit=10):
-        with sqlite3.connect(self.db_path) as conn:
+    def load_active_sessions(self):
+        """读取活跃会话检查点，返回 (会话列表, 检查点时间)"""
+        with self._db.connect() as conn:
             cursor = conn.execute(
                 '''
-                SELECT session_id, ip_address, device_name, client_type, media_name,
-                       start_time, end_time, duration, location
-                FROM playback_history
-                WHERE user_id = ? AND end_time IS NOT NULL
-                ORDER BY start_time DESC
-                LIMIT ?
-                ''',
-                (user_id, limit),
-            )
-            return cursor.fetchall()
-
-    def get_user_ban_info(self, user_id):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
+                SELECT session_id, user_id, username, ip_address, device_name, client_type,
+                       media_name, start_time, location, playback_duration, last_position_ticks, saved_at
+                FROM active_session_checkpoint
                 '''
-                SELECT timestamp, trigger_ip, active_sessions, action
-                FROM security_log
-                WHERE user_id = ? AND action = 'DISABLE'
-                ORDER BY timestamp DESC
-                LIMIT 1
-                ''',
-                (user_id,),
             )
-            return cursor.fetchone()
+            rows = cursor.fetchall()
 
-    def get_playback_records_by_username(self, username, limit=10):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                '''
-                SELECT session_id, ip_address, device_name, client_type, media_name,
-                       start_time, end_time, duration, location
-                FROM playback_history
-                WHERE username = ? AND end_time IS NOT NULL
-                ORDER BY start_time DESC
-                LIMIT ?
-                ''',
-                (username, limit),
+        sessions = []
+        saved_at = None
+        for row in rows:
+            sessions.append(
+                {
+                    'session_id': row[0],
+                    'user_id': row[1],
+                    'username': row[2] or '未知用户',
+                    'ip': row[3] or '',
+                    'device': row[4] or '未知设备',
+                    'client': row[5] or '未知客户端',
+                    'media': row[6] or '未知内容',
+                    'start_time': datetime.strptime(row[7], '%Y-%m-%d %H:%M:%S'),
+                    'location': row[8] or '未知位置',
+                    'playback_duration': row[9] or 0,
+                    'last_position_ticks': row[10] or 0,
+                }
             )
-            return cursor.fetchall()
+            saved_at = datetime.strptime(row[11], '%Y-%m-%d %H:%M:%S')
+        return sessions, saved_at
 
-    def get_ban_info_by_username(self, username):
-        with sqlite3.connect(self.db_path) as conn:
+    def record_session_start(self, session_data):
+        self._write(
+            self.SESSION_START_SQL,
+            (
+                session_data['session_id'],
+                session_data['user_id'],
+                session_data['username'],
+                session_data['ip'],
+                session_data['device'],
+                session_data['client'],
+                session_data['media'],
+                session_data['start_time'].strftime('%Y-%m-%d %H:%M:%S'),
+                session_data.get('location', '未知位置'),
+            ),
+        )
+
+    def backfill_location(self, ip_address, location, pending_location):
+        """将该IP仍为占位归属地的播放记录更新为解析结果"""
+        self._write(
+            self.LOCATION_BACKFILL_SQL,
+            (location, ip_address, pending_location),
+        )
+
+    def get_pending_location_ips(self, pending_location, limit=1000):
+        """归属地仍为占位值的播放记录涉及的IP（重启后继续回填）"""
+        with self._db.connect() as conn:
             cursor = conn.execute(
-                '''
-                SELECT timestamp, trigger_ip, active_sessions, action
-                FROM security_log
-                WHERE username = ? AND action IN ('DISABLE', 'DISABLE_EXPIRED')
-                ORDER BY timestamp DESC
-                LIMIT 1
-                ''',
-                (username,),
+                'SELECT DISTINCT ip_address FROM playback_history WHERE location = ? LIMIT ?',
+                (pending_location, limit),
             )
-            return cursor.fetchone()
+            return [row[0] for row in cursor.fetchall()]
+
+    def _read_archives(self, sql, params, limit, newest_first=True):
+        """在各月归档库中执行与主库相同的查询（最后一个参数为 LIMIT），按月份顺序合并到 limit 条为止"""
+        rows = []
+        for _month, path in list_archives(self.archive_dir, newest_first=newest_first):
+            if len(rows) >= limit:
+                break
+            conn = connect_archive(path)
+            try:
+                rows.extend(conn.execute(sql, (*params, limit - len(rows))).fetchall())
+            finally:
+                conn.close()
+        return rows
+
+    def _query_history(self, sql, params, limit, include_archive=False):
+        """按时间倒序的历史查询：先查主库，不足 limit 条且 include_archive 时继续从新到旧查询归档库"""
+        with self._db.connect() as conn:
+            rows = conn.execute(sql, (*params, limit)).fetchall()
+        if include_archive and len(rows) < limit:
+            rows.extend(self._read_archives(sql, params, limit - len(rows)))
+        return rows
+
+    def get_user_playback_records(self, user_id, limit=10, include_archive=False):
+        return self._query_history(
+            '''
+            SELECT session_id, ip_address, device_name, client_type, media_name,
+                   start_time, end_time, duration, location
+            FROM playback_history
+            WHERE user_id = ? AND end_time IS NOT NULL
+            ORDER BY start_time DESC
+            LIMIT ?
+            ''',
+            (user_id,),
+            limit,
+            include_archive,
+        )
+
+    def get_user_ban_info(self, user_id, include_archive=False):
+        rows = self._query_history(
+            '''
+            SELECT timestamp, trigger_ip, active_sessions, action
+            FROM security_log
+            WHERE user_id = ? AND action = 'DISABLE'
+            ORDER BY timestamp DESC
+            LIMIT ?
+            ''',
+            (user_id,),
+            1,
+            include_archive,
+        )
+        return rows[0] if rows else None
+
+    def get_playback_records_by_username(self, username, limit=10, include_archive=False):
+        return self._query_history(
+            '''
+            SELECT session_id, ip_address, device_name, client_type, media_name,
+                   start_time, end_time, duration, location
+            FROM playback_history
+            WHERE username = ? AND end_time IS NOT NULL
+            ORDER BY start_time DESC
+            LIMIT ?
+            ''',
+            (username,),
+            limit,
+            include_archive,
+        )
+
+    def get_ban_info_by_username(self, username, include_archive=False):
+        rows = self._query_history(
+            '''
+            SELECT timestamp, trigger_ip, active_sessions, action
+            FROM security_log
+            WHERE username = ? AND action IN ('DISABLE', 'DISABLE_EXPIRED')
+            ORDER BY timestamp DESC
+            LIMIT ?
+            ''',
+            (username,),
+            1,
+            include_archive,
+        )
+        return rows[0] if rows else None
 
     def record_session_end(self, session_id, end_time, duration):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                '''
-                UPDATE playback_history
-                SET end_time = ?, duration = ?
-                WHERE session_id = ? AND end_time IS NULL
-                ''',
-                (
-                    end_time.strftime('%Y-%m-%d %H:%M:%S'),
-                    duration,
-                    session_id,
-                ),
-            )
-            conn.commit()
+        self._write(
+            self.SESSION_END_SQL,
+            (
+                end_time.strftime('%Y-%m-%d %H:%M:%S'),
+                duration,
+                session_id,
+            ),
+        )
 
     def log_security_event(self, log_data):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                '''
-                INSERT INTO security_log
-                (timestamp, user_id, username, trigger_ip, active_sessions, action)
-                VALUES (?,?,?,?,?,?)
-                ''',
-                (
-                    log_data['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
-                    log_data['user_id'],
-                    log_data['username'],
-                    log_data['trigger_ip'],
-                    log_data['active_sessions'],
-                    log_data['action'],
-                ),
-            )
-            conn.commit()
+        self._write(
+            self.SECURITY_EVENT_SQL,
+            (
+                log_data['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
+                log_data['user_id'],
+                log_data['username'],
+                log_data['trigger_ip'],
+                log_data['active_sessions'],
+                log_data['action'],
+            ),
+        )
 
     def set_user_expiry(self, user_id, expiry_date, never_expire=False):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             conn.execute(
                 '''
                 INSERT INTO user_expiry (user_id, expiry_date, never_expire, updated_at)
@@ -274,7 +350,7 @@ class DatabaseManager:
             conn.commit()
 
     def set_user_never_expire(self, user_id, never_expire=True):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             conn.execute(
                 '''
                 INSERT INTO user_expiry (user_id, never_expire, updated_at)
@@ -288,7 +364,7 @@ class DatabaseManager:
             conn.commit()
 
     def get_user_expiry(self, user_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             cursor = conn.execute(
                 'SELECT expiry_date, never_expire FROM user_expiry WHERE user_id = ?',
                 (user_id,),
@@ -299,7 +375,7 @@ class DatabaseManager:
             return None
 
     def is_user_never_expire(self, user_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             cursor = conn.execute(
                 'SELECT never_expire FROM user_expiry WHERE user_id = ?',
                 (user_id,),
@@ -308,7 +384,7 @@ class DatabaseManager:
             return bool(result[0]) if result else False
 
     def get_all_expired_users(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             cursor = conn.execute(
                 '''
                 SELECT user_id FROM user_expiry
@@ -320,12 +396,12 @@ class DatabaseManager:
             return [row[0] for row in cursor.fetchall()]
 
     def clear_user_expiry(self, user_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             conn.execute('DELETE FROM user_expiry WHERE user_id = ?', (user_id,))
             conn.commit()
 
     def create_user_group(self, group_id, name):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             conn.execute(
                 '''
                 INSERT INTO user_groups (group_id, name, updated_at)
@@ -336,13 +412,13 @@ class DatabaseManager:
             conn.commit()
 
     def delete_user_group(self, group_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             conn.execute('DELETE FROM user_group_members WHERE group_id = ?', (group_id,))
             conn.execute('DELETE FROM user_groups WHERE group_id = ?', (group_id,))
             conn.commit()
 
     def get_all_user_groups(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             cursor = conn.execute('SELECT group_id, name FROM user_groups ORDER BY created_at')
             groups = []
             for group_id, name in cursor.fetchall():
@@ -355,7 +431,7 @@ class DatabaseManager:
             return groups
 
     def add_user_to_group(self, group_id, user_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             try:
                 conn.execute(
                     '''
@@ -370,7 +446,7 @@ class DatabaseManager:
                 return False
 
     def remove_user_from_group(self, group_id, user_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             conn.execute(
                 'DELETE FROM user_group_members WHERE group_id = ? AND user_id = ?',
                 (group_id, user_id),
@@ -378,7 +454,7 @@ class DatabaseManager:
             conn.commit()
 
     def get_group_members(self, group_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             cursor = conn.execute(
                 'SELECT user_id FROM user_group_members WHERE group_id = ?',
                 (group_id,),
@@ -393,7 +469,7 @@ class DatabaseManager:
         expires_at = datetime.now() + timedelta(hours=int(valid_hours))
         code = None
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             for _ in range(10):
                 candidate = self._generate_invite_code(8)
                 exists = conn.execute('SELECT 1 FROM invites WHERE code = ?', (candidate,)).fetchone()
@@ -425,7 +501,7 @@ class DatabaseManager:
         return self.get_invite_by_code(code)
 
     def get_invite_by_code(self, code):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             cursor = conn.execute(
                 '''
                 SELECT code, expires_at, max_uses, used_count, group_id,
@@ -451,7 +527,7 @@ class DatabaseManager:
             }
 
     def consume_invite(self, code):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             conn.execute(
                 '''
                 UPDATE invites
@@ -466,7 +542,7 @@ class DatabaseManager:
             return True
 
     def list_invites(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             cursor = conn.execute(
                 '''
                 SELECT code, expires_at, max_uses, used_count, group_id,
@@ -492,7 +568,7 @@ class DatabaseManager:
             ]
 
     def delete_invite(self, code):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             conn.execute(
                 'UPDATE invites SET is_active = 0, updated_at = CURRENT_TIMESTAMP WHERE code = ?',
                 (code,),
@@ -519,7 +595,7 @@ class DatabaseManager:
         if not ip_address:
             return None
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             cursor = conn.execute(
                 '''
                 SELECT provider, ip_address, location, district, street, isp,
@@ -545,11 +621,103 @@ class DatabaseManager:
                 }
             return None
 
+    def get_ip_locations(self, ip_addresses):
+        """批量读取IP归属地缓存，返回 {ip: 归属地信息}"""
+        ip_addresses = list(dict.fromkeys(ip for ip in ip_addresses if ip))
+        locations = {}
+        with self._db.connect() as conn:
+            # 分批查询，避免超过 SQLite 的参数个数上限
+            for offset in range(0, len(ip_addresses), 500):
+                chunk = ip_addresses[offset:offset + 500]
+                cursor = conn.execute(
+                    f'''
+                    SELECT provider, ip_address, location, district, street, isp,
+                           latitude, longitude, formatted
+                    FROM ip_location_cache
+                    WHERE ip_address IN ({','.join('?' * len(chunk))})
+                    ''',
+                    chunk,
+                )
+                for row in cursor.fetchall():
+                    locations[row[1]] = {
+                        'provider': row[0],
+                        'ip': row[1],
+                        'location': row[2],
+                        'district': row[3],
+                        'street': row[4],
+                        'isp': row[5],
+                        'latitude': row[6],
+                        'longitude': row[7],
+                        'formatted': row[8],
+                        'ts': int(datetime.now().timestamp()),
+                    }
+        return locations
+
+    def get_all_ip_locations(self, provider=None):
+        """读取全部IP归属地缓存记录（可按数据源过滤），用于构建内存网段索引"""
+        sql = '''
+            SELECT provider, ip_address, location, district, street, isp,
+                   latitude, longitude, formatted
+            FROM ip_location_cache
+        '''
+        params = ()
+        if provider:
+            sql += ' WHERE provider = ?'
+            params = (provider,)
+        with self._db.connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [
+            {
+                'provider': row[0],
+                'ip': row[1],
+                'location': row[2],
+                'district': row[3],
+                'street': row[4],
+                'isp': row[5],
+                'latitude': row[6],
+                'longitude': row[7],
+                'formatted': row[8],
+            }
+            for row in rows
+        ]
+
+    def get_recent_ip_locations(self, limit, provider=None):
+        """按最近更新时间倒序读取最多 limit 条IP归属地缓存，用于启动时预热内存缓存"""
+        sql = '''
+            SELECT provider, ip_address, location, district, street, isp,
+                   latitude, longitude, formatted
+            FROM ip_location_cache
+        '''
+        params = []
+        if provider:
+            sql += ' WHERE provider = ?'
+            params.append(provider)
+        sql += ' ORDER BY updated_at DESC, id DESC LIMIT ?'
+        params.append(int(limit))
+        with self._db.connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        ts = int(datetime.now().timestamp())
+        return [
+            {
+                'provider': row[0],
+                'ip': row[1],
+                'location': row[2],
+                'district': row[3],
+                'street': row[4],
+                'isp': row[5],
+                'latitude': row[6],
+                'longitude': row[7],
+                'formatted': row[8],
+                'ts': ts,
+            }
+            for row in rows
+        ]
+
     def save_ip_location(self, location_info):
         if not location_info or not location_info.get('ip'):
             return False
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             conn.execute(
                 '''
                 INSERT INTO ip_location_cache (
@@ -582,8 +750,47 @@ class DatabaseManager:
             conn.commit()
             return True
 
+    def add_geocache_outbox(self, payloads):
+        """将待上报 GeoCache 的记录写入发件箱"""
+        with self._db.connect(write=True) as conn:
+            conn.executemany(
+                'INSERT INTO geocache_outbox (payload) VALUES (?)',
+                [(json.dumps(payload, ensure_ascii=False),) for payload in payloads],
+            )
+            conn.commit()
+
+    def get_geocache_outbox(self, limit=50):
+        """按写入顺序读取待上报记录，返回 [(id, payload, attempts)]"""
+        with self._db.connect() as conn:
+            cursor = conn.execute(
+                'SELECT id, payload, attempts FROM geocache_outbox ORDER BY id LIMIT ?',
+                (limit,),
+            )
+            return [(row[0], json.loads(row[1]), row[2]) for row in cursor.fetchall()]
+
+    def count_geocache_outbox(self):
+        with self._db.connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM geocache_outbox').fetchone()[0]
+
+    def delete_geocache_outbox(self, ids):
+        if not ids:
+            return
+        with self._db.connect(write=True) as conn:
+            conn.executemany('DELETE FROM geocache_outbox WHERE id = ?', [(record_id,) for record_id in ids])
+            conn.commit()
+
+    def mark_geocache_outbox_failed(self, ids, error):
+        if not ids:
+            return
+        with self._db.connect(write=True) as conn:
+            conn.executemany(
+                'UPDATE geocache_outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?',
+                [(error, record_id) for record_id in ids],
+            )
+            conn.commit()
+
     def cleanup_old_ip_locations(self, days=30):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             cursor = conn.execute(
                 '''
                 DELETE FROM ip_location_cache
@@ -595,28 +802,192 @@ class DatabaseManager:
             conn.commit()
             return deleted_count
 
-    def get_security_logs(self, limit=100):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.execute(
-                '''
-                SELECT id, timestamp, user_id, username, trigger_ip, active_sessions, action
-                FROM security_log
-                ORDER BY timestamp ASC
+    def get_security_logs(self, limit=100, include_archive=False):
+        sql = '''
+            SELECT id, timestamp, user_id, username, trigger_ip, active_sessions, action
+            FROM security_log
+            ORDER BY timestamp ASC
+            LIMIT ?
+        '''
+        # 按时间正序：归档中的记录更早，先从最早的归档读起
+        rows = self._read_archives(sql, (), limit, newest_first=False) if include_archive else []
+        if len(rows) < limit:
+            with self._db.connect() as conn:
+                rows.extend(conn.execute(sql, (limit - len(rows),)).fetchall())
+        return [
+            {
+                'id': row[0],
+                'timestamp': row[1],
+                'user_id': row[2],
+                'username': row[3],
+                'trigger_ip': row[4],
+                'active_sessions': row[5],
+                'action': row[6],
+            }
+            for row in rows
+        ]
+
+    def get_archivable_rows(self, table, columns, time_column, cutoff, limit):
+        """按时间从旧到新读取早于 cutoff 的一批记录（供 history_archive 使用），未结束的会话不归档"""
+        open_filter = ' AND end_time IS NOT NULL' if table == 'playback_history' else ''
+        with self._db.connect() as conn:
+            return conn.execute(
+                f'''
+                SELECT {", ".join(columns)} FROM {table}
+                WHERE {time_column} < ?{open_filter}
+                ORDER BY {time_column}
                 LIMIT ?
                 ''',
-                (limit,),
-            )
-            logs = []
-            for row in cursor.fetchall():
-                logs.append(
-                    {
-                        'id': row[0],
-                        'timestamp': row[1],
-                        'user_id': row[2],
-                        'username': row[3],
-                        'trigger_ip': row[4],
-                        'active_sessions': row[5],
-                        'action': row[6],
-                    }
+                (cutoff, limit),
+            ).fetchall()
+
+    def delete_archived_rows(self, table, ids):
+        if not ids:
+            return
+        with self._db.connect(write=True) as conn:
+            conn.executemany(f'DELETE FROM {table} WHERE id = ?', [(record_id,) for record_id in ids])
+
+    def get_first_history_day(self):
+        """主库播放记录与汇总表中最早的日期（汇总表包含已归档记录的日期）"""
+        with self._db.connect() as conn:
+            row = conn.execute(
+                '''
+                SELECT MIN(day) FROM (
+                    SELECT substr(MIN(start_time), 1, 10) AS day FROM playback_history
+                    UNION ALL
+                    SELECT MIN(day) FROM rollup_hour_day
+                )
+                '''
+            ).fetchone()
+            return row[0] if row else None
+
+    def replace_rollups(self, start_day, end_day, archive_rows=None):
+        """在一个写事务内用主库记录（加上归档库的聚合结果）重新计算 [start_day, end_day) 的汇总"""
+        archive_rows = archive_rows or {}
+        with self._db.connect(write=True) as conn:
+            for table, (columns, _expressions, keys) in ROLLUP_TABLES.items():
+                conn.execute(f'DELETE FROM {table} WHERE day >= ? AND day < ?', (start_day, end_day))
+                conn.execute(
+                    f'INSERT INTO {table} ({columns}, sessions, watch_seconds) {rollup_aggregate_sql(table)}',
+                    (start_day, end_day),
                 )
-            return logs
+                rows = archive_rows.get(table)
+                if rows:
+                    placeholders = ','.join('?' * (len(columns.split(',')) + 2))
+                    conn.executemany(
+                        f'''
+                        INSERT INTO {table} ({columns}, sessions, watch_seconds) VALUES ({placeholders})
+                        ON CONFLICT ({keys}) DO UPDATE SET
+                            sessions = sessions + excluded.sessions,
+                            watch_seconds = watch_seconds + excluded.watch_seconds
+                        ''',
+                        rows,
+                    )
+
+    def get_watch_totals(self, start_day, end_day):
+        """[start_day, end_day) 内的会话数、观看秒数与活跃用户数（读取汇总表）"""
+        with self._db.connect() as conn:
+            sessions, watch_seconds = conn.execute(
+                'SELECT COALESCE(SUM(sessions), 0), COALESCE(SUM(watch_seconds), 0) FROM rollup_hour_day '
+                'WHERE day >= ? AND day < ?',
+                (start_day, end_day),
+            ).fetchone()
+            active_users = conn.execute(
+                'SELECT COUNT(DISTINCT user_id) FROM rollup_user_day WHERE day >= ? AND day < ?',
+                (start_day, end_day),
+            ).fetchone()[0]
+        return sessions, watch_seconds, active_users
+
+    def get_top_users(self, start_day, end_day, limit=10):
+        with self._db.connect() as conn:
+            return conn.execute(
+                '''
+                SELECT user_id, MAX(username), SUM(sessions), SUM(watch_seconds), COUNT(*)
+                FROM rollup_user_day
+                WHERE day >= ? AND day < ?
+                GROUP BY user_id
+                ORDER BY 4 DESC
+                LIMIT ?
+                ''',
+                (start_day, end_day, limit),
+            ).fetchall()
+
+    def get_top_media(self, start_day, end_day, limit=10):
+        with self._db.connect() as conn:
+            return conn.execute(
+                '''
+                SELECT media_name, SUM(sessions), SUM(watch_seconds)
+                FROM rollup_media_day
+                WHERE day >= ? AND day < ? AND media_name != ''
+                GROUP BY media_name
+                ORDER BY 3 DESC
+                LIMIT ?
+                ''',
+                (start_day, end_day, limit),
+            ).fetchall()
+
+    def get_client_mix(self, start_day, end_day, limit=50):
+        with self._db.connect() as conn:
+            return conn.execute(
+                '''
+                SELECT client_type, device_name, SUM(sessions), SUM(watch_seconds)
+                FROM rollup_client_day
+                WHERE day >= ? AND day < ?
+                GROUP BY client_type, device_name
+                ORDER BY 4 DESC
+                LIMIT ?
+                ''',
+                (start_day, end_day, limit),
+            ).fetchall()
+
+    def get_daily_activity(self, start_day, end_day):
+        """每天的活跃用户数、会话数与观看秒数"""
+        with self._db.connect() as conn:
+            return conn.execute(
+                '''
+                SELECT day, COUNT(*), SUM(sessions), SUM(watch_seconds)
+                FROM rollup_user_day
+                WHERE day >= ? AND day < ?
+                GROUP BY day
+                ORDER BY day
+                ''',
+                (start_day, end_day),
+            ).fetchall()
+
+    def get_hourly_distribution(self, start_day, end_day):
+        with self._db.connect() as conn:
+            return conn.execute(
+                '''
+                SELECT hour, SUM(sessions), SUM(watch_seconds)
+                FROM rollup_hour_day
+                WHERE day >= ? AND day < ?
+                GROUP BY hour
+                ORDER BY hour
+                ''',
+                (start_day, end_day),
+            ).fetchall()
+
+    def get_session_intervals(self, range_start, range_end, lookback_start):
+        """与 [range_start, range_end) 有重叠的会话 [(id, 开始, 结束或空)]，包括对应月份归档库中的记录
+
+        只读取开始时间不早于 lookback_start 的会话（走 start_time 索引），更早开始的超长会话不计入。
+        主库中结束时间为空的记录都是当前进程正在跟踪的会话（结束为空，表示进行中）：
+        上次运行遗留的未结束记录已在启动时由 close_orphaned_sessions 标记结束。
+        """
+        sql = '''
+            SELECT id, start_time, end_time FROM playback_history
+            WHERE start_time >= ? AND start_time < ? AND (end_time IS NULL OR end_time > ?)
+        '''
+        params = (lookback_start, range_end, range_start)
+        # 归档进行中同一条记录可能同时出现在主库和归档库，按 id 去重
+        intervals = {}
+        for month, path in list_archives(self.archive_dir, newest_first=False):
+            if lookback_start[:7] <= month <= range_end[:7]:
+                conn = connect_archive(path)
+                try:
+                    intervals.update((row[0], row) for row in conn.execute(sql, params) if row[2] is not None)
+                finally:
+                    conn.close()
+        with self._db.connect() as conn:
+            intervals.update((row[0], row) for row in conn.execute(sql, params))
+        return list(intervals.values())
@@ -1,5 +1,7 @@
 import copy
 import logging
+import threading
+import time
 
 import requests
 
@@ -7,26 +9,83 @@ logger = logging.getLogger(__name__)
 
 
 class EmbyClient:
-    def __init__(self, server_url, api_key):
+    def __init__(self, server_url, api_key, user_cache_ttl=300):
         self.server_url = server_url.rstrip('/')
         self.api_key = api_key
         self.session = requests.Session()
         self.session.headers.update({'X-Emby-Token': self.api_key})
 
+        # 用户信息缓存: user_id -> (过期时间(monotonic), 用户信息)；读写都使用副本，调用方可以修改返回值
+        self.user_cache_ttl = user_cache_ttl
+        self._user_cache = {}
+        # 批量刷新后仍不存在的用户（如已删除但会话仍在列表中）: user_id -> 过期时间，期间不再触发批量刷新
+        self._missing_users = {}
+        self._user_cache_lock = threading.Lock()
+
     def get_session(self):
         return self.session
 
-    def get_user_info(self, user_id):
+    def get_user_info(self, user_id, use_cache=True):
+        if use_cache:
+            with self._user_cache_lock:
+                cached = self._user_cache.get(user_id)
+            if cached and cached[0] > time.monotonic():
+                return copy.deepcopy(cached[1])
+
         try:
             response = self.session.get(
                 f"{self.server_url}/emby/Users/{user_id}",
                 timeout=3
             )
-            return response.json()
+            user_info = response.json()
         except Exception as e:
             logger.warning('获取用户信息失败: user_id=%s, error=%s', user_id, e)
             return {}
 
+        if user_info and user_info.get('Id'):
+            self._cache_users([user_info])
+        return user_info
+
+    def _cache_users(self, users):
+        expires_at = time.monotonic() + self.user_cache_ttl
+        with self._user_cache_lock:
+            for user in users:
+                if user.get('Id'):
+                    self._user_cache[user['Id']] = (expires_at, copy.deepcopy(user))
+                    self._missing_users.pop(user['Id'], None)
+
+    def invalidate_user(self, user_id=None):
+        """使用户信息缓存失效，不传 user_id 时清空全部"""
+        with self._user_cache_lock:
+            if user_id is None:
+                self._user_cache.clear()
+                self._missing_users.clear()
+            else:
+                self._user_cache.pop(user_id, None)
+                self._missing_users.pop(user_id, None)
+
+    def prefetch_users(self, user_ids):
+        """任一用户不在缓存中时，用一次 /emby/Users 请求批量刷新缓存
+
+        刷新后仍不存在的用户在 user_cache_ttl 内不再触发刷新，避免每次轮询都请求全部用户列表。
+        """
+        now = time.monotonic()
+        with self._user_cache_lock:
+            missing = [
+                user_id for user_id in set(user_ids)
+                if (user_id not in self._user_cache or self._user_cache[user_id][0] <= now)
+                and self._missing_users.get(user_id, 0) <= now
+            ]
+        if missing:
+            users = self.get_users()
+            if isinstance(users, list):
+                expires_at = time.monotonic() + self.user_cache_ttl
+                with self._user_cache_lock:
+                    for user_id in missing:
+                        if user_id not in self._user_cache:
+                            self._missing_users[user_id] = expires_at
+        return len(missing)
+
     def get_user_policy(self, user_id):
         try:
             response = self.session.get(
@@ -52,6 +111,7 @@ class EmbyClient:
                 json=clean_policy,
                 timeout=8,
             )
+            self.invalidate_user(user_id)
             if response.status_code not in (200, 204):
                 logger.error('设置用户策略失败: user_id=%s, status_code=%s', user_id, response.status_code)
             return response.status_code in (200, 204)
@@ -126,15 +186,17 @@ class EmbyClient:
         return None
 
     def get_active_sessions(self):
+        """返回 {会话Id: 会话}；请求失败时返回 None（与“当前没有播放”的空字典区分）"""
         try:
             response = self.session.get(
                 f"{self.server_url}/emby/Sessions",
                 timeout=5
             )
+            response.raise_for_status()
             return {s['Id']: s for s in response.json() if s.get('NowPlayingItem')}
         except Exception as e:
             logger.warning('获取活动会话失败: error=%s', e)
-            return {}
+            return None
 
     @staticmethod
     def parse_media_info(item):
@@ -150,7 +212,10 @@ class EmbyClient:
                 f"{self.server_url}/emby/Users",
                 timeout=5
             )
-            return response.json()
+            users = response.json()
+            if isinstance(users, list):
+                self._cache_users(users)
+            return users
         except Exception as e:
             logger.warning('获取用户列表失败: error=%s', e)
             return []
@@ -161,6 +226,7 @@ class EmbyClient:
                 f"{self.server_url}/emby/Users/{user_id}",
                 timeout=8,
             )
+            self.invalidate_user(user_id)
             if response.status_code not in (200, 204):
                 logger.error('删除用户失败: user_id=%s, status_code=%s', user_id, response.status_code)
             return response.status_code in (200, 204)
@@ -0,0 +1,160 @@
+import json
+import logging
+import socket
+import threading
+import time
+from urllib.parse import urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+
+def build_websocket_url(server_url, api_key, device_id='embyq'):
+    """将 Emby 服务器地址转换为 /embywebsocket 订阅地址"""
+    parts = urlsplit(server_url.rstrip('/'))
+    scheme = 'wss' if parts.scheme == 'https' else 'ws'
+    query = urlencode({'api_key': api_key, 'deviceId': device_id})
+    return urlunsplit((scheme, parts.netloc, f"{parts.path}/embywebsocket", query, ''))
+
+
+class EmbySessionStream:
+    """Emby WebSocket 会话事件订阅
+
+    连接后发送 SessionsStart 订阅，把服务器推送的消息转换成统一事件回调：
+      - ('sessions', {session_id: session})  完整会话快照（仅含正在播放的会话）
+      - ('start', session)                   PlaybackStart，Data 为会话对象
+      - ('stop', session_id)                 PlaybackStopped / SessionEnded
+      - ('refresh', None)                    无法直接解析的播放事件，需要主动拉取一次
+
+    ws_url 可以指向本地模拟服务端，便于脱离真实 Emby 测试。
+    """
+
+    SESSION_EVENTS_INTERVAL_MS = 1500
+
+    def __init__(self, server_url, api_key, on_event, ws_url=None, device_id='embyq', reconnect_delay=5, max_reconnect_delay=60):
+        self.ws_url = ws_url or build_websocket_url(server_url, api_key, device_id)
+        self.on_event = on_event
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.connected = False
+        self._ws = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def is_available():
+        try:
+            import websocket  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='emby-websocket', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        ws = self._ws
+        if ws:
+            ws.keep_running = False
+            raw_sock = getattr(ws.sock, 'sock', None)
+            if raw_sock:
+                # 发送关闭帧后只 shutdown 连接，由读线程自己关闭 socket：
+                # 在其他线程 close() 正被 select 的 socket 可能收不到唤醒，读线程要等到 ping 超时才退出
+                try:
+                    ws.sock.send_close()
+                    raw_sock.shutdown(socket.SHUT_RDWR)
+                except Exception:
+                    pass
+            else:
+                try:
+                    ws.close()
+                except Exception:
+                    pass
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        import websocket
+
+        delay = self.reconnect_delay
+        while not self._stop_event.is_set():
+            self._ws = websocket.WebSocketApp(
+                self.ws_url,
+                on_open=self._on_open,
+                on_message=self._on_message,
+                on_error=self._on_error,
+                on_close=self._on_close,
+            )
+            started_at = time.monotonic()
+            try:
+                self._ws.run_forever(ping_interval=30, ping_timeout=10)
+            except Exception as e:
+                logger.warning('Emby WebSocket 运行异常: error=%s', e)
+            self.connected = False
+
+            if self._stop_event.is_set():
+                break
+            # 连接稳定存活过一段时间则重置退避
+            if time.monotonic() - started_at > self.max_reconnect_delay:
+                delay = self.reconnect_delay
+            logger.warning('Emby WebSocket 已断开，%s 秒后重连', delay)
+            self._stop_event.wait(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _send(self, message_type, data=None):
+        payload = {'MessageType': message_type}
+        if data is not None:
+            payload['Data'] = data
+        self._ws.send(json.dumps(payload))
+
+    def _on_open(self, ws):
+        self.connected = True
+        logger.info('Emby WebSocket 已连接: url=%s', self.ws_url.split('?', 1)[0])
+        self._send('SessionsStart', f"0,{self.SESSION_EVENTS_INTERVAL_MS}")
+        # 连接建立后先做一次全量对账，弥补断线期间遗漏的事件
+        self.on_event('refresh', None)
+
+    def _on_close(self, ws, status_code=None, message=None):
+        self.connected = False
+        logger.info('Emby WebSocket 连接关闭: status_code=%s', status_code)
+
+    def _on_error(self, ws, error):
+        logger.warning('Emby WebSocket 错误: error=%s', error)
+
+    def _on_message(self, ws, raw):
+        try:
+            message = json.loads(raw)
+        except (TypeError, ValueError):
+            logger.debug('Emby WebSocket 消息无法解析: %s', raw)
+            return
+
+        message_type = message.get('MessageType')
+        data = message.get('Data')
+
+        if message_type == 'ForceKeepAlive':
+            self._send('KeepAlive')
+        elif message_type == 'Sessions' and isinstance(data, list):
+            self.on_event('sessions', {s['Id']: s for s in data if s.get('Id') and s.get('NowPlayingItem')})
+        elif message_type == 'PlaybackStart':
+            if isinstance(data, dict) and data.get('Id') and data.get('NowPlayingItem'):
+                self.on_event('start', data)
+            else:
+                self.on_event('refresh', None)
+        elif message_type in ('PlaybackStopped', 'SessionEnded'):
+            session_id = self._extract_session_id(data)
+            if session_id:
+                self.on_event('stop', session_id)
+            else:
+                self.on_event('refresh', None)
+
+    @staticmethod
+    def _extract_session_id(data):
+        if isinstance(data, str):
+            return data
+        if not isinstance(data, dict):
+            return None
+        return data.get('SessionId') or (data.get('Session') or {}).get('Id') or data.get('Id')
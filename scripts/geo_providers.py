@@ -0,0 +1,101 @@
+"""IP 归属地查询后端
+
+LocationService 通过统一的后端接口调用 ip138 / 自建库：
+- InProcessBackend: 直接在进程内调用 qoo-ip138 / ip-hiofd 的 Python API，无需每次启动子进程
+- SubprocessBackend: 调用命令行工具（仅安装了 CLI、无法导入 Python 包时使用）
+
+两种后端返回相同格式的原始数据：
+- query_ip138(ip) -> [(字段名, 值), ...]
+- query_hiofd(ip) -> {"query_ip", "result_ip", "location", "district", "street", "isp", "latitude", "longitude"}
+"""
+
+from __future__ import annotations
+
+import importlib
+import json
+import shutil
+import subprocess
+from typing import Any
+
+
+class SubprocessBackend:
+    name = "subprocess"
+
+    def __init__(self, timeout_sec: int = 45):
+        self.timeout_sec = timeout_sec
+
+    def _run_cmd(self, cmd: list[str]) -> str:
+        if not cmd:
+            raise ValueError("空命令")
+
+        if shutil.which(cmd[0]) is None:
+            raise FileNotFoundError(f"命令未找到: {cmd[0]}")
+
+        proc = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            timeout=self.timeout_sec,
+            check=False,
+        )
+
+        if proc.returncode != 0:
+            stderr = (proc.stderr or "").strip()
+            stdout = (proc.stdout or "").strip()
+            detail = stderr or stdout or f"exit={proc.returncode}"
+            raise RuntimeError(f"命令执行失败: {' '.join(cmd)} | {detail}")
+
+        return (proc.stdout or "").strip()
+
+    def query_ip138(self, ip_address: str) -> list[tuple[str, str]]:
+        output = self._run_cmd(["qoo-ip138", f"--ip={ip_address}"])
+        pairs = []
+        for raw_line in output.splitlines():
+            line = raw_line.strip()
+            if not line or (":" not in line and "：" not in line):
+                continue
+            sep = "：" if "：" in line else ":"
+            key, value = line.rsplit(sep, 1)
+            pairs.append((key.strip(), value.strip()))
+        return pairs
+
+    def query_hiofd(self, ip_address: str) -> dict[str, Any]:
+        output = self._run_cmd(["ip-hiofd", "--ip", ip_address, "--json"])
+        return json.loads(output)
+
+    def close(self) -> None:
+        pass
+
+
+class InProcessBackend:
+    name = "inprocess"
+
+    def __init__(self, timeout_sec: int = 45):
+        self.timeout_sec = timeout_sec
+        # 任一包缺失都会在这里抛出 ImportError，由 create_backend 回退到子进程后端
+        self._qoo_ip138 = importlib.import_module("qoo_ip138").qoo_ip138
+        self._hiofd_client = importlib.import_module("ip_hiofd").HiofdIpClient()
+
+    def query_ip138(self, ip_address: str) -> list[tuple[str, str]]:
+        result = self._qoo_ip138(ip_address) or {}
+        return [(str(key).strip(), str(value).strip()) for key, value in result.items()]
+
+    def query_hiofd(self, ip_address: str) -> dict[str, Any]:
+        # 重试由 LocationService 统一控制，这里只查询一次
+        result = self._hiofd_client.lookup(ip_address, timeout_sec=self.timeout_sec, retries=1)
+        return dict(result.__dict__)
+
+    def close(self) -> None:
+        pass
+
+
+def create_backend(kind: str = "auto", timeout_sec: int = 45):
+    """创建查询后端；auto 优先进程内调用，Python 包不可用时回退为子进程"""
+    if kind == "subprocess":
+        return SubprocessBackend(timeout_sec)
+    try:
+        return InProcessBackend(timeout_sec)
+    except ImportError:
+        if kind == "inprocess":
+            raise
+        return SubprocessBackend(timeout_sec)
@@ -1,6 +1,8 @@
 import base64
 import logging
 import os
+import queue
+import threading
 import time
 from typing import Any
 
@@ -38,6 +40,8 @@ class GeoCacheClient:
         self.timeout = timeout
         self.enabled = True
         self.emby_server_info = emby_server_info or {}
+        # 复用连接，批量上报时避免每条记录都重新建立 TCP/TLS 连接
+        self.session = requests.Session()
 
     def update_config(self, base_url: str = None, api_key: str = None):
         """更新配置"""
@@ -71,9 +75,35 @@ class GeoCacheClient:
         if not self.enabled:
             return False
 
-        if not ip:
+        payload = self.build_report_payload(
+            {
+                "ip": ip,
+                "location": location,
+                "district": district,
+                "street": street,
+                "isp": isp,
+                "latitude": latitude,
+                "longitude": longitude,
+            },
+            provider=provider,
+            client_version=client_version,
+        )
+        if not payload:
             return False
 
+        try:
+            self.send_report(payload)
+            return True
+        except requests.exceptions.RequestException as e:
+            logger.warning('GeoCache 提交失败: ip=%s, error=%s', ip, e)
+            return False
+
+    def build_report_payload(self, location_info: dict[str, Any], provider: str = None,
+                             client_version: str = None) -> dict[str, Any] | None:
+        """由位置信息字典生成上报内容，缺少 IP 时返回 None"""
+        if not location_info or not location_info.get("ip"):
+            return None
+
         # 如果未提供provider，则使用Emby服务器信息生成
         if provider is None:
             server_name = self.emby_server_info.get('ServerName', 'EmbyServer')
@@ -84,37 +114,31 @@ class GeoCacheClient:
         if client_version is None:
             client_version = f"EmbyQ v{_get_version()}"
 
-        url = f"{self.base_url}/v1/ip/report"
-
-        payload = {
-            "ip": ip,
-            "location": location,
-            "district": district,
-            "street": street,
-            "isp": isp,
-            "latitude": latitude,
-            "longitude": longitude,
+        return {
+            "ip": location_info["ip"],
+            "location": location_info.get("location"),
+            "district": location_info.get("district"),
+            "street": location_info.get("street"),
+            "isp": location_info.get("isp"),
+            "latitude": location_info.get("latitude"),
+            "longitude": location_info.get("longitude"),
             "provider": provider,
             "client_version": client_version
         }
 
+    def send_report(self, payload: dict[str, Any]) -> None:
+        """提交一条上报内容，失败时抛出 requests 异常"""
         headers = {
             "Content-Type": "application/json",
             "X-API-Key": self.api_key
         }
-
-        try:
-            response = requests.post(
-                url,
-                json=payload,
-                headers=headers,
-                timeout=self.timeout
-            )
-            response.raise_for_status()
-            return True
-        except requests.exceptions.RequestException as e:
-            logger.warning('GeoCache 提交失败: ip=%s, error=%s', ip, e)
-            return False
+        response = self.session.post(
+            f"{self.base_url}/v1/ip/report",
+            json=payload,
+            headers=headers,
+            timeout=self.timeout
+        )
+        response.raise_for_status()
 
     def report_location_info(self, location_info: dict[str, Any]) -> bool:
         """
@@ -149,6 +173,14 @@ class GeoCacheClient:
         Returns:
             dict: 归属地信息字典，查询失败返回 None
         """
+        try:
+            return self.query_ip(ip)
+        except requests.exceptions.RequestException as e:
+            logger.warning('GeoCache 查询失败: ip=%s, error=%s', ip, e)
+            return None
+
+    def query_ip(self, ip: str, timeout: float = None) -> dict[str, Any] | None:
+        """查询 IP 归属地，未命中返回 None，请求失败时抛出 requests 异常（供熔断器统计）"""
         if not self.enabled:
             return None
 
@@ -157,34 +189,35 @@ class GeoCacheClient:
 
         url = f"{self.base_url}/v1/ip/lookup"
 
+        response = self.session.get(
+            url,
+            params={"ip": ip},
+            timeout=timeout or self.timeout
+        )
+        response.raise_for_status()
         try:
-            response = requests.get(
-                url,
-                params={"ip": ip},
-                timeout=self.timeout
-            )
-            response.raise_for_status()
             data = response.json()
-
-            if data.get("found"):
-                logger.debug('GeoCache 查询命中: ip=%s, location=%s', ip, data.get('location'))
-                return {
-                    "provider": "geocache",
-                    "ip": data.get("ip"),
-                    "location": data.get("location"),
-                    "district": data.get("district"),
-                    "street": data.get("street"),
-                    "isp": data.get("isp"),
-                    "latitude": data.get("latitude"),
-                    "longitude": data.get("longitude"),
-                    "formatted": "",  # GeoCache 不提供格式化信息，由调用方处理
-                    "ts": int(time.time())
-                }
-            logger.debug('GeoCache 查询未命中: ip=%s', ip)
-            return None
-        except requests.exceptions.RequestException as e:
-            logger.warning('GeoCache 查询失败: ip=%s, error=%s', ip, e)
-            return None
+        except ValueError as e:
+            raise requests.exceptions.RequestException(f"响应不是有效的 JSON: {e}") from e
+        if not isinstance(data, dict):
+            raise requests.exceptions.RequestException(f"响应格式错误: {type(data).__name__}")
+
+        if data.get("found"):
+            logger.debug('GeoCache 查询命中: ip=%s, location=%s', ip, data.get('location'))
+            return {
+                "provider": "geocache",
+                "ip": data.get("ip"),
+                "location": data.get("location"),
+                "district": data.get("district"),
+                "street": data.get("street"),
+                "isp": data.get("isp"),
+                "latitude": data.get("latitude"),
+                "longitude": data.get("longitude"),
+                "formatted": "",  # GeoCache 不提供格式化信息，由调用方处理
+                "ts": int(time.time())
+            }
+        logger.debug('GeoCache 查询未命中: ip=%s', ip)
+        return None
 
     def health_check(self) -> bool:
         """
@@ -205,3 +238,172 @@ class GeoCacheClient:
             return data.get("ok", False)
         except requests.exceptions.RequestException:
             return False
+
+
+def _is_retryable(error: requests.exceptions.RequestException) -> bool:
+    """网络错误、5xx 以及 408/429 可以稍后重试，其余 4xx 说明记录本身被拒绝"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return True
+    status = response.status_code
+    return not 400 <= status < 500 or status in (408, 429)
+
+
+class GeoCacheReporter:
+    """GeoCache 异步批量上报
+
+    report() 只把记录放入有界内存队列（满则丢弃并计数）；后台线程定期把队列内容写入 SQLite 发件箱，
+    再按批次通过复用连接的 session 上报，成功后从发件箱删除。网络错误或 5xx/408/429 时按指数退避暂停，
+    发件箱中的记录在重启后继续上报，超过最大尝试次数的记录被丢弃；其余 4xx 表示记录本身被服务端拒绝，
+    重试也不会成功，直接丢弃并继续上报后面的记录，不退避。
+    """
+
+    def __init__(self, client: GeoCacheClient, db_manager=None, queue_size: int = 1000, batch_size: int = 50,
+                 flush_interval: float = 5.0, max_attempts: int = 10, max_backoff: float = 300.0):
+        self.client = client
+        self.db_manager = db_manager
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.discarded = 0
+        self.rejected = 0
+        self.backoff = 0.0
+        self.last_error = None
+
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='geocache-reporter', daemon=True)
+        self._thread.start()
+
+    def report(self, location_info: dict[str, Any]) -> bool:
+        payload = self.client.build_report_payload(location_info)
+        if not payload:
+            return False
+        try:
+            self._queue.put_nowait(payload)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def stop(self, timeout: float = None) -> None:
+        """停止后台线程；等待时间不少于一次上报请求的超时，确保进行中的请求能够结束"""
+        self._stop.set()
+        # 先把内存队列写入发件箱：即使后台线程卡在上报请求上、等待超时，这些记录也不会丢失
+        self._save_queue()
+        self._thread.join(timeout=max(timeout or 0, self.client.timeout))
+
+    def stats(self) -> dict[str, Any]:
+        pending = self._queue.qsize()
+        if self.db_manager:
+            try:
+                pending += self.db_manager.count_geocache_outbox()
+            except Exception:
+                pass
+        return {
+            'pending': pending,
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'discarded': self.discarded,
+            'rejected': self.rejected,
+            'backoff_seconds': self.backoff,
+            'last_error': self.last_error,
+        }
+
+    def _drain(self) -> list[dict[str, Any]]:
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.backoff or self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning('GeoCache 上报任务异常: error=%s', e)
+        self._save_queue()
+
+    def _save_queue(self) -> None:
+        """把内存中尚未上报的记录写入发件箱，下次启动继续上报"""
+        if not self.db_manager:
+            return
+        items = self._drain()
+        if items:
+            try:
+                self.db_manager.add_geocache_outbox(items)
+            except Exception as e:
+                logger.warning('GeoCache 发件箱写入失败: count=%s, error=%s', len(items), e)
+
+    def flush(self) -> int:
+        """上报一轮，返回成功条数"""
+        items = self._drain()
+        if not self.db_manager:
+            batch = [(None, payload, 0) for payload in items]
+            return self._send_batch(batch)
+
+        if items:
+            self.db_manager.add_geocache_outbox(items)
+
+        total = 0
+        while not self._stop.is_set():
+            batch = self.db_manager.get_geocache_outbox(self.batch_size)
+            sent = self._send_batch(batch)
+            total += sent
+            # 本批没有需要重试的失败且可能还有积压时继续，否则等待下一轮
+            if not batch or self.backoff or len(batch) < self.batch_size:
+                break
+        return total
+
+    def _send_batch(self, batch) -> int:
+        sent = 0
+        done_ids = []
+        for index, (record_id, payload, attempts) in enumerate(batch):
+            if record_id is not None and self._stop.is_set():
+                # 停止时不再上报本批剩余记录，它们仍在发件箱中
+                break
+            try:
+                self.client.send_report(payload)
+            except requests.exceptions.RequestException as e:
+                if not _is_retryable(e):
+                    self.rejected += 1
+                    self.last_error = str(e)
+                    logger.warning('GeoCache 拒绝上报记录，已丢弃: ip=%s, error=%s', payload.get('ip'), e)
+                    if record_id is not None:
+                        done_ids.append(record_id)
+                    continue
+                self.failed += 1
+                self.last_error = str(e)
+                self.backoff = min(max(self.backoff * 2, self.flush_interval), self.max_backoff)
+                logger.warning('GeoCache 上报失败，%.0f秒后重试: ip=%s, error=%s', self.backoff, payload.get('ip'), e)
+                if record_id is None:
+                    # 无发件箱时把未上报的记录放回内存队列
+                    for _, pending_payload, _ in batch[index:]:
+                        try:
+                            self._queue.put_nowait(pending_payload)
+                        except queue.Full:
+                            self.dropped += 1
+                elif attempts + 1 >= self.max_attempts:
+                    self.discarded += 1
+                    done_ids.append(record_id)
+                else:
+                    self.db_manager.mark_geocache_outbox_failed([record_id], str(e))
+                break
+            sent += 1
+            self.sent += 1
+            if record_id is not None:
+                done_ids.append(record_id)
+        else:
+            self.backoff = 0.0
+
+        if done_ids:
+            self.db_manager.delete_geocache_outbox(done_ids)
+        return sent
@@ -0,0 +1,194 @@
+"""播放记录与安全日志的保留期归档
+
+超过保留天数的记录按月份移入归档库 data/archive/history-YYYY-MM.db（与主库相同的表结构，保留原 id），
+每批先写入归档库并提交，再在主库中用一个短事务删除这一批，批次之间暂停片刻，不长时间占用主库写锁。
+写入归档库使用 INSERT OR IGNORE，删除前中断时下次重复归档同一批记录不会产生重复数据。
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FILE_PATTERN = re.compile(r'^history-(\d{4}-\d{2})\.db$')
+
+# 表名 -> (时间列, 归档的列)
+ARCHIVE_TABLES = {
+    'playback_history': (
+        'start_time',
+        (
+            'id', 'session_id', 'user_id', 'username', 'ip_address', 'device_name', 'client_type',
+            'media_name', 'start_time', 'end_time', 'duration', 'location',
+        ),
+    ),
+    'security_log': (
+        'timestamp',
+        ('id', 'timestamp', 'user_id', 'username', 'trigger_ip', 'active_sessions', 'action'),
+    ),
+}
+
+ARCHIVE_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS playback_history (
+        id INTEGER PRIMARY KEY,
+        session_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        username TEXT NOT NULL,
+        ip_address TEXT NOT NULL,
+        device_name TEXT,
+        client_type TEXT,
+        media_name TEXT,
+        start_time DATETIME NOT NULL,
+        end_time DATETIME,
+        duration INTEGER,
+        location TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS security_log (
+        id INTEGER PRIMARY KEY,
+        timestamp DATETIME,
+        user_id TEXT,
+        username TEXT,
+        trigger_ip TEXT,
+        active_sessions INTEGER,
+        action TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_playback_history_user_start ON playback_history(user_id, start_time)',
+    'CREATE INDEX IF NOT EXISTS idx_playback_history_username_start ON playback_history(username, start_time)',
+    'CREATE INDEX IF NOT EXISTS idx_security_log_user_action ON security_log(user_id, action, timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_security_log_username_action ON security_log(username, action, timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_security_log_timestamp ON security_log(timestamp)',
+)
+
+
+def list_archives(archive_dir, newest_first=True):
+    """返回 [(月份, 路径)]，默认按月份从新到旧"""
+    if not archive_dir or not os.path.isdir(archive_dir):
+        return []
+    archives = []
+    for name in os.listdir(archive_dir):
+        match = ARCHIVE_FILE_PATTERN.match(name)
+        if match:
+            archives.append((match.group(1), os.path.join(archive_dir, name)))
+    return sorted(archives, reverse=newest_first)
+
+
+def connect_archive(path, readonly=True):
+    if readonly:
+        return sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    for statement in ARCHIVE_SCHEMA:
+        conn.execute(statement)
+    return conn
+
+
+def _month_of(value):
+    value = str(value or '')
+    # 时间格式异常的记录归入 0000-00，仍可被跨归档查询读到
+    return value[:7] if re.match(r'^\d{4}-\d{2}', value) else '0000-00'
+
+
+class HistoryArchiver:
+    def __init__(self, db_manager):
+        self.db = db_manager
+        self.enabled = False
+        self.retention_days = {'playback_history': 365, 'security_log': 365}
+        self.batch_size = 500
+        self.max_batches = 200
+        self.batch_pause = 0.05
+        self.last_run = None
+        self.total_archived = {table: 0 for table in ARCHIVE_TABLES}
+        self._lock = threading.Lock()
+
+    def configure(self, archive_config):
+        self.enabled = bool(archive_config.get('enabled', False))
+        self.retention_days = {
+            'playback_history': int(archive_config.get('playback_retention_days', 365)),
+            'security_log': int(archive_config.get('security_retention_days', 365)),
+        }
+        self.batch_size = max(int(archive_config.get('batch_size', 500)), 1)
+        self.max_batches = max(int(archive_config.get('max_batches', 200)), 1)
+        self.batch_pause = float(archive_config.get('batch_pause', 0.05))
+
+    def run(self):
+        """归档各表超过保留期的记录，每次最多 max_batches 批，剩余的留到下次；返回各表归档条数"""
+        if not self._lock.acquire(blocking=False):
+            return {}
+        try:
+            started = time.monotonic()
+            archived = {}
+            for table, days in self.retention_days.items():
+                if days <= 0:
+                    continue
+                cutoff = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+                archived[table] = self._archive_table(table, cutoff)
+                self.total_archived[table] += archived[table]
+            elapsed = time.monotonic() - started
+            self.last_run = {
+                'finished_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'archived': archived,
+                'elapsed_sec': round(elapsed, 2),
+            }
+            if any(archived.values()):
+                logger.info('历史记录归档完成: %s，耗时 %.1fs', archived, elapsed)
+            return archived
+        finally:
+            self._lock.release()
+
+    def _archive_table(self, table, cutoff):
+        time_column, columns = ARCHIVE_TABLES[table]
+        placeholders = ','.join('?' * len(columns))
+        insert_sql = f'INSERT OR IGNORE INTO {table} ({",".join(columns)}) VALUES ({placeholders})'
+        time_index = columns.index(time_column)
+        total = 0
+        for _ in range(self.max_batches):
+            rows = self.db.get_archivable_rows(table, columns, time_column, cutoff, self.batch_size)
+            if not rows:
+                break
+
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(_month_of(row[time_index]), []).append(row)
+            for month, month_rows in by_month.items():
+                path = os.path.join(self.db.archive_dir, f'history-{month}.db')
+                conn = connect_archive(path, readonly=False)
+                try:
+                    with conn:
+                        conn.executemany(insert_sql, month_rows)
+                finally:
+                    conn.close()
+
+            self.db.delete_archived_rows(table, [row[0] for row in rows])
+            total += len(rows)
+            if len(rows) < self.batch_size:
+                break
+            # 让出主库写锁，监控线程的写入可以插在批次之间
+            time.sleep(self.batch_pause)
+        return total
+
+    @contextmanager
+    def exclusive(self):
+        """等待进行中的归档结束，并在 with 块内暂停归档（供需要主库与归档库一致视图的任务使用）"""
+        with self._lock:
+            yield
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'retention_days': self.retention_days,
+            'archives': [
+                {'month': month, 'size_bytes': os.path.getsize(path)}
+                for month, path in list_archives(self.db.archive_dir)
+            ],
+            'total_archived': dict(self.total_archived),
+            'last_run': self.last_run,
+        }
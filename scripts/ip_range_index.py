@@ -0,0 +1,125 @@
+"""基于 ip_location_cache 构建的内存 IP 网段索引
+
+已解析 IP 按网段（IPv4 /24、IPv6 /64）归并，网段前缀以整数形式有序存放在 array 中，
+查询时用 bisect 定位，命中且满足置信度策略的网段可直接返回归属地，无需再调用外部命令。
+"""
+
+from __future__ import annotations
+
+import bisect
+import threading
+from array import array
+from typing import Any
+
+from ip_utils import FAMILY_IPV4, FAMILY_IPV6, parse_ip
+
+# 网段内出现不一致归属地时的样本数标记，此类网段不再参与前缀匹配
+INCONSISTENT = 0
+
+
+class IPRangeIndex:
+    def __init__(self, ipv4_prefix: int = 24, ipv6_prefix: int = 64, min_samples: int = 2, rebuild_threshold: int = 1024):
+        self.host_bits = {FAMILY_IPV4: 32 - ipv4_prefix, FAMILY_IPV6: 128 - ipv6_prefix}
+        self.min_samples = max(int(min_samples), 1)
+        self.rebuild_threshold = rebuild_threshold
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self) -> None:
+        # 每个地址族一组平行数组：网段前缀（升序）、样本数、代表条目下标
+        self._prefixes = {family: array('Q') for family in self.host_bits}
+        self._samples = {family: array('L') for family in self.host_bits}
+        self._entry_ids = {family: array('L') for family in self.host_bits}
+        self._entries: list[dict[str, Any]] = []
+        # 自上次构建以来新增/变化的网段: (family, prefix) -> [样本数, 代表条目]
+        self._overlay: dict[tuple[int, int], list] = {}
+
+    def _block(self, ip: str) -> tuple[int, int] | None:
+        family, value = parse_ip(ip)
+        if family not in self.host_bits:
+            return None
+        return family, value >> self.host_bits[family]
+
+    def _find(self, family: int, prefix: int) -> int:
+        prefixes = self._prefixes[family]
+        pos = bisect.bisect_left(prefixes, prefix)
+        if pos < len(prefixes) and prefixes[pos] == prefix:
+            return pos
+        return -1
+
+    def _get_block(self, family: int, prefix: int) -> list | None:
+        block = self._overlay.get((family, prefix))
+        if block is not None:
+            return block
+        pos = self._find(family, prefix)
+        if pos < 0:
+            return None
+        return [self._samples[family][pos], self._entries[self._entry_ids[family][pos]]]
+
+    @staticmethod
+    def _merge(block: list | None, info: dict[str, Any]) -> list:
+        if block is None:
+            return [1, info]
+        samples, entry = block
+        if samples == INCONSISTENT or entry.get('formatted') != info.get('formatted'):
+            return [INCONSISTENT, entry]
+        # 同一IP重复解析不增加样本数
+        return [samples if entry.get('ip') == info.get('ip') else samples + 1, info]
+
+    def build(self, rows: list[dict[str, Any]]) -> int:
+        """用全部缓存记录重建索引，返回索引的网段数"""
+        blocks: dict[tuple[int, int], list] = {}
+        for info in rows:
+            key = self._block(info.get('ip') or '')
+            if key is not None:
+                blocks[key] = self._merge(blocks.get(key), info)
+        with self._lock:
+            self._clear()
+            self._load(blocks)
+        return len(blocks)
+
+    def _load(self, blocks: dict[tuple[int, int], list]) -> None:
+        for (family, prefix), (samples, entry) in sorted(blocks.items()):
+            self._prefixes[family].append(prefix)
+            self._samples[family].append(samples)
+            self._entry_ids[family].append(len(self._entries))
+            self._entries.append(entry)
+
+    def add(self, info: dict[str, Any]) -> None:
+        """记录一次新的解析结果，积累到一定数量后合并进有序数组"""
+        key = self._block(info.get('ip') or '')
+        if key is None:
+            return
+        with self._lock:
+            self._overlay[key] = self._merge(self._get_block(*key), info)
+            if len(self._overlay) >= self.rebuild_threshold:
+                self._compact()
+
+    def _compact(self) -> None:
+        blocks = {}
+        for family in self.host_bits:
+            for pos, prefix in enumerate(self._prefixes[family]):
+                blocks[(family, prefix)] = [self._samples[family][pos], self._entries[self._entry_ids[family][pos]]]
+        blocks.update(self._overlay)
+        self._clear()
+        self._load(blocks)
+
+    def lookup(self, ip: str) -> dict[str, Any] | None:
+        """返回同网段的代表归属地；网段样本不足或归属地不一致时返回 None"""
+        key = self._block(ip)
+        if key is None:
+            return None
+        with self._lock:
+            block = self._get_block(*key)
+        if block is None or block[0] == INCONSISTENT or block[0] < self.min_samples:
+            return None
+        return block[1]
+
+    def __len__(self) -> int:
+        with self._lock:
+            indexed = sum(len(prefixes) for prefixes in self._prefixes.values())
+            return indexed + sum(1 for key in self._overlay if self._find(*key) < 0)
+
+    def __bool__(self) -> bool:
+        # 定义了 __len__ 时空索引为假值，`if self.range_index:` 会把“尚无网段”误当成“未启用”
+        return True
@@ -0,0 +1,127 @@
+"""IP 端点解析与网络前缀归一化
+
+Emby 会话中的 RemoteEndPoint 会在每次会话开始、告警时被反复解析，这里统一解析一次
+并缓存到有界 LRU 中，监控与 Web 服务共享同一份缓存。
+"""
+
+from __future__ import annotations
+
+import re
+import socket
+from functools import lru_cache
+from typing import NamedTuple
+
+CACHE_SIZE = 4096
+
+FAMILY_UNKNOWN = 0
+FAMILY_IPV4 = 4
+FAMILY_IPV6 = 6
+
+_BRACKET_OR_COLON_RE = re.compile(r'^\[(.*?)\](?::(\d+))?$|^([^%]:*)(?:%[^:]*)?:(?:(\d+))?$')
+_IPV4_PORT_RE = re.compile(r'^(\d+\.\d+\.\d+\.\d+):(\d+)$')
+
+
+class ParsedEndpoint(NamedTuple):
+    ip: str
+    family: int
+    network: str
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_ip(ip: str) -> tuple[int, int]:
+    """解析 IP 字符串，返回 (地址族, 整数值)；无法解析时返回 (FAMILY_UNKNOWN, 0)"""
+    if not ip:
+        return FAMILY_UNKNOWN, 0
+    try:
+        return FAMILY_IPV6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+    except (OSError, ValueError):
+        pass
+    try:
+        return FAMILY_IPV4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except (OSError, ValueError):
+        return FAMILY_UNKNOWN, 0
+
+
+def ip_family(ip: str) -> int:
+    return parse_ip(ip)[0]
+
+
+def ip_type_label(ip: str) -> str:
+    family = ip_family(ip)
+    if family == FAMILY_IPV6:
+        return 'IPv6'
+    if family == FAMILY_IPV4:
+        return 'IPv4'
+    return '未知'
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def network_key(ip: str, ipv6_prefix_length: int) -> str:
+    """同网判断用的网络标识
+
+    IPv6 按配置的前缀长度（security.ipv6_prefix_length，可为 /56、/60 等非 /64 前缀）做整数掩码，
+    返回如 "2409:8a55:9429:9a90::/64"；
+    IPv4 及无法解析的字符串直接返回原值（IPv4 仅在完全相同时视为同一网络）。
+    """
+    family, value = parse_ip(ip)
+    if family != FAMILY_IPV6:
+        return ip
+
+    prefix_length = min(max(int(ipv6_prefix_length), 0), 128)
+    host_bits = 128 - prefix_length
+    masked = (value >> host_bits) << host_bits
+    return f"{socket.inet_ntop(socket.AF_INET6, masked.to_bytes(16, 'big'))}/{prefix_length}"
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def extract_ip(remote_endpoint: str) -> str:
+    """从 RemoteEndPoint 中提取 IP，支持 [IPv6]:port、IPv6%iface、IPv4:port 等格式"""
+    if not remote_endpoint:
+        return ""
+
+    match = _BRACKET_OR_COLON_RE.match(remote_endpoint)
+    if match:
+        # [IPv6]:port 格式
+        if match.group(1):
+            return match.group(1)
+        ip_part = match.group(3)
+        if ip_part:
+            return ip_part
+
+    # 形如 2408:8207:28c:3c01:8c5e:7cff:fe2e:2c8e:8096 的 IPv6:port
+    parts = remote_endpoint.split(':')
+    if len(parts) >= 8:
+        potential_ipv6 = ':'.join(parts[:8])
+        if ip_family(potential_ipv6) == FAMILY_IPV6:
+            return potential_ipv6
+
+    match = _IPV4_PORT_RE.match(remote_endpoint)
+    if match:
+        return match.group(1)
+
+    # 都匹配不到时返回原始值（可能是直接的 IPv6），移除接口标识
+    return remote_endpoint.split('%')[0]
+
+
+def parse_endpoint(remote_endpoint: str, ipv6_prefix_length: int) -> ParsedEndpoint:
+    """解析 RemoteEndPoint，得到 (ip, 地址族, 网络标识)"""
+    ip = extract_ip(remote_endpoint)
+    return ParsedEndpoint(ip, ip_family(ip), network_key(ip, ipv6_prefix_length))
+
+
+def is_same_network(ip1: str, ip2: str, ipv6_prefix_length: int) -> bool:
+    if ip1 == ip2:
+        return True
+    family1 = ip_family(ip1)
+    if family1 != FAMILY_IPV6 or ip_family(ip2) != FAMILY_IPV6:
+        # IPv4 只有完全相同才算同一网络；混合类型不是同一网络
+        return False
+    return network_key(ip1, ipv6_prefix_length) == network_key(ip2, ipv6_prefix_length)
+
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    stats = {}
+    for name, func in (('extract_ip', extract_ip), ('parse_ip', parse_ip), ('network_key', network_key)):
+        info = func.cache_info()
+        stats[name] = {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'maxsize': info.maxsize}
+    return stats
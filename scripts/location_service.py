@@ -1,31 +1,219 @@
 from __future__ import annotations
 
-import json
 import logging
-import shutil
-import subprocess
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from typing import Any
 
-from geocache_client import GeoCacheClient
+import requests
+
+from circuit_breaker import AdaptiveTimeout, CircuitBreaker
+from geo_providers import create_backend
+from geocache_client import GeoCacheClient, GeoCacheReporter
+from ip_range_index import IPRangeIndex
+from metrics import StageMetrics
+
+# 内存缓存之后的查询层级，按顺序依次尝试；provider（ip138/自建库 外部查询）始终作为最后兜底
+TIER_NAMES = ("sqlite", "prefix", "geocache", "provider")
+
+# 外部查询熔断或超时时返回的占位结果，数据源恢复后由 retry_pending() 补查
+PENDING_PROVIDER = "pending"
+PENDING_LOCATION = "解析中"
+
+
+class LocationCache:
+    """有界 LRU 内存缓存，每个条目带过期时间；解析失败的结果使用单独的（较短）TTL。"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 86400, negative_ttl: float = 300):
+        self.maxsize = max(int(maxsize), 1)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._data: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: dict[str, Any]) -> None:
+        ttl = self.negative_ttl if value.get("provider") in ("none", PENDING_PROVIDER) else self.ttl
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def warm(self, values: list[dict[str, Any]]) -> int:
+        """预热载入（按从新到旧的顺序传入），返回载入条数
+
+        不覆盖、也不挤掉已有条目：预热条目放在 LRU 队列最旧的一端，缓存满即停止。
+        """
+        loaded = 0
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for value in values:
+                if len(self._data) >= self.maxsize:
+                    break
+                key = value.get("ip")
+                if not key or key in self._data:
+                    continue
+                self._data[key] = (expires_at, value)
+                self._data.move_to_end(key, last=False)
+                loaded += 1
+        return loaded
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class _InflightLookup:
+    """正在进行中的一次IP解析，其他线程等待同一结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: dict[str, Any] | None = None
+        self.error: BaseException | None = None
 
 
 class LocationService:
     """IP 归属地查询服务：支持 qoo-ip138 和自建库两种方式切换。"""
 
-    def __init__(self, timeout_sec: int = 45, use_hiofd: bool = False, db_manager=None, emby_server_info: dict = None):
+    def __init__(
+        self,
+        timeout_sec: int = 45,
+        use_hiofd: bool = False,
+        db_manager=None,
+        emby_server_info: dict = None,
+        cache_size: int = 10000,
+        cache_ttl: float = 86400,
+        negative_cache_ttl: float = 300,
+        prefix_match: bool = True,
+        prefix_min_samples: int = 2,
+        backend: str = "auto",
+        lookup_workers: int = 4,
+        geocache_url: str = None,
+        tiers: list[str] = None,
+        geocache_timeout: float = 2,
+        geocache_failure_threshold: int = 5,
+        geocache_reset_timeout: float = 60,
+        warmup_size: int = 0,
+        breaker_failure_threshold: int = 5,
+        breaker_failure_rate: float = 0.5,
+        breaker_window: int = 20,
+        breaker_reset_timeout: float = 60,
+        adaptive_timeout: bool = True,
+        min_timeout_sec: float = 3,
+        timeout_multiplier: float = 3,
+    ):
         self.timeout_sec = timeout_sec
         self.use_hiofd = use_hiofd
-        self.cache: dict[str, dict[str, Any]] = {}
+        # 查询后端：优先进程内调用 Python 包，避免每次查询都启动子进程
+        self.backend = create_backend(backend, timeout_sec)
+        logging.info(f"📍 IP归属地查询后端: {self.backend.name}")
+        self.cache = LocationCache(maxsize=cache_size, ttl=cache_ttl, negative_ttl=negative_cache_ttl)
+        self.warmup_size = max(int(warmup_size or 0), 0)
+        self.warmup_stats: dict[str, Any] | None = None
+        self._warmup_thread: threading.Thread | None = None
+        self.lookup_workers = max(int(lookup_workers), 1)
+
+        # 每个数据源一个熔断器和自适应超时；查询在独立线程池中执行，超时后调用方立即返回占位结果
+        self.provider_breakers = {
+            name: CircuitBreaker(
+                name,
+                failure_threshold=breaker_failure_threshold,
+                reset_timeout=breaker_reset_timeout,
+                window_size=breaker_window,
+                failure_rate_threshold=breaker_failure_rate,
+            )
+            for name in ("ip138", "自建库")
+        }
+        self.provider_timeouts = {
+            name: AdaptiveTimeout(
+                min_timeout=min_timeout_sec if adaptive_timeout else timeout_sec,
+                max_timeout=timeout_sec,
+                multiplier=timeout_multiplier,
+            )
+            for name in ("ip138", "自建库")
+        }
+        self._provider_executor = ThreadPoolExecutor(
+            max_workers=self.lookup_workers + 2, thread_name_prefix="location-provider"
+        )
+        # lookup_many 中本地层级未命中的IP在此线程池中并发走剩余层级
+        self._lookup_executor = ThreadPoolExecutor(max_workers=self.lookup_workers, thread_name_prefix="location-lookup")
+        # 等待补查的IP（返回了占位结果），按加入顺序补查
+        self._pending: dict[str, float] = {}
+
+        # 单飞合并：同一IP同时只进行一次解析，其余并发请求等待并共享结果
+        self._inflight: dict[str, _InflightLookup] = {}
+        self._inflight_lock = threading.Lock()
+        self.coalesced_lookups = 0
         self.hiofd_retries = 3
         self.hiofd_retry_delay_sec = 1.0
         self.db_manager = db_manager
         self.emby_server_info = emby_server_info or {}
-        
+
+        # 同网段（IPv4 /24、IPv6 /64）已有足够且一致的解析结果时，直接复用而不调用外部命令
+        self.range_index = IPRangeIndex(min_samples=prefix_min_samples) if prefix_match else None
+        self.prefix_hits = 0
+        self._rebuild_range_index()
+
+        # 分层查询：内存 -> 数据库 -> 网段索引 -> GeoCache -> 外部查询，命中后回写到更快的层级
+        self.tiers = self._normalize_tiers(tiers)
+        self.tier_counts = {tier: {"lookups": 0, "hits": 0, "errors": 0, "skipped": 0} for tier in self.tiers}
+        self.tier_metrics = StageMetrics()
+        logging.info(f"📍 IP归属地查询层级: memory -> {' -> '.join(self.tiers)}")
+
+        # GeoCache 查询使用较短超时，连续失败后熔断一段时间，避免拖慢会话处理
+        self.geocache_timeout = geocache_timeout
+        self.geocache_breaker = CircuitBreaker(
+            "geocache", failure_threshold=geocache_failure_threshold, reset_timeout=geocache_reset_timeout
+        )
+
+        self.geocache_url = geocache_url or None
         self.geocache_client = None
+        self.geocache_reporter = None
         self.geocache_enabled = self.use_hiofd
         if self.geocache_enabled:
-            self.geocache_client = GeoCacheClient(emby_server_info=self.emby_server_info)
+            self._start_geocache()
             logging.info("🌍 GeoCache 已启用")
 
     def update_config(self, use_hiofd: bool):
@@ -42,14 +230,126 @@ class LocationService:
             
             # 更新 GeoCache 客户端
             if new_geocache_enabled and not old_geocache_enabled:
-                self.geocache_client = GeoCacheClient(emby_server_info=self.emby_server_info)
+                self._start_geocache()
                 logging.info("🌍 GeoCache 已启用")
             elif not new_geocache_enabled and old_geocache_enabled:
-                self.geocache_client = None
+                self._stop_geocache()
                 logging.info("🌍 GeoCache 已禁用")
             
             self.cache.clear()
             logging.info("📍 已清空IP解析缓存")
+            self._rebuild_range_index()
+
+    def _start_geocache(self):
+        self.geocache_client = GeoCacheClient(base_url=self.geocache_url, emby_server_info=self.emby_server_info)
+        # 上报在后台线程中批量进行，不阻塞会话记录
+        self.geocache_reporter = GeoCacheReporter(self.geocache_client, db_manager=self.db_manager)
+
+    def _stop_geocache(self):
+        if self.geocache_reporter:
+            self.geocache_reporter.stop()
+        self.geocache_reporter = None
+        self.geocache_client = None
+
+    def close(self):
+        """停止后台上报线程，未上报的记录保留在发件箱中"""
+        self._stop_geocache()
+        self._lookup_executor.shutdown(wait=False, cancel_futures=True)
+        self._provider_executor.shutdown(wait=False, cancel_futures=True)
+
+    def start_warm_up(self):
+        """在后台线程中预热内存缓存，监控轮询无需等待"""
+        if not self.warmup_size or not self.db_manager or self._warmup_thread:
+            return
+        self._warmup_thread = threading.Thread(target=self.warm_up, name="ip-cache-warmup", daemon=True)
+        self._warmup_thread.start()
+
+    def warm_up(self, limit: int = None) -> int:
+        """一次查询载入最近更新的若干条当前数据源的归属地记录到内存缓存，返回载入条数"""
+        limit = min(limit or self.warmup_size, self.cache.maxsize)
+        if not limit or not self.db_manager:
+            return 0
+        provider = "自建库" if self.use_hiofd else "ip138"
+        started = time.perf_counter()
+        try:
+            rows = self.db_manager.get_recent_ip_locations(limit, provider)
+        except Exception as e:
+            logging.error(f"📍 IP归属地缓存预热失败: {e}")
+            return 0
+        loaded = self.cache.warm(rows)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.warmup_stats = {"loaded": loaded, "rows": len(rows), "elapsed_ms": round(elapsed_ms, 1)}
+        logging.info(f"📍 IP归属地缓存预热完成: 载入 {loaded} 条，耗时 {elapsed_ms:.0f}ms")
+        return loaded
+
+    def _rebuild_range_index(self):
+        """用数据库中当前数据源的缓存记录重建网段索引"""
+        if self.range_index is None or not self.db_manager:
+            return
+        provider = "自建库" if self.use_hiofd else "ip138"
+        try:
+            started = time.monotonic()
+            blocks = self.range_index.build(self.db_manager.get_all_ip_locations(provider))
+            logging.info(f"📍 IP网段索引已构建: {blocks} 个网段，耗时 {(time.monotonic() - started) * 1000:.0f}ms")
+        except Exception as e:
+            logging.error(f"📍 构建IP网段索引失败: {e}")
+
+    @staticmethod
+    def _normalize_tiers(tiers: list[str] | None) -> list[str]:
+        names = [str(tier).strip().lower() for tier in (tiers or TIER_NAMES)]
+        unknown = [name for name in names if name not in TIER_NAMES and name != "memory"]
+        if unknown:
+            logging.warning(f"📍 忽略未知的IP归属地查询层级: {', '.join(unknown)}")
+        # 内存缓存总是最先查询，不参与排序
+        ordered = [name for name in dict.fromkeys(names) if name in TIER_NAMES]
+        if "provider" not in ordered:
+            ordered.append("provider")
+        return ordered
+
+    def _count_tier(self, tier: str, lookups: int = 0, hits: int = 0, errors: int = 0, skipped: int = 0) -> None:
+        with self._inflight_lock:
+            counts = self.tier_counts[tier]
+            counts["lookups"] += lookups
+            counts["hits"] += hits
+            counts["errors"] += errors
+            counts["skipped"] += skipped
+
+    def get_stats(self) -> dict[str, Any]:
+        cache_stats = self.cache.stats()
+        stats = {"cache": cache_stats, "coalesced_lookups": self.coalesced_lookups}
+
+        memory_lookups = cache_stats["hits"] + cache_stats["misses"]
+        tiers = {
+            "memory": {
+                "lookups": memory_lookups,
+                "hits": cache_stats["hits"],
+                "hit_rate": round(cache_stats["hits"] / memory_lookups, 4) if memory_lookups else 0.0,
+            }
+        }
+        latency = self.tier_metrics.snapshot()
+        with self._inflight_lock:
+            for tier in self.tiers:
+                counts = dict(self.tier_counts[tier])
+                counts["hit_rate"] = round(counts["hits"] / counts["lookups"], 4) if counts["lookups"] else 0.0
+                counts["latency"] = latency.get(tier)
+                tiers[tier] = counts
+        stats["tiers"] = tiers
+        if self.warmup_stats:
+            stats["warmup"] = self.warmup_stats
+
+        if self.geocache_reporter:
+            stats["geocache_reporter"] = self.geocache_reporter.stats()
+        if "geocache" in self.tiers:
+            stats["geocache_breaker"] = self.geocache_breaker.to_dict()
+        stats["providers"] = {
+            name: {"breaker": breaker.to_dict(), "timeout": self.provider_timeouts[name].to_dict()}
+            for name, breaker in self.provider_breakers.items()
+        }
+        with self._inflight_lock:
+            stats["pending"] = len(self._pending)
+        if self.range_index is not None:
+            stats["range_index"] = {"blocks": len(self.range_index), "prefix_hits": self.prefix_hits}
+        return stats
 
     def _format_location(self, location: str, district: str, street: str, isp: str) -> str:
         parts = []
@@ -66,48 +366,17 @@ class LocationService:
         left = "·".join(parts) if parts else "未知位置"
         return f"{left} | {isp.strip()}" if isp else left
 
-    def _run_cmd(self, cmd: list[str]) -> str:
-        if not cmd:
-            raise ValueError("空命令")
-
-        if shutil.which(cmd[0]) is None:
-            raise FileNotFoundError(f"命令未找到: {cmd[0]}")
-
-        proc = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=self.timeout_sec,
-            check=False,
-        )
-
-        if proc.returncode != 0:
-            stderr = (proc.stderr or "").strip()
-            stdout = (proc.stdout or "").strip()
-            detail = stderr or stdout or f"exit={proc.returncode}"
-            raise RuntimeError(f"命令执行失败: {' '.join(cmd)} | {detail}")
-
-        return (proc.stdout or "").strip()
-
     def _query_ip138(self, ip_address: str) -> dict[str, Any]:
-        output = self._run_cmd(["qoo-ip138", f"--ip={ip_address}"])
-
         location = ""
         isp = ""
-        for raw_line in output.splitlines():
-            line = raw_line.strip()
-            if not line:
-                continue
-
+        for name, value in self.backend.query_ip138(ip_address):
             for key in ("归属地", "归属地理位置", "location", "Location"):
-                if key in line and (":" in line or "：" in line):
-                    sep = "：" if "：" in line else ":"
-                    location = line.rsplit(sep, 1)[1].strip()
+                if key in name:
+                    location = value
 
             for key in ("运营商", "isp", "ISP"):
-                if key in line and (":" in line or "：" in line):
-                    sep = "：" if "：" in line else ":"
-                    isp = line.rsplit(sep, 1)[1].strip()
+                if key in name:
+                    isp = value
 
         return {
             "provider": "ip138",
@@ -127,8 +396,7 @@ class LocationService:
 
         for attempt in range(1, self.hiofd_retries + 1):
             try:
-                output = self._run_cmd(["ip-hiofd", "--ip", ip_address, "--json"])
-                data = json.loads(output)
+                data = self.backend.query_hiofd(ip_address)
 
                 result_ip = str(data.get("result_ip") or "").strip()
                 if result_ip and result_ip != ip_address:
@@ -180,6 +448,81 @@ class LocationService:
             f"自建库 多次查询失败({self.hiofd_retries}次): {last_err}"
         )
 
+    def _lookup_prefix(self, ip_address: str) -> dict[str, Any] | None:
+        """用同网段的解析结果推断归属地；推断结果只放内存缓存，不写库也不上报"""
+        if self.range_index is None:
+            return None
+        block_info = self.range_index.lookup(ip_address)
+        if not block_info:
+            return None
+        info = {**block_info, "ip": ip_address, "match": "prefix", "ts": int(time.time())}
+        with self._inflight_lock:
+            self.prefix_hits += 1
+        self.cache.set(ip_address, info)
+        return info
+
+    def lookup_many(self, ip_addresses: list[str], resolve: bool = True) -> list[dict[str, Any] | None]:
+        """批量查询，结果与输入顺序一致
+
+        去重后先查内存缓存，再按 tiers 顺序批量查询本地层级（数据库一次 IN 查询、网段索引），
+        遇到第一个外部层级（GeoCache / 解析命令）时，剩余的IP由线程池并发从该层级起走完后续层级；
+        resolve=False 时跳过外部层级，未命中的位置返回 None。
+        """
+        current_provider = "自建库" if self.use_hiofd else "ip138"
+        results: dict[str, dict[str, Any]] = {}
+        missing = []
+        for ip_address in dict.fromkeys(ip for ip in ip_addresses if ip):
+            cached_info = self.cache.get(ip_address)
+            if cached_info and cached_info.get("provider") in (current_provider, "none", PENDING_PROVIDER):
+                results[ip_address] = cached_info
+            else:
+                missing.append(ip_address)
+
+        remaining_tiers: list[str] = []
+        for index, tier in enumerate(self.tiers):
+            if not missing:
+                break
+            if tier == "sqlite":
+                missing = self._batch_sqlite(missing, current_provider, results)
+            elif tier == "prefix":
+                missing = self._batch_prefix(missing, results)
+            elif resolve:
+                remaining_tiers = self.tiers[index:]
+                break
+
+        if missing and remaining_tiers:
+            futures = {
+                ip_address: self._lookup_executor.submit(self._lookup, ip_address, remaining_tiers, False)
+                for ip_address in missing
+            }
+            results.update((ip_address, future.result()) for ip_address, future in futures.items())
+
+        return [results.get(ip) if ip else self.lookup(ip) for ip in ip_addresses]
+
+    def _batch_sqlite(self, missing: list[str], current_provider: str, results: dict) -> list[str]:
+        if not self.db_manager:
+            return missing
+        for ip_address, db_info in self.db_manager.get_ip_locations(missing).items():
+            if db_info.get("provider") == current_provider:
+                results[ip_address] = db_info
+                self.cache.set(ip_address, db_info)
+        unresolved = [ip_address for ip_address in missing if ip_address not in results]
+        self._count_tier("sqlite", lookups=len(missing), hits=len(missing) - len(unresolved))
+        return unresolved
+
+    def _batch_prefix(self, missing: list[str], results: dict) -> list[str]:
+        if self.range_index is None:
+            return missing
+        unresolved = []
+        for ip_address in missing:
+            info = self._lookup_prefix(ip_address)
+            if info:
+                results[ip_address] = info
+            else:
+                unresolved.append(ip_address)
+        self._count_tier("prefix", lookups=len(missing), hits=len(missing) - len(unresolved))
+        return unresolved
+
     def lookup(self, ip_address: str) -> dict[str, Any]:
         if not ip_address:
             return {
@@ -195,36 +538,212 @@ class LocationService:
                 "ts": int(time.time()),
             }
 
+        return self._lookup(ip_address)
+
+    def _lookup(self, ip_address: str, tiers: list[str] = None, check_cache: bool = True) -> dict[str, Any]:
+        """单个IP的查询：内存缓存 -> 单飞合并 -> 依次查询 tiers（默认全部层级）"""
         current_provider = "自建库" if self.use_hiofd else "ip138"
-        
-        if ip_address in self.cache:
-            cached_info = self.cache[ip_address]
-            if cached_info.get("provider") == current_provider:
-                return cached_info
-            else:
+
+        if check_cache:
+            cached_info = self.cache.get(ip_address)
+            if cached_info:
+                # 解析失败的结果在 negative TTL 内直接返回，避免对同一IP反复调用外部命令
+                if cached_info.get("provider") in (current_provider, "none", PENDING_PROVIDER):
+                    return cached_info
                 logging.info(f"📍 解析方式已切换，重新查询 {ip_address}")
 
-        info = None
-        
-        if self.db_manager:
-            db_info = self.db_manager.get_ip_location(ip_address)
-            if db_info and db_info.get("provider") == current_provider:
-                info = db_info
-                self.cache[ip_address] = info
+        with self._inflight_lock:
+            inflight = self._inflight.get(ip_address)
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight[ip_address] = _InflightLookup()
+            else:
+                self.coalesced_lookups += 1
+
+        if not leader:
+            inflight.done.wait()
+            if inflight.error is not None:
+                raise inflight.error
+            return inflight.result
+
+        try:
+            inflight.result = self._resolve(ip_address, current_provider, tiers)
+            return inflight.result
+        except BaseException as e:
+            inflight.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(ip_address, None)
+            inflight.done.set()
+
+    def _resolve(self, ip_address: str, current_provider: str, tiers: list[str] = None) -> dict[str, Any]:
+        """内存缓存未命中时按层级依次查询（默认为配置的全部层级），第一个命中的层级返回结果"""
+        for tier in self.tiers if tiers is None else tiers:
+            handler = getattr(self, f"_tier_{tier}")
+            started = time.perf_counter()
+            info = handler(ip_address, current_provider)
+            self.tier_metrics.observe(tier, (time.perf_counter() - started) * 1000)
+            if info is not None:
                 return info
-            elif db_info:
-                logging.info(f"📍 数据库中IP归属地数据源已切换，重新查询 {ip_address}")
+        # 只有在 provider 层被配置在其他层之前时才会走到这里
+        return self._failed_info(ip_address)
+
+    def _failed_info(self, ip_address: str) -> dict[str, Any]:
+        return {
+            "provider": "none",
+            "ip": ip_address,
+            "location": "",
+            "district": "",
+            "street": "",
+            "isp": "",
+            "latitude": None,
+            "longitude": None,
+            "formatted": "解析失败",
+            "ts": int(time.time()),
+        }
+
+    def _tier_sqlite(self, ip_address: str, current_provider: str) -> dict[str, Any] | None:
+        if not self.db_manager:
+            return None
+        db_info = self.db_manager.get_ip_location(ip_address)
+        if db_info and db_info.get("provider") == current_provider:
+            self._count_tier("sqlite", lookups=1, hits=1)
+            self.cache.set(ip_address, db_info)
+            return db_info
+        if db_info:
+            logging.info(f"📍 数据库中IP归属地数据源已切换，重新查询 {ip_address}")
+        self._count_tier("sqlite", lookups=1)
+        return None
+
+    def _tier_prefix(self, ip_address: str, current_provider: str) -> dict[str, Any] | None:
+        if self.range_index is None:
+            return None
+        info = self._lookup_prefix(ip_address)
+        self._count_tier("prefix", lookups=1, hits=1 if info else 0)
+        return info
+
+    def _tier_geocache(self, ip_address: str, current_provider: str) -> dict[str, Any] | None:
+        client = self.geocache_client
+        if not client:
+            return None
+        if not self.geocache_breaker.allow():
+            self._count_tier("geocache", skipped=1)
+            return None
 
         try:
-            if self.use_hiofd:
-                info = self._query_hiofd(ip_address)
-            else:
-                info = self._query_ip138(ip_address)
+            data = client.query_ip(ip_address, timeout=self.geocache_timeout)
         except Exception as e:
-            provider = "自建库" if self.use_hiofd else "ip138"
-            logging.error(f"📍 {provider} 查询失败({ip_address}): {e}")
+            # 任何异常都要记为失败，否则半开状态的试探请求不会结束，熔断器一直停在试探中
+            self.geocache_breaker.record_failure()
+            self._count_tier("geocache", lookups=1, errors=1)
+            logging.warning(f"📍 GeoCache 查询失败({ip_address}): {e}")
+            return None
+        self.geocache_breaker.record_success()
+
+        if not data or not (data.get("location") or data.get("isp")):
+            self._count_tier("geocache", lookups=1)
+            return None
+        self._count_tier("geocache", lookups=1, hits=1)
+
+        location = str(data.get("location") or "").strip()
+        district = str(data.get("district") or "").strip()
+        street = str(data.get("street") or "").strip()
+        isp = str(data.get("isp") or "").strip()
+        # GeoCache 只在使用自建库时启用，其数据即自建库数据，按当前数据源写回数据库以便后续直接命中
+        info = {
+            "provider": current_provider,
+            "ip": ip_address,
+            "location": location,
+            "district": district,
+            "street": street,
+            "isp": isp,
+            "latitude": data.get("latitude"),
+            "longitude": data.get("longitude"),
+            "formatted": self._format_location(location, district, street, isp),
+            "match": "geocache",
+            "ts": int(time.time()),
+        }
+        self.cache.set(ip_address, info)
+        if self.db_manager:
+            self.db_manager.save_ip_location(info)
+        if self.range_index is not None:
+            self.range_index.add(info)
+        return info
+
+    def _tier_provider(self, ip_address: str, current_provider: str) -> dict[str, Any]:
+        breaker = self.provider_breakers[current_provider]
+        if not breaker.allow():
+            self._count_tier("provider", skipped=1)
+            return self._placeholder(ip_address)
+
+        adaptive_timeout = self.provider_timeouts[current_provider]
+        timeout = adaptive_timeout.current()
+        query = self._query_hiofd if self.use_hiofd else self._query_ip138
+        started = time.perf_counter()
+        future = self._provider_executor.submit(query, ip_address)
+        try:
+            info = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # 尚未开始的查询直接取消；已在执行的查询不再等待，结束后由回调写入缓存，不必等补查
+            future.cancel()
+            breaker.record_failure()
+            self._count_tier("provider", lookups=1, errors=1)
+            logging.warning(f"📍 {current_provider} 查询超时({ip_address}): 超过 {timeout:.1f}s，稍后补查")
+            placeholder = self._placeholder(ip_address)
+            future.add_done_callback(
+                lambda done: self._on_late_result(done, ip_address, adaptive_timeout, started)
+            )
+            return placeholder
+        except Exception as e:
+            breaker.record_failure()
+            logging.error(f"📍 {current_provider} 查询失败({ip_address}): {e}")
+            self._count_tier("provider", lookups=1, errors=1)
+            info = self._failed_info(ip_address)
+        else:
+            breaker.record_success()
+            adaptive_timeout.observe(time.perf_counter() - started)
+            self._count_tier("provider", lookups=1, hits=1)
+
+        self._store_provider_result(ip_address, info)
+        return info
+
+    def _on_late_result(self, future, ip_address: str, adaptive_timeout, started: float) -> None:
+        """超时后才完成的查询：结果照常写入缓存、数据库和网段索引，并移出待补查列表"""
+        if future.cancelled() or future.exception() is not None:
+            return
+        adaptive_timeout.observe(time.perf_counter() - started)
+        with self._inflight_lock:
+            self._pending.pop(ip_address, None)
+        try:
+            self._store_provider_result(ip_address, future.result())
+        except Exception as e:
+            logging.warning(f"📍 保存超时查询结果失败({ip_address}): {e}")
+
+    def _store_provider_result(self, ip_address: str, info: dict[str, Any]) -> None:
+        self.cache.set(ip_address, info)
+
+        if info.get("provider") != "none" and self.db_manager:
+            self.db_manager.save_ip_location(info)
+
+        if info.get("provider") != "none" and self.range_index is not None:
+            self.range_index.add(info)
+
+        if info.get("provider") != "none" and self.geocache_reporter:
+            self.geocache_reporter.report(info)
+
+    def _placeholder(self, ip_address: str) -> dict[str, Any]:
+        """数据源不可用时的占位结果：优先用数据库中其他数据源的旧记录，否则返回“解析中”"""
+        with self._inflight_lock:
+            if ip_address not in self._pending and len(self._pending) < self.cache.maxsize:
+                self._pending[ip_address] = time.time()
+
+        stale_info = self.db_manager.get_ip_location(ip_address) if self.db_manager else None
+        if stale_info and stale_info.get("formatted"):
+            info = {**stale_info, "provider": PENDING_PROVIDER, "stale": True}
+        else:
             info = {
-                "provider": "none",
+                "provider": PENDING_PROVIDER,
                 "ip": ip_address,
                 "location": "",
                 "district": "",
@@ -232,16 +751,32 @@ class LocationService:
                 "isp": "",
                 "latitude": None,
                 "longitude": None,
-                "formatted": "解析失败",
+                "formatted": PENDING_LOCATION,
                 "ts": int(time.time()),
             }
+        self.cache.set(ip_address, info)
+        return info
 
-        self.cache[ip_address] = info
-        
-        if info.get("provider") != "none" and self.db_manager:
-            self.db_manager.save_ip_location(info)
-        
-        if info.get("provider") != "none" and self.geocache_enabled:
-            self.geocache_client.report_location_info(info)
-        
-        return info
\ No newline at end of file
+    def retry_pending(self, limit: int = 50) -> int:
+        """数据源恢复（未熔断）后补查返回过占位结果的IP，返回补查成功的数量"""
+        with self._inflight_lock:
+            ip_addresses = list(self._pending)[:limit]
+        if not ip_addresses:
+            return 0
+
+        current_provider = "自建库" if self.use_hiofd else "ip138"
+        breaker = self.provider_breakers[current_provider]
+        resolved = 0
+        for ip_address in ip_addresses:
+            if not breaker.available():
+                break
+            with self._inflight_lock:
+                self._pending.pop(ip_address, None)
+            self.cache.discard(ip_address)
+            info = self.lookup(ip_address)
+            if info.get("provider") not in ("none", PENDING_PROVIDER):
+                resolved += 1
+
+        if resolved:
+            logging.info(f"📍 已补查 {resolved} 个IP的归属地")
+        return resolved
@@ -86,9 +86,21 @@ def main() -> int:
     if args.self_check:
         return 0
 
-    db_manager = DatabaseManager(config['database']['name'])
+    database_config = config['database']
+    db_manager = DatabaseManager(
+        database_config['name'],
+        sqlite_options={
+            'busy_timeout_ms': database_config.get('busy_timeout_ms', 5000),
+            'mmap_size_mb': database_config.get('mmap_size_mb', 256),
+            'cache_size_mb': database_config.get('cache_size_mb', 16),
+        },
+    )
     wish_store = WishStore(db_manager.db_path)
-    emby_client = EmbyClient(server_url=config['emby']['server_url'], api_key=config['emby']['api_key'])
+    emby_client = EmbyClient(
+        server_url=config['emby']['server_url'],
+        api_key=config['emby']['api_key'],
+        user_cache_ttl=config['emby'].get('user_cache_ttl', 300),
+    )
     security = EmbySecurity(emby_client)
     tmdb_client = TMDBClient(config.get('tmdb', {}))
 
@@ -97,9 +109,33 @@ def main() -> int:
 
     from location_service import LocationService
 
-    use_geocache = config.get('ip_location', {}).get('use_geocache', False)
+    ip_location_config = config.get('ip_location', {})
     emby_server_info = emby_client.get_server_info()
-    location_service = LocationService(use_hiofd=use_geocache, db_manager=db_manager, emby_server_info=emby_server_info)
+    location_service = LocationService(
+        use_hiofd=ip_location_config.get('use_geocache', False),
+        db_manager=db_manager,
+        emby_server_info=emby_server_info,
+        cache_size=ip_location_config.get('cache_size', 10000),
+        cache_ttl=ip_location_config.get('cache_ttl', 86400),
+        negative_cache_ttl=ip_location_config.get('negative_cache_ttl', 300),
+        prefix_match=ip_location_config.get('prefix_match', True),
+        prefix_min_samples=ip_location_config.get('prefix_min_samples', 2),
+        backend=ip_location_config.get('backend', 'auto'),
+        lookup_workers=ip_location_config.get('lookup_workers', 4),
+        geocache_url=ip_location_config.get('geocache_url') or None,
+        tiers=ip_location_config.get('tiers'),
+        geocache_timeout=ip_location_config.get('geocache_timeout', 2),
+        geocache_failure_threshold=ip_location_config.get('geocache_failure_threshold', 5),
+        geocache_reset_timeout=ip_location_config.get('geocache_reset_timeout', 60),
+        warmup_size=ip_location_config.get('warmup_size', 5000),
+        breaker_failure_threshold=ip_location_config.get('breaker_failure_threshold', 5),
+        breaker_failure_rate=ip_location_config.get('breaker_failure_rate', 0.5),
+        breaker_window=ip_location_config.get('breaker_window', 20),
+        breaker_reset_timeout=ip_location_config.get('breaker_reset_timeout', 60),
+        adaptive_timeout=ip_location_config.get('adaptive_timeout', True),
+        min_timeout_sec=ip_location_config.get('min_timeout', 3),
+        timeout_multiplier=ip_location_config.get('timeout_multiplier', 3),
+    )
 
     monitor = EmbyMonitor(
         db_manager=db_manager,
@@ -107,6 +143,7 @@ def main() -> int:
         security_client=security,
         config=config,
         location_service=location_service,
+        shadow_syncer=shadow_syncer,
     )
 
     web_server = WebServer(
@@ -123,7 +160,11 @@ def main() -> int:
     )
 
     web_server.start()
-    monitor.run()
+    try:
+        monitor.run()
+    finally:
+        # Web 服务与监控共用连接管理器；监控异常退出时同样关闭所有连接
+        db_manager.close()
     return 0
 
 
@@ -0,0 +1,96 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# 直方图桶上界（毫秒），按 1.2 倍递增，覆盖 0.5ms ~ 60s
+BUCKET_BOUNDS_MS = [0.5 * 1.2 ** i for i in range(65)]
+
+
+class LatencyHistogram:
+    """固定分桶的耗时直方图，内存占用恒定，百分位取所在桶的上界（不超过最大值）"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                bound = BUCKET_BOUNDS_MS[index] if index < len(BUCKET_BOUNDS_MS) else self.max_ms
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total_ms / self.count, 2) if self.count else 0.0,
+            'p50_ms': round(self.percentile(0.50), 2),
+            'p95_ms': round(self.percentile(0.95), 2),
+            'p99_ms': round(self.percentile(0.99), 2),
+            'max_ms': round(self.max_ms, 2),
+        }
+
+
+class StageMetrics:
+    """按阶段统计耗时
+
+    stage() 记录到对应阶段的直方图；在 begin_cycle()/end_cycle() 之间、同一线程内的阶段
+    还会累加到本轮周期的耗时分解中，用于慢周期日志。
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def observe(self, stage, elapsed_ms):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = LatencyHistogram()
+            histogram.observe(elapsed_ms)
+
+        breakdown = getattr(self._local, 'breakdown', None)
+        if breakdown is not None:
+            breakdown[stage] = breakdown.get(stage, 0.0) + elapsed_ms
+
+    @contextmanager
+    def stage(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - started) * 1000)
+
+    def begin_cycle(self):
+        self._local.breakdown = {}
+        self._local.cycle_started = time.perf_counter()
+
+    def end_cycle(self, stage='cycle'):
+        """结束当前周期，返回 (周期总耗时ms, 各阶段耗时分解)"""
+        breakdown = getattr(self._local, 'breakdown', None) or {}
+        started = getattr(self._local, 'cycle_started', None)
+        self._local.breakdown = None
+        if started is None:
+            return 0.0, breakdown
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.observe(stage, elapsed_ms)
+        return elapsed_ms, breakdown
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: histogram.to_dict() for stage, histogram in sorted(self._histograms.items())}
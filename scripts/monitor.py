@@ -1,22 +1,74 @@
 import os
 import time
 import sqlite3
-import socket
-import re
 import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import requests
 from webhook_notifier import WebhookNotifier
-from location_service import LocationService
+from location_service import PENDING_LOCATION, PENDING_PROVIDER, LocationService
+from emby_websocket import EmbySessionStream
+from history_archive import HistoryArchiver
+from ip_utils import ip_type_label, network_key, parse_endpoint
+from metrics import StageMetrics
+from rollups import RollupRebuilder
+from scheduler import TaskScheduler
 
 
 class EmbyMonitor:
-    def __init__(self, db_manager, emby_client, security_client, config, location_service=None):
+    def __init__(self, db_manager, emby_client, security_client, config, location_service=None, shadow_syncer=None):
         self.db = db_manager
         self.emby = emby_client
         self.security = security_client
         self.config = config
+        self.shadow_syncer = shadow_syncer
         self.active_sessions = {}
+
+        # 新会话补全（用户信息、归属地、入库）在线程池中异步进行，
+        # 轮询线程只负责发现会话，结果完成后再合并进 active_sessions
+        self._sessions_lock = threading.RLock()
+        self._pending_sessions = set()
+        # 补全尚未完成时就收到 stop 事件的会话，补全结束后立即结束
+        self._stopped_pending_sessions = set()
+        self._enrich_executor = None
+        self._enrich_slots = None
+        self.enrich_workers = 0
+        self.enrich_queue_size = 0
+
+        # 按用户维护活跃会话的网络索引，随会话开始/结束增量更新（均在 _sessions_lock 下访问）
+        # _user_networks: user_id -> {网络标识: 引用计数}
+        # _user_ip_sessions: (user_id, ip) -> {session_id: None}（保持插入顺序）
+        self._user_networks = {}
+        self._user_ip_sessions = {}
+        self.ipv6_prefix_length = None
+
+        # WebSocket 事件模式：事件由订阅线程写入队列，由主循环统一消费
+        self._session_stream = None
+        self._event_queue = queue.Queue()
+
+        # 热重启：启动时从检查点恢复的会话，等首次完整会话快照对账后清空
+        self._restored_sessions = None
+        self._restored_at = None
+        self._next_checkpoint = 0
+
+        # 最近一次到期用户检查的计数与耗时
+        self.last_expiry_check = {}
+
+        # 延迟解析归属地：会话先以占位归属地入库，等待回填的IP（在 _sessions_lock 下访问，保持加入顺序）
+        self._pending_location_ips = {}
+
+        # 到期检查、缓存清理、影子库同步等周期任务按配置的时间间隔在调度线程中执行
+        self.scheduler = TaskScheduler()
+
+        # 轮询周期各阶段耗时直方图（Emby 接口、用户信息、归属地、SQLite、Webhook）
+        self.metrics = StageMetrics()
+
+        # 超过保留期的播放记录/安全日志按月移入归档库，由周期任务分批执行
+        self.archiver = HistoryArchiver(db_manager)
+        # 观看时长汇总表由触发器增量维护，定期重建最近几天以修正手工改动等造成的偏差
+        self.rollup_rebuilder = RollupRebuilder(db_manager, self.archiver)
         
         # 使用传入的 location_service 或创建新的
         if location_service:
@@ -36,7 +88,6 @@ class EmbyMonitor:
         self.auto_disable = config['security']['auto_disable']
         self.alert_threshold = config['notifications']['alert_threshold']
         self.alerts_enabled = config['notifications']['enable_alerts']
-        self.ipv6_prefix_length = config['security'].get('ipv6_prefix_length', 64)
         
         # 初始化Webhook通知器
         self.webhook_notifier = None
@@ -49,7 +100,13 @@ class EmbyMonitor:
         self.auto_disable = config['security']['auto_disable']
         self.alert_threshold = config['notifications']['alert_threshold']
         self.alerts_enabled = config['notifications']['enable_alerts']
-        self.ipv6_prefix_length = config['security'].get('ipv6_prefix_length', 64)
+        ipv6_prefix_length = int(config['security'].get('ipv6_prefix_length') or 64)
+        if ipv6_prefix_length != self.ipv6_prefix_length:
+            self.ipv6_prefix_length = ipv6_prefix_length
+            self._rebuild_network_index()
+        self._configure_enrich_pool(config.get('monitor', {}))
+        self.db.set_write_behind(config.get('monitor', {}).get('write_behind', True))
+        self._configure_scheduled_jobs(config)
 
         webhook_config = config.get('webhook', {})
         try:
@@ -66,182 +123,327 @@ class EmbyMonitor:
             logging.error(f"❌ Webhook通知初始化/更新失败: {e}")
             self.webhook_notifier = None
 
-    def _extract_ip_address(self, remote_endpoint):
-        """智能提取IP地址，支持IPv4和IPv6"""
-        if not remote_endpoint:
-            return ""
-        
-        # 处理IPv6地址格式：[IPv6]:port 或 IPv6%interface:port
-        ipv6_pattern = r'^\[(.*?)\](?::(\d+))?$|^([^%]:*)(?:%[^:]*)?:(?:(\d+))?$'
-        match = re.match(ipv6_pattern, remote_endpoint)
-        
-        if match:
-            # 方括号格式（IPv6）
-            if match.group(1):  # [IPv6]:port格式
-                return match.group(1)
-            # 冒号格式（可能是IPv6）
-            ip_part = match.group(3)
-            if ip_part and self._is_ipv6(ip_part):
-                return ip_part
-            elif ip_part:
-                return ip_part
-        
-        # 如果上面没匹配到，尝试其他方法
-        # 对于IPv6格式2408:8207:28c:3c01:8c5e:7cff:fe2e:2c8e:8096
-        parts = remote_endpoint.split(':')
-        if len(parts) >= 8:  # IPv6至少有8个部分（16进制）
-            # 尝试前8个部分组成IPv6地址
-            potential_ipv6 = ':'.join(parts[:8])
-            if self._is_ipv6(potential_ipv6):
-                return potential_ipv6
-        
-        # 处理IPv4格式
-        ipv4_pattern = r'^(\d+\.\d+\.\d+\.\d+):(\d+)$'
-        match = re.match(ipv4_pattern, remote_endpoint)
-        if match:
-            return match.group(1)
-        
-        # 如果都匹配不到，返回原始值（可能是IPv6直接格式）
-        return remote_endpoint.split('%')[0]  # 移除接口标识
-    
-    def _is_ipv6(self, ip_str):
-        """检查是否为有效的IPv6地址"""
-        try:
-            socket.inet_pton(socket.AF_INET6, ip_str)
-            return True
-        except (socket.error, ValueError):
-            return False
-    
-    def _is_ipv4(self, ip_str):
-        """检查是否为有效的IPv4地址"""
-        try:
-            socket.inet_pton(socket.AF_INET, ip_str)
-            return True
-        except (socket.error, ValueError):
-            return False
-    
-    def _get_ipv6_prefix(self, ipv6_address, prefix_length):
-        """获取IPv6地址的前缀
-        
-        Args:
-            ipv6_address: IPv6地址字符串
-            prefix_length: 前缀长度（比特）
-            
-        Returns:
-            前缀字符串，例如 "2409:8a55:9429:9a90::"（64位前缀）
-        """
-        if not ipv6_address or not self._is_ipv6(ipv6_address):
-            return ipv6_address
-            
-        try:
-            # 将IPv6地址转换为二进制数据
-            binary_data = socket.inet_pton(socket.AF_INET6, ipv6_address)
-            
-            # 计算需要保留的字节数
-            prefix_bytes = prefix_length // 8
-            if prefix_length % 8 != 0:
-                prefix_bytes += 1
-            
-            # 获取前缀字节
-            prefix_binary = binary_data[:prefix_bytes]
-            
-            # 计算需要保留的段数（每个段16位=2字节）
-            prefix_segments = prefix_length // 16
-            if prefix_length % 16 != 0:
-                prefix_segments += 1
-            
-            # 将前缀字节转换回IPv6地址字符串
-            prefix_address = socket.inet_ntop(socket.AF_INET6, prefix_binary.ljust(16, b'\x00'))
-            
-            # 提取前缀部分
-            segments = prefix_address.split(':')
-            prefix_segments = segments[:prefix_segments]
-            
-            # 确保格式正确（添加::如果需要）
-            if len(prefix_segments) < 8:
-                prefix_segments.append('')
-            
-            return ':'.join(prefix_segments)
-            
-        except Exception:
-            return ipv6_address
-    
-    def _is_same_network(self, ip1, ip2):
-        """判断两个IP地址是否属于同一网络
-        
-        Args:
-            ip1: 第一个IP地址
-            ip2: 第二个IP地址
-            
-        Returns:
-            True如果属于同一网络，否则False
-        """
-        if ip1 == ip2:
-            return True
-            
-        # 检查是否都是IPv6地址
-        if self._is_ipv6(ip1) and self._is_ipv6(ip2):
-            # 比较前缀
-            prefix1 = self._get_ipv6_prefix(ip1, self.ipv6_prefix_length)
-            prefix2 = self._get_ipv6_prefix(ip2, self.ipv6_prefix_length)
-            return prefix1 == prefix2
-        
-        # 检查是否都是IPv4地址（直接比较）
-        if self._is_ipv4(ip1) and self._is_ipv4(ip2):
-            return ip1 == ip2
-        
-        # 混合类型，认为不是同一网络
-        return False
+    def _configure_enrich_pool(self, monitor_config):
+        """根据配置（重新）创建会话补全线程池"""
+        workers = max(int(monitor_config.get('enrich_workers', 4) or 1), 1)
+        queue_size = max(int(monitor_config.get('enrich_queue_size', 64) or workers), workers)
+        if workers == self.enrich_workers and queue_size == self.enrich_queue_size:
+            return
+
+        old_executor = self._enrich_executor
+        self.enrich_workers = workers
+        self.enrich_queue_size = queue_size
+        self._enrich_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='session-enrich')
+        self._enrich_slots = threading.BoundedSemaphore(queue_size)
+        if old_executor:
+            # 旧线程池中已提交的任务继续执行完毕，不再接收新任务
+            old_executor.shutdown(wait=False)
+        logging.info(f"🧵 会话补全线程池: 并发 {workers} | 队列上限 {queue_size}")
+
+    def _configure_scheduled_jobs(self, config):
+        """根据配置注册/更新周期任务"""
+        monitor_config = config.get('monitor', {})
+        self.scheduler.add_job('expiry_check', monitor_config.get('expiry_check_interval', 600), self._check_expired_users)
+        self.scheduler.add_job(
+            'ip_cache_cleanup', monitor_config.get('ip_cache_cleanup_interval', 36000), self._cleanup_ip_location_cache
+        )
+        self.scheduler.add_job('metrics_summary', monitor_config.get('metrics_log_interval', 600), self._log_metrics_summary)
+        self.rollup_rebuild_days = monitor_config.get('rollup_rebuild_days', 3)
+        if monitor_config.get('rollup_rebuild_interval', 86400):
+            self.scheduler.add_job(
+                'rollup_rebuild', monitor_config.get('rollup_rebuild_interval', 86400), self._rebuild_recent_rollups
+            )
+        else:
+            self.scheduler.remove_job('rollup_rebuild')
+        ip_location_config = config.get('ip_location', {})
+        # 补查因数据源熔断/超时而返回占位结果的IP归属地
+        self.scheduler.add_job(
+            'location_retry', ip_location_config.get('pending_retry_interval', 30), self.location_service.retry_pending
+        )
+        self.deferred_location = ip_location_config.get('deferred_location', True)
+        self.backfill_batch_size = max(int(ip_location_config.get('backfill_batch_size', 100) or 1), 1)
+        self.scheduler.add_job(
+            'location_backfill', ip_location_config.get('backfill_interval', 10), self._backfill_locations
+        )
+
+        shadow_config = config.get('shadow_library', {})
+        if self.shadow_syncer and shadow_config.get('enabled', True):
+            self.shadow_syncer.sync_interval = shadow_config.get('sync_interval', 3600)
+            self.scheduler.add_job('shadow_sync', self.shadow_syncer.sync_interval, self.shadow_syncer.sync_all)
+        else:
+            self.scheduler.remove_job('shadow_sync')
+
+        archive_config = config.get('archive', {})
+        self.archiver.configure(archive_config)
+        if self.archiver.enabled:
+            self.scheduler.add_job('history_archive', archive_config.get('interval', 3600), self.archiver.run)
+        else:
+            self.scheduler.remove_job('history_archive')
+
+    def _rebuild_recent_rollups(self):
+        self.rollup_rebuilder.rebuild(days=self.rollup_rebuild_days)
+
+    def _network_key(self, ip):
+        """会话所属网络标识：IPv6 取配置长度的前缀，其余直接使用IP"""
+        return network_key(ip, self.ipv6_prefix_length)
+
+    def _index_session(self, session_data):
+        """将会话加入网络索引（调用方需持有 _sessions_lock）"""
+        user_id = session_data['user_id']
+        networks = self._user_networks.setdefault(user_id, {})
+        network = self._network_key(session_data['ip'])
+        networks[network] = networks.get(network, 0) + 1
+        self._user_ip_sessions.setdefault((user_id, session_data['ip']), {})[session_data['session_id']] = None
+
+    def _unindex_session(self, session_data):
+        """将会话移出网络索引（调用方需持有 _sessions_lock）"""
+        user_id = session_data['user_id']
+        networks = self._user_networks.get(user_id, {})
+        network = self._network_key(session_data['ip'])
+        if networks.get(network, 0) > 1:
+            networks[network] -= 1
+        else:
+            networks.pop(network, None)
+            if not networks:
+                self._user_networks.pop(user_id, None)
+
+        ip_key = (user_id, session_data['ip'])
+        sessions = self._user_ip_sessions.get(ip_key, {})
+        sessions.pop(session_data['session_id'], None)
+        if not sessions:
+            self._user_ip_sessions.pop(ip_key, None)
+
+    def _rebuild_network_index(self):
+        """IPv6 前缀长度变化后按当前活跃会话重建网络索引"""
+        with self._sessions_lock:
+            self._user_networks = {}
+            self._user_ip_sessions = {}
+            for session_data in self.active_sessions.values():
+                self._index_session(session_data)
 
     def process_sessions(self):
         """核心会话处理逻辑"""
         try:
-            current_sessions = self.emby.get_active_sessions()
-            self._detect_new_sessions(current_sessions)
-            self._detect_ended_sessions(current_sessions)
-            self._update_session_positions(current_sessions)
+            with self.metrics.stage('emby_sessions'):
+                current_sessions = self.emby.get_active_sessions()
+            if current_sessions is None:
+                # 获取失败不是“没有会话”：保留活跃会话与待对账的检查点，等待下一次成功的快照
+                return
+            self._apply_sessions(current_sessions)
         except Exception as e:
             logging.error(f"❌ 会话更新失败: {str(e)}")
 
+    def _apply_sessions(self, current_sessions):
+        """以一份完整会话快照对账：新增、结束、更新播放位置"""
+        if self._restored_sessions is not None:
+            self._reconcile_restored_sessions(current_sessions)
+        self._detect_new_sessions(current_sessions)
+        self._detect_ended_sessions(current_sessions)
+        self._update_session_positions(current_sessions)
+
+    def _handle_stream_event(self, event_type, data):
+        """处理 WebSocket 推送的会话事件"""
+        try:
+            if event_type == 'sessions':
+                self._apply_sessions(data)
+            elif event_type == 'start':
+                with self._sessions_lock:
+                    known = (
+                        data['Id'] in self.active_sessions
+                        or data['Id'] in self._pending_sessions
+                        or data['Id'] in (self._restored_sessions or {})
+                    )
+                if not known:
+                    self._submit_session_start(data)
+            elif event_type == 'stop':
+                with self._sessions_lock:
+                    known = data in self.active_sessions
+                    if not known and data in self._pending_sessions:
+                        self._stopped_pending_sessions.add(data)
+                if known:
+                    self._record_session_end(data)
+            elif event_type == 'refresh':
+                self.process_sessions()
+        except Exception as e:
+            logging.error(f"❌ 会话事件处理失败({event_type}): {str(e)}")
+
+    def _restore_active_sessions(self):
+        """加载上次运行保存的活跃会话检查点，等待首次会话快照对账"""
+        try:
+            # 不在检查点中的未结束记录是上次运行遗留的，当前进程不会再结束它们
+            orphaned = self.db.close_orphaned_sessions()
+            if orphaned:
+                logging.info(f"♻️ 已将 {orphaned} 条上次运行遗留的未结束播放记录标记为结束")
+        except Exception as e:
+            logging.error(f"❌ 清理遗留的未结束播放记录失败: {str(e)}")
+        try:
+            sessions, saved_at = self.db.load_active_sessions()
+        except Exception as e:
+            logging.error(f"❌ 读取会话检查点失败: {str(e)}")
+            return
+        if not sessions:
+            return
+        self._restored_sessions = {session['session_id']: session for session in sessions}
+        self._restored_at = saved_at
+        logging.info(f"♻️ 已加载 {len(sessions)} 个会话检查点（保存于 {saved_at.strftime('%Y-%m-%d %H:%M:%S')}），等待对账")
+
+    def _reconcile_restored_sessions(self, current_sessions):
+        """用首次完整会话快照对账检查点：仍在播放的直接接管，已结束的补写结束记录"""
+        restored, self._restored_sessions = self._restored_sessions, None
+        ended = []
+        with self._sessions_lock:
+            for session_id, session_data in restored.items():
+                session = current_sessions.get(session_id)
+                if (
+                    session
+                    and session.get('UserId') == session_data['user_id']
+                    and session_id not in self.active_sessions
+                    and session_id not in self._pending_sessions
+                ):
+                    # 沿用原记录与累计播放时长，不重复入库、不重新查询归属地
+                    self.active_sessions[session_id] = session_data
+                    self._index_session(session_data)
+                else:
+                    ended.append(session_data)
+
+        # 停机期间结束的会话，以检查点时间作为结束时间
+        for session_data in ended:
+            duration = session_data.get('playback_duration', 0)
+            if duration == 0:
+                duration = max(int((self._restored_at - session_data['start_time']).total_seconds()), 0)
+            try:
+                self.db.record_session_end(session_data['session_id'], self._restored_at, duration)
+            except Exception as e:
+                logging.error(f"❌ 补写会话结束记录失败: {str(e)}")
+        logging.info(f"♻️ 会话检查点对账完成 | 接管: {len(restored) - len(ended)} | 停机期间结束: {len(ended)}")
+
+    def _flush_writes(self):
+        """将本周期缓冲的会话/安全日志记录在一个事务内写入数据库"""
+        try:
+            with self.metrics.stage('sqlite_flush'):
+                written = self.db.flush_writes()
+            if written:
+                logging.debug(f"💾 批量写入 {written} 条记录")
+        except Exception as e:
+            logging.error(f"❌ 批量写入失败，{self.db.pending_write_count()} 条记录待重试: {str(e)}")
+
+    def _checkpoint_active_sessions(self, force=False):
+        """按 checkpoint_interval 保存活跃会话检查点，force=True 时立即保存"""
+        now = time.monotonic()
+        if not force and now < self._next_checkpoint:
+            return
+        self._next_checkpoint = now + self.config['monitor'].get('checkpoint_interval', 30)
+
+        # 检查点尚未对账前不覆盖，避免再次重启时丢失未接管的会话
+        if self._restored_sessions is not None:
+            return
+        with self._sessions_lock:
+            sessions = [dict(session_data) for session_data in self.active_sessions.values()]
+        try:
+            with self.metrics.stage('checkpoint'):
+                self.db.save_active_sessions(sessions, datetime.now())
+        except Exception as e:
+            logging.error(f"❌ 保存会话检查点失败: {str(e)}")
+
     def _detect_new_sessions(self, current_sessions):
-        """识别新会话"""
-        for session_id, session in current_sessions.items():
-            if session_id not in self.active_sessions:
-                self._record_session_start(session)
+        """识别新会话，提交到补全线程池异步记录"""
+        with self._sessions_lock:
+            new_sessions = [
+                session for session_id, session in current_sessions.items()
+                if session_id not in self.active_sessions and session_id not in self._pending_sessions
+            ]
+        if not new_sessions:
+            return
+
+        # 新会话涉及的用户有未缓存的，先用一次 /emby/Users 批量刷新用户信息缓存
+        try:
+            with self.metrics.stage('user_prefetch'):
+                self.emby.prefetch_users([session['UserId'] for session in new_sessions if session.get('UserId')])
+        except Exception as e:
+            logging.warning(f"⚠️ 批量预取用户信息失败: {str(e)}")
+
+        # 多个新会话同时出现时（如停机后重启），先用一次批量查询把已知归属地载入内存缓存
+        if len(new_sessions) > 1:
+            try:
+                with self.metrics.stage('geolocation_prefetch'):
+                    self.location_service.lookup_many(
+                        [parse_endpoint(session.get('RemoteEndPoint', ''), self.ipv6_prefix_length).ip for session in new_sessions],
+                        resolve=False,
+                    )
+            except Exception as e:
+                logging.warning(f"⚠️ 批量预取IP归属地失败: {str(e)}")
+
+        for session in new_sessions:
+            if not self._submit_session_start(session):
+                break
+
+    def _submit_session_start(self, session):
+        """提交新会话补全任务，队列已满时返回 False，剩余会话留到下一轮轮询"""
+        slots = self._enrich_slots
+        if not slots.acquire(blocking=False):
+            logging.warning(f"⚠️ 会话补全队列已满({self.enrich_queue_size})，剩余新会话延后处理")
+            return False
+
+        session_id = session.get('Id')
+        with self._sessions_lock:
+            self._pending_sessions.add(session_id)
+
+        def on_done(_future):
+            with self._sessions_lock:
+                self._pending_sessions.discard(session_id)
+                stopped = session_id in self._stopped_pending_sessions
+                self._stopped_pending_sessions.discard(session_id)
+                stopped = stopped and session_id in self.active_sessions
+            slots.release()
+            if stopped:
+                self._record_session_end(session_id)
+
+        try:
+            future = self._enrich_executor.submit(self._record_session_start, session, datetime.now())
+        except RuntimeError as e:
+            on_done(None)
+            logging.error(f"❌ 提交会话补全任务失败: {str(e)}")
+            return False
+        future.add_done_callback(on_done)
+        return True
 
     def _detect_ended_sessions(self, current_sessions):
         """识别结束会话"""
-        ended = set(self.active_sessions.keys()) - set(current_sessions.keys())
+        with self._sessions_lock:
+            ended = set(self.active_sessions.keys()) - set(current_sessions.keys())
         for sid in ended:
             self._record_session_end(sid)
 
     def _update_session_positions(self, current_sessions):
         """更新活跃会话的播放位置"""
-        for session_id, session in current_sessions.items():
-            if session_id in self.active_sessions:
-                play_state = session.get('PlayState', {})
-                position_ticks = play_state.get('PositionTicks', 0)
-                
-                # 获取上次记录的播放位置
-                last_position_ticks = self.active_sessions[session_id].get('last_position_ticks', 0)
-                
-                # 计算增量播放时长（秒）
-                if position_ticks > last_position_ticks:
-                    # 播放位置前进，累加播放时长
-                    delta_ticks = position_ticks - last_position_ticks
-                    delta_seconds = int(delta_ticks / 10000000)
-                    current_duration = self.active_sessions[session_id].get('playback_duration', 0)
-                    self.active_sessions[session_id]['playback_duration'] = current_duration + delta_seconds
-                
-                # 更新上次播放位置
-                self.active_sessions[session_id]['last_position_ticks'] = position_ticks
-
-    def _record_session_start(self, session):
-        """记录新会话"""
+        with self._sessions_lock:
+            for session_id, session in current_sessions.items():
+                if session_id in self.active_sessions:
+                    play_state = session.get('PlayState', {})
+                    position_ticks = play_state.get('PositionTicks', 0)
+
+                    # 获取上次记录的播放位置
+                    last_position_ticks = self.active_sessions[session_id].get('last_position_ticks', 0)
+
+                    # 计算增量播放时长（秒）
+                    if position_ticks > last_position_ticks:
+                        # 播放位置前进，累加播放时长
+                        delta_ticks = position_ticks - last_position_ticks
+                        delta_seconds = int(delta_ticks / 10000000)
+                        current_duration = self.active_sessions[session_id].get('playback_duration', 0)
+                        self.active_sessions[session_id]['playback_duration'] = current_duration + delta_seconds
+
+                    # 更新上次播放位置
+                    self.active_sessions[session_id]['last_position_ticks'] = position_ticks
+
+    def _record_session_start(self, session, start_time=None):
+        """记录新会话（在补全线程池中执行）"""
         try:
             user_id = session['UserId']
-            user_info = self.emby.get_user_info(user_id)
-            ip_address = self._extract_ip_address(session.get('RemoteEndPoint', ''))
+            with self.metrics.stage('user_info'):
+                user_info = self.emby.get_user_info(user_id)
+            endpoint = parse_endpoint(session.get('RemoteEndPoint', ''), self.ipv6_prefix_length)
+            ip_address = endpoint.ip
             username = user_info.get('Name', '未知用户').strip()
 
             # 白名单检查 - 记录信息但不封禁
@@ -251,8 +453,11 @@ class EmbyMonitor:
             media_item = session.get('NowPlayingItem', {})
             media_name = self.emby.parse_media_info(media_item)
             
-            # 获取地理位置
-            location = self._get_location(ip_address)
+            # 获取地理位置；延迟解析时只查内存/数据库/网段索引，未命中先记为占位值，由回填任务补全
+            if self.deferred_location:
+                location = self._get_known_location(ip_address)
+            else:
+                location = self._get_location(ip_address)
 
             session_data = {
                 'session_id': session['Id'],
@@ -262,17 +467,20 @@ class EmbyMonitor:
                 'device': session.get('DeviceName', '未知设备'),
                 'client': session.get('Client', '未知客户端'),
                 'media': media_name,
-                'start_time': datetime.now(),
+                'start_time': start_time or datetime.now(),
                 'location': location,
                 'playback_duration': 0,
                 'last_position_ticks': 0
             }
 
-            self.db.record_session_start(session_data)
-            self.active_sessions[session['Id']] = session_data
+            with self.metrics.stage('sqlite'):
+                self.db.record_session_start(session_data)
+            with self._sessions_lock:
+                self.active_sessions[session['Id']] = session_data
+                self._index_session(session_data)
             
             # 显示IP地址类型信息
-            ip_type = "IPv6" if self._is_ipv6(ip_address) else "IPv4" if self._is_ipv4(ip_address) else "未知"
+            ip_type = ip_type_label(ip_address)
             if is_whitelist:
                 logging.info(f"[▶] {username} (白名单) | 设备: {session_data['device']} | IP: {ip_address} ({ip_type}) | 位置: {location} | 内容: {session_data['media']}")
             else:
@@ -288,7 +496,9 @@ class EmbyMonitor:
     def _record_session_end(self, session_id):
         """记录会话结束"""
         try:
-            session_data = self.active_sessions[session_id]
+            with self._sessions_lock:
+                session_data = self.active_sessions.pop(session_id)
+                self._unindex_session(session_data)
             end_time = datetime.now()
             
             # 使用内存中记录的实际播放时长
@@ -298,9 +508,9 @@ class EmbyMonitor:
             if duration == 0:
                 duration = int((end_time - session_data['start_time']).total_seconds())
             
-            self.db.record_session_end(session_id, end_time, duration)
+            with self.metrics.stage('sqlite'):
+                self.db.record_session_end(session_id, end_time, duration)
             logging.info(f"[■] {session_data['username']} | 时长: {duration//60}分{duration%60}秒")
-            del self.active_sessions[session_id]
         except KeyError:
             logging.warning(f"⚠️ 会话 {session_id} 已不存在")
         except Exception as e:
@@ -312,32 +522,85 @@ class EmbyMonitor:
             return "未知位置"
 
         try:
-            info = self.location_service.lookup(ip_address)
+            with self.metrics.stage('geolocation'):
+                info = self.location_service.lookup(ip_address)
             return info.get("formatted", "未知位置")
         except Exception as e:
             logging.error(f"📍 解析 {ip_address} 失败: {str(e)}")
             return "解析失败"
 
+    def _get_known_location(self, ip_address):
+        """不调用外部查询获取归属地，未知时返回占位值并加入回填队列"""
+        if not ip_address:
+            return "未知位置"
+
+        try:
+            with self.metrics.stage('geolocation'):
+                info = self.location_service.lookup_many([ip_address], resolve=False)[0]
+        except Exception as e:
+            logging.error(f"📍 读取 {ip_address} 归属地缓存失败: {str(e)}")
+            info = None
+        if info and info.get("provider") != PENDING_PROVIDER:
+            return info.get("formatted", "未知位置")
+
+        with self._sessions_lock:
+            self._pending_location_ips[ip_address] = None
+        return PENDING_LOCATION
+
+    def _seed_pending_locations(self):
+        """重启后把数据库中仍为占位归属地的IP重新加入回填队列"""
+        try:
+            ip_addresses = self.db.get_pending_location_ips(PENDING_LOCATION)
+        except Exception as e:
+            logging.error(f"❌ 读取待回填归属地的记录失败: {str(e)}")
+            return
+        if ip_addresses:
+            with self._sessions_lock:
+                self._pending_location_ips.update(dict.fromkeys(ip_addresses))
+            logging.info(f"📍 {len(ip_addresses)} 个IP的归属地待回填")
+
+    def _backfill_locations(self):
+        """分批解析占位归属地的IP，更新播放记录和活跃会话（周期任务）"""
+        with self._sessions_lock:
+            ip_addresses = list(self._pending_location_ips)[:self.backfill_batch_size]
+        if not ip_addresses:
+            return
+
+        with self.metrics.stage('location_backfill'):
+            infos = self.location_service.lookup_many(ip_addresses)
+
+        filled = 0
+        for ip_address, info in zip(ip_addresses, infos):
+            # 数据源仍不可用（占位结果）时保留在队列中，下次再试
+            if not info or info.get("provider") == PENDING_PROVIDER:
+                continue
+            location = info.get("formatted") or "未知位置"
+            with self._sessions_lock:
+                self._pending_location_ips.pop(ip_address, None)
+                for session_data in self.active_sessions.values():
+                    if session_data['ip'] == ip_address and session_data.get('location') == PENDING_LOCATION:
+                        session_data['location'] = location
+            self.db.backfill_location(ip_address, location, PENDING_LOCATION)
+            filled += 1
+
+        if filled:
+            with self._sessions_lock:
+                remaining = len(self._pending_location_ips)
+            logging.info(f"📍 已回填 {filled} 个IP的归属地，剩余 {remaining} 个")
+
     def _check_login_abnormality(self, user_id, new_ip):
         """检测登录异常"""
         if not self.alerts_enabled:
             return
         
-        existing_networks = set()
-        for sess in self.active_sessions.values():
-            if sess['user_id'] == user_id:
-                existing_ip = sess['ip']
-                # 如果是同一网络，跳过
-                if not self._is_same_network(existing_ip, new_ip):
-                    # 对于IPv6，存储网络前缀
-                    if self._is_ipv6(existing_ip):
-                        network = self._get_ipv6_prefix(existing_ip, self.ipv6_prefix_length)
-                    else:
-                        network = existing_ip
-                    existing_networks.add(network)
+        # 同一网络（相同IP或相同IPv6前缀）的会话不计入，只统计其他网络的数量
+        new_network = self._network_key(new_ip)
+        with self._sessions_lock:
+            networks = self._user_networks.get(user_id, {})
+            other_network_count = len(networks) - (1 if new_network in networks else 0)
         
-        if len(existing_networks) >= (self.alert_threshold - 1):
-            self._trigger_alert(user_id, new_ip, len(existing_networks)+1)
+        if other_network_count >= (self.alert_threshold - 1):
+            self._trigger_alert(user_id, new_ip, other_network_count+1)
 
     def _trigger_alert(self, user_id, trigger_ip, session_count):
         """触发安全告警"""
@@ -350,14 +613,16 @@ class EmbyMonitor:
                 logging.info(f"⚪ 白名单用户 [{username}] 受保护，跳过禁用")
                 return
 
+            # 告警随会话补全在线程池中执行，延迟解析时也同步查询，告警与 Webhook 中给出实际归属地
             location = self._get_location(trigger_ip)
-            ip_type = "IPv6" if self._is_ipv6(trigger_ip) else "IPv4" if self._is_ipv4(trigger_ip) else "未知"
+            ip_type = ip_type_label(trigger_ip)
             
             # 记录会话信息以获取设备等详细信息
             device = "未知设备"
             client = "未知客户端"
-            for sess in self.active_sessions.values():
-                if sess['user_id'] == user_id and sess['ip'] == trigger_ip:
+            with self._sessions_lock:
+                for session_id in self._user_ip_sessions.get((user_id, trigger_ip), {}):
+                    sess = self.active_sessions[session_id]
                     device = sess.get('device', '未知设备')
                     client = sess.get('client', '未知客户端')
                     break
@@ -399,7 +664,8 @@ class EmbyMonitor:
             return
         
         try:
-            success = self.webhook_notifier.send_ban_notification(user_info)
+            with self.metrics.stage('webhook'):
+                success = self.webhook_notifier.send_ban_notification(user_info)
             if success:
                 logging.info(f"🔔 Webhook通知已发送: {user_info['username']}")
             else:
@@ -432,98 +698,213 @@ class EmbyMonitor:
             logging.error(f"❌ 安全日志记录失败: {str(e)}")
 
     def _check_expired_users(self):
-        """检查并封禁到期用户"""
+        """检查并封禁到期用户：一次拉取全部用户，用集合运算筛出待封禁用户后并发封禁"""
+        started = time.monotonic()
         try:
-            # 获取所有已到期但未禁用的用户
-            expired_users = self.db.get_all_expired_users()
-
-            for user_id in expired_users:
-                try:
-                    # 获取用户信息
-                    user_info = self.emby.get_user_info(user_id)
-                    if not user_info:
-                        continue
-
-                    username = user_info.get('Name', '未知用户').strip()
-
-                    # 检查是否已在白名单
-                    if username.lower() in self.whitelist:
-                        logging.info(f"⚪ 白名单用户 [{username}] 到期但受保护，跳过禁用")
-                        continue
-
-                    # 检查用户是否已被禁用
-                    is_disabled = user_info.get('Policy', {}).get('IsDisabled', False)
-                    if is_disabled:
-                        continue
-
-                    # 封禁用户
-                    if self.security.disable_user(user_id, username):
-                        logging.info(f"🔒 用户 [{username}] 账号已到期，自动封禁")
-
-                        # 记录安全日志
-                        log_data = {
-                            'timestamp': datetime.now(),
-                            'user_id': user_id,
-                            'username': username,
-                            'trigger_ip': 'system',
-                            'active_sessions': 0,
-                            'action': 'DISABLE_EXPIRED'
-                        }
-                        self.db.log_security_event(log_data)
-
-                        # 发送Webhook通知
-                        self._send_webhook_notification({
-                            'username': username,
-                            'user_id': user_id,
-                            'ip_address': 'system',
-                            'ip_type': 'N/A',
-                            'location': '系统自动',
-                            'session_count': 0,
-                            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                            'reason': '账号已到期',
-                            'device': 'N/A',
-                            'client': 'N/A'
-                        })
-
-                except Exception as e:
-                    logging.error(f"❌ 处理到期用户 {user_id} 失败: {str(e)}")
+            expired_ids = set(self.db.get_all_expired_users())
+            if not expired_ids:
+                return
 
+            users = {user['Id']: user for user in self.emby.get_users() or [] if user.get('Id')}
+            known_ids = expired_ids & users.keys()
+            disabled_ids = {
+                user_id for user_id in known_ids
+                if users[user_id].get('Policy', {}).get('IsDisabled', False)
+            }
+            whitelist_ids = {
+                user_id for user_id in known_ids
+                if (users[user_id].get('Name') or '').strip().lower() in self.whitelist
+            }
+            for user_id in whitelist_ids:
+                logging.info(f"⚪ 白名单用户 [{(users[user_id].get('Name') or '未知用户').strip()}] 到期但受保护，跳过禁用")
+            target_ids = known_ids - disabled_ids - whitelist_ids
+
+            disabled_count = 0
+            if target_ids:
+                workers = min(max(int(self.config['monitor'].get('expiry_workers', 4) or 1), 1), len(target_ids))
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='expiry-disable') as executor:
+                    results = executor.map(
+                        lambda user_id: self._disable_expired_user(user_id, (users[user_id].get('Name') or '未知用户').strip()),
+                        target_ids,
+                    )
+                    disabled_count = sum(1 for ok in results if ok)
+
+            self.last_expiry_check = {
+                'expired': len(expired_ids),
+                'missing': len(expired_ids - known_ids),
+                'already_disabled': len(disabled_ids),
+                'whitelisted': len(whitelist_ids - disabled_ids),
+                'targets': len(target_ids),
+                'disabled': disabled_count,
+                'duration_ms': int((time.monotonic() - started) * 1000),
+            }
+            if target_ids:
+                stats = self.last_expiry_check
+                logging.info(
+                    f"⏰ 到期检查 | 到期: {stats['expired']} | 已禁用: {stats['already_disabled']} | "
+                    f"白名单: {stats['whitelisted']} | 不存在: {stats['missing']} | "
+                    f"封禁: {stats['disabled']}/{stats['targets']} | 耗时: {stats['duration_ms']}ms"
+                )
         except Exception as e:
             logging.error(f"❌ 检查到期用户失败: {str(e)}")
 
-    def run(self):
-        """启动监控服务"""
-        logging.info(f"🔍 监控服务启动 | 数据库: {self.config['database']['name']}")
+    def _disable_expired_user(self, user_id, username):
+        """封禁单个到期用户并记录日志、发送通知（在线程池中执行）"""
+        try:
+            if not self.security.disable_user(user_id, username):
+                return False
+            logging.info(f"🔒 用户 [{username}] 账号已到期，自动封禁")
 
-        # 到期用户检查计数器
-        expiry_check_counter = 0
-        expiry_check_interval = 60  # 每60个主循环周期检查一次到期用户
+            # 记录安全日志
+            log_data = {
+                'timestamp': datetime.now(),
+                'user_id': user_id,
+                'username': username,
+                'trigger_ip': 'system',
+                'active_sessions': 0,
+                'action': 'DISABLE_EXPIRED'
+            }
+            self.db.log_security_event(log_data)
 
-        # IP归属地缓存清理计数器
-        ip_cache_cleanup_counter = 0
-        ip_cache_cleanup_interval = 7200  # 每7200个主循环周期清理一次IP归属地缓存（约10小时）
+            # 发送Webhook通知
+            self._send_webhook_notification({
+                'username': username,
+                'user_id': user_id,
+                'ip_address': 'system',
+                'ip_type': 'N/A',
+                'location': '系统自动',
+                'session_count': 0,
+                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'reason': '账号已到期',
+                'device': 'N/A',
+                'client': 'N/A'
+            })
+            return True
+        except Exception as e:
+            logging.error(f"❌ 处理到期用户 {user_id} 失败: {str(e)}")
+            return False
 
+    def _cleanup_ip_location_cache(self):
+        """清理30天前的IP归属地缓存记录"""
         try:
-            while True:
+            deleted_count = self.db.cleanup_old_ip_locations(days=30)
+            if deleted_count > 0:
+                logging.info(f"🧹 已清理 {deleted_count} 条30天前的IP归属地缓存记录")
+        except Exception as e:
+            logging.error(f"❌ 清理IP归属地缓存失败: {str(e)}")
+
+    def _run_periodic_tasks(self):
+        """每个轮询周期结束时执行：批量写入本周期记录、保存会话检查点"""
+        self._flush_writes()
+        self._checkpoint_active_sessions()
+
+    def _start_session_stream(self):
+        """启动 WebSocket 会话订阅，依赖缺失时返回 False 以回退到轮询模式"""
+        if not EmbySessionStream.is_available():
+            logging.warning("⚠️ 未安装 websocket-client，WebSocket 模式不可用，回退为轮询模式")
+            return False
+
+        self._session_stream = EmbySessionStream(
+            server_url=self.emby.server_url,
+            api_key=self.emby.api_key,
+            on_event=lambda event_type, data: self._event_queue.put((event_type, data)),
+            ws_url=self.config['monitor'].get('websocket_url') or None,
+        )
+        self._session_stream.start()
+        return True
+
+    def _end_cycle(self):
+        """结束一个轮询周期的计时，超过 check_interval 时输出各阶段耗时分解"""
+        elapsed_ms, breakdown = self.metrics.end_cycle()
+        check_interval_ms = self.config['monitor']['check_interval'] * 1000
+        if elapsed_ms <= check_interval_ms:
+            return
+        parts = [f"{stage}: {ms:.0f}ms" for stage, ms in sorted(breakdown.items(), key=lambda item: -item[1])]
+        other_ms = max(elapsed_ms - sum(breakdown.values()), 0)
+        parts.append(f"other: {other_ms:.0f}ms")
+        logging.warning(f"🐢 慢周期 {elapsed_ms:.0f}ms > {check_interval_ms}ms | {' | '.join(parts)}")
+
+    def _log_metrics_summary(self):
+        """定期输出各阶段耗时统计"""
+        for stage, stats in self.metrics.snapshot().items():
+            logging.info(
+                f"📊 {stage} | 次数: {stats['count']} | p50: {stats['p50_ms']}ms | p95: {stats['p95_ms']}ms | "
+                f"p99: {stats['p99_ms']}ms | max: {stats['max_ms']}ms"
+            )
+
+    def _run_poll_loop(self):
+        while True:
+            self.metrics.begin_cycle()
+            self.process_sessions()
+            self._run_periodic_tasks()
+            self._end_cycle()
+            time.sleep(self.config['monitor']['check_interval'])
+
+    def _run_event_loop(self):
+        """WebSocket 模式主循环：实时消费事件，并以较慢的轮询兜底对账"""
+        check_interval = self.config['monitor']['check_interval']
+        reconcile_interval = max(self.config['monitor'].get('reconcile_interval', 60), check_interval)
+        next_tick = time.monotonic() + check_interval
+        next_reconcile = time.monotonic() + reconcile_interval
+
+        # 有待对账的会话检查点时立即取一次完整快照，避免事件先于对账到达
+        if self._restored_sessions is not None:
+            self.process_sessions()
+
+        while True:
+            try:
+                event_type, data = self._event_queue.get(timeout=max(next_tick - time.monotonic(), 0))
+                self._handle_stream_event(event_type, data)
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            if now < next_tick:
+                continue
+
+            # 连接断开期间按 check_interval 轮询，连接正常时按 reconcile_interval 对账
+            self.metrics.begin_cycle()
+            if not self._session_stream.connected or now >= next_reconcile:
                 self.process_sessions()
+                next_reconcile = now + reconcile_interval
+            self._run_periodic_tasks()
+            self._end_cycle()
+            next_tick = now + check_interval
 
-                # 定期检查到期用户
-                expiry_check_counter += 1
-                if expiry_check_counter >= expiry_check_interval:
-                    self._check_expired_users()
-                    expiry_check_counter = 0
-
-                # 定期清理IP归属地缓存
-                ip_cache_cleanup_counter += 1
-                if ip_cache_cleanup_counter >= ip_cache_cleanup_interval:
-                    try:
-                        deleted_count = self.db.cleanup_old_ip_locations(days=30)
-                        if deleted_count > 0:
-                            logging.info(f"🧹 已清理 {deleted_count} 条30天前的IP归属地缓存记录")
-                    except Exception as e:
-                        logging.error(f"❌ 清理IP归属地缓存失败: {str(e)}")
-                    ip_cache_cleanup_counter = 0
-
-                time.sleep(self.config['monitor']['check_interval'])
+    def run(self):
+        """启动监控服务"""
+        mode = self.config['monitor'].get('mode', 'poll')
+        logging.info(f"🔍 监控服务启动 | 数据库: {self.config['database']['name']} | 模式: {mode}")
+        # 后台预热IP归属地内存缓存，不阻塞轮询
+        self.location_service.start_warm_up()
+        self._restore_active_sessions()
+        self._seed_pending_locations()
+        # 启动时用一次 /emby/Users 预热用户信息缓存
+        self.emby.get_users()
+        self.scheduler.start()
+
+        try:
+            if mode == 'websocket' and self._start_session_stream():
+                self._run_event_loop()
+            else:
+                self._run_poll_loop()
         except KeyboardInterrupt:
             logging.info("\n👋 监控服务停止")
+        finally:
+            self.scheduler.stop()
+            self.location_service.close()
+            if self._session_stream:
+                self._session_stream.stop()
+            if self._enrich_executor:
+                self._enrich_executor.shutdown(wait=True, cancel_futures=True)
+            pending = self.db.pending_write_count()
+            if pending:
+                logging.info(f"💾 停止前写入 {pending} 条缓冲记录")
+            self._flush_writes()
+            self._checkpoint_active_sessions(force=True)
+            # 最后写入检查点后关闭所有线程的数据库连接（含 WAL 检查点）
+            try:
+                closed = self.db.close()
+                logging.info(f"💾 已关闭 {closed} 个数据库连接")
+            except Exception as e:
+                logging.error(f"❌ 关闭数据库连接失败: {str(e)}")
@@ -0,0 +1,132 @@
+"""观看时长汇总表的重建
+
+汇总表（用户/影片/客户端/小时 × 天）由触发器 trg_playback_history_rollup 在会话结束时增量维护（见迁移 v6）。
+重建按自然月分段：每段在一个写事务内删除该时间段的汇总，再从主库播放记录和对应月份的归档库重新聚合，
+段与段之间释放写锁。重建期间暂停归档任务，避免记录在主库与归档库之间移动造成重复或遗漏。
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+
+from history_archive import connect_archive, list_archives
+
+logger = logging.getLogger(__name__)
+
+# 表名 -> (写入的列, 对应的聚合表达式, 主键列)
+ROLLUP_TABLES = {
+    'rollup_user_day': (
+        'day, user_id, username',
+        'substr(start_time, 1, 10), user_id, MAX(username)',
+        'day, user_id',
+    ),
+    'rollup_media_day': (
+        'day, media_name',
+        "substr(start_time, 1, 10), COALESCE(media_name, '')",
+        'day, media_name',
+    ),
+    'rollup_client_day': (
+        'day, client_type, device_name',
+        "substr(start_time, 1, 10), COALESCE(client_type, ''), COALESCE(device_name, '')",
+        'day, client_type, device_name',
+    ),
+    'rollup_hour_day': (
+        'day, hour',
+        'substr(start_time, 1, 10), CAST(substr(start_time, 12, 2) AS INTEGER)',
+        'day, hour',
+    ),
+}
+
+
+def rollup_aggregate_sql(table):
+    """从 playback_history 聚合 [开始日期, 结束日期) 内已结束会话的 SQL，主库与归档库通用"""
+    _columns, expressions, keys = ROLLUP_TABLES[table]
+    group_by = ', '.join(str(index) for index in range(1, len(keys.split(',')) + 1))
+    return f'''
+        SELECT {expressions}, COUNT(*), SUM(MAX(COALESCE(duration, 0), 0))
+        FROM playback_history
+        WHERE end_time IS NOT NULL AND start_time >= ? AND start_time < ?
+        GROUP BY {group_by}
+    '''
+
+
+def _month_ranges(first_day, last_day):
+    """把 [first_day, last_day] 按自然月切分为 [(开始, 结束)) 日期字符串区间"""
+    start = first_day
+    while start <= last_day:
+        next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        end = min(next_month, last_day + timedelta(days=1))
+        yield start.isoformat(), end.isoformat()
+        start = end
+
+
+class RollupRebuilder:
+    def __init__(self, db_manager, archiver=None, segment_pause=0.05):
+        self.db = db_manager
+        self.archiver = archiver
+        self.segment_pause = segment_pause
+        self.last_run = None
+        self._lock = threading.Lock()
+
+    def rebuild(self, days=None):
+        """重建最近 days 天（None 表示全部历史）的汇总；已有重建在进行时返回 None"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            started = time.monotonic()
+            with self.archiver.exclusive() if self.archiver else nullcontext():
+                today = date.today()
+                first_day = today - timedelta(days=max(int(days), 1) - 1) if days else self._first_history_day()
+                segments = 0
+                if first_day:
+                    for start, end in _month_ranges(first_day, today):
+                        self.db.replace_rollups(start, end, self._archive_aggregates(start, end))
+                        segments += 1
+                        time.sleep(self.segment_pause)
+            elapsed = time.monotonic() - started
+            self.last_run = {
+                'finished_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'from_day': first_day.isoformat() if first_day else None,
+                'segments': segments,
+                'elapsed_sec': round(elapsed, 2),
+            }
+            logger.info('观看时长汇总重建完成: 起始日期=%s，%s 段，耗时 %.1fs', self.last_run['from_day'], segments, elapsed)
+            return self.last_run
+        finally:
+            self._lock.release()
+
+    def _first_history_day(self):
+        candidates = [self.db.get_first_history_day()]
+        # 时间格式异常的记录归档在 0000-00，无法按日期汇总
+        months = [month for month, _path in list_archives(self._archive_dir()) if month != '0000-00']
+        if months:
+            candidates.append(f'{min(months)}-01')
+        candidates = [day for day in candidates if day]
+        if not candidates:
+            return None
+        try:
+            return datetime.strptime(min(candidates), '%Y-%m-%d').date()
+        except ValueError:
+            logger.warning('无法解析最早的播放记录日期: %s', min(candidates))
+            return None
+
+    def _archive_dir(self):
+        return getattr(self.db, 'archive_dir', None)
+
+    def _archive_aggregates(self, start, end):
+        """同一月份的归档库中该时间段的聚合结果 {表名: [行]}"""
+        archive_dir = self._archive_dir()
+        path = os.path.join(archive_dir, f'history-{start[:7]}.db') if archive_dir else None
+        if not path or not os.path.exists(path):
+            return {}
+        conn = connect_archive(path)
+        try:
+            return {table: conn.execute(rollup_aggregate_sql(table), (start, end)).fetchall() for table in ROLLUP_TABLES}
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {'last_run': self.last_run, 'running': self._lock.locked()}
@@ -0,0 +1,165 @@
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledJob:
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.next_run = 0.0
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.overlap_skips = 0
+        self.last_run_at = None
+        self.last_duration = None
+        self.last_error = None
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'interval': self.interval,
+            'running': self.running,
+            'runs': self.runs,
+            'failures': self.failures,
+            'overlap_skips': self.overlap_skips,
+            'last_run_at': self.last_run_at.strftime('%Y-%m-%d %H:%M:%S') if self.last_run_at else None,
+            'last_duration': round(self.last_duration, 3) if self.last_duration is not None else None,
+            'last_error': self.last_error,
+            'next_run_in': max(round(self.next_run - time.monotonic(), 1), 0),
+        }
+
+
+class TaskScheduler:
+    """按固定时间间隔（单调时钟）执行周期任务的调度器
+
+    调度线程维护一个按下次执行时间排序的最小堆，到期任务交给线程池执行，
+    不占用监控轮询线程。上一次执行尚未结束时本次跳过并计入 overlap_skips。
+    max_workers 为 None 时线程池随注册的任务数扩容：同一任务不会并发执行，
+    线程数不少于任务数即可保证耗时长的任务（如归档、重建汇总）不会让其他到期任务排队。
+    """
+
+    def __init__(self, max_workers=None):
+        self._jobs = {}
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._auto_size = max_workers is None
+        self._workers = 1 if max_workers is None else max_workers
+        self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='scheduler-job')
+        self._thread = None
+        self._running = False
+
+    def add_job(self, name, interval, func, initial_delay=None):
+        """添加或更新周期任务；interval 变化时按新间隔重新排期"""
+        interval = float(interval)
+        if interval <= 0:
+            raise ValueError(f'任务间隔必须大于0: {name}')
+
+        with self._cond:
+            job = self._jobs.get(name)
+            if job and job.interval == interval:
+                job.func = func
+                return
+            if not job:
+                job = ScheduledJob(name, interval, func)
+                self._jobs[name] = job
+                self._ensure_workers()
+            job.interval = interval
+            job.func = func
+            delay = interval if initial_delay is None else initial_delay
+            self._push(job, time.monotonic() + delay)
+            self._cond.notify()
+
+    def remove_job(self, name):
+        with self._cond:
+            self._jobs.pop(name, None)
+            self._cond.notify()
+
+    def get_stats(self):
+        with self._cond:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._loop, name='task-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _ensure_workers(self):
+        if not self._auto_size or len(self._jobs) <= self._workers:
+            return
+        old_executor = self._executor
+        self._workers = len(self._jobs)
+        self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='scheduler-job')
+        # 旧线程池中正在执行的任务继续执行完毕，不再接收新任务
+        old_executor.shutdown(wait=False)
+
+    def _push(self, job, next_run):
+        # 堆中可能残留同一任务的旧条目，弹出时以 job.next_run 校验是否仍然有效
+        job.next_run = next_run
+        self._seq += 1
+        heapq.heappush(self._heap, (next_run, self._seq, job))
+
+    def _loop(self):
+        with self._cond:
+            while self._running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                next_run, _, job = self._heap[0]
+                if self._jobs.get(job.name) is not job or next_run != job.next_run:
+                    heapq.heappop(self._heap)
+                    continue
+
+                now = time.monotonic()
+                if next_run > now:
+                    self._cond.wait(next_run - now)
+                    continue
+
+                heapq.heappop(self._heap)
+                # 以计划时间推进，避免执行耗时带来的周期漂移；落后太多时从当前时间重新计算
+                self._push(job, max(next_run + job.interval, now))
+                if job.running:
+                    job.overlap_skips += 1
+                    logger.warning('周期任务仍在执行，本次跳过: job=%s', job.name)
+                    continue
+                job.running = True
+                self._executor.submit(self._run_job, job)
+
+    def _run_job(self, job):
+        started = time.monotonic()
+        started_at = datetime.now()
+        error = None
+        try:
+            job.func()
+        except Exception as exc:
+            error = str(exc)
+            logger.exception('周期任务执行失败: job=%s, error=%s', job.name, exc)
+        finally:
+            with self._cond:
+                job.running = False
+                job.runs += 1
+                job.last_run_at = started_at
+                job.last_duration = time.monotonic() - started
+                job.last_error = error
+                if error:
+                    job.failures += 1
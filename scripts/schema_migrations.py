@@ -0,0 +1,377 @@
+"""主数据库的版本化结构迁移
+
+schema_version 表记录已执行的迁移版本。新增表、列或索引时在 MIGRATIONS 末尾追加 (版本号, 说明, 函数)，
+版本号递增，已发布的迁移不再修改。每个迁移在单独的写事务中执行，失败时回滚并抛出异常。
+早于本机制创建的数据库版本记为 0，前几个迁移均可重复执行（IF NOT EXISTS / 先检查列），因此可以直接升级。
+"""
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _column_names(conn, table_name):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table_name})').fetchall()}
+
+
+def _create_base_tables(conn):
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS playback_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            username TEXT NOT NULL,
+            ip_address TEXT NOT NULL,
+            device_name TEXT,
+            client_type TEXT,
+            media_name TEXT,
+            start_time DATETIME NOT NULL,
+            end_time DATETIME,
+            duration INTEGER,
+            location TEXT
+        )
+        '''
+    )
+
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS security_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp DATETIME,
+            user_id TEXT,
+            username TEXT,
+            trigger_ip TEXT,
+            active_sessions INTEGER,
+            action TEXT
+        )
+        '''
+    )
+
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS user_expiry (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL UNIQUE,
+            expiry_date DATE,
+            never_expire INTEGER DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    )
+
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS user_groups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id TEXT NOT NULL UNIQUE,
+            name TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    )
+
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS user_group_members (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(group_id, user_id)
+        )
+        '''
+    )
+
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS invites (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT NOT NULL UNIQUE,
+            expires_at DATETIME NOT NULL,
+            max_uses INTEGER NOT NULL,
+            used_count INTEGER DEFAULT 0,
+            group_id TEXT,
+            account_expiry_date DATE,
+            is_active INTEGER DEFAULT 1,
+            created_by TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    )
+
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS ip_location_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ip_address TEXT NOT NULL UNIQUE,
+            provider TEXT NOT NULL,
+            location TEXT,
+            district TEXT,
+            street TEXT,
+            isp TEXT,
+            latitude REAL,
+            longitude REAL,
+            formatted TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    )
+
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS geocache_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload TEXT NOT NULL,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    )
+
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS active_session_checkpoint (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            username TEXT,
+            ip_address TEXT,
+            device_name TEXT,
+            client_type TEXT,
+            media_name TEXT,
+            start_time DATETIME NOT NULL,
+            location TEXT,
+            playback_duration INTEGER DEFAULT 0,
+            last_position_ticks INTEGER DEFAULT 0,
+            saved_at DATETIME NOT NULL
+        )
+        '''
+    )
+
+
+def _add_security_log_username(conn):
+    if 'username' not in _column_names(conn, 'security_log'):
+        conn.execute('ALTER TABLE security_log ADD COLUMN username TEXT')
+
+
+def _add_user_expiry_never_expire(conn):
+    if 'never_expire' not in _column_names(conn, 'user_expiry'):
+        conn.execute('ALTER TABLE user_expiry ADD COLUMN never_expire INTEGER DEFAULT 0')
+
+
+def _add_hot_path_indexes(conn):
+    # record_session_end：只索引未结束的会话，索引很小且随会话结束自动移出
+    conn.execute(
+        '''
+        CREATE INDEX IF NOT EXISTS idx_playback_history_open_session
+        ON playback_history(session_id) WHERE end_time IS NULL
+        '''
+    )
+    # get_user_playback_records / get_playback_records_by_username：按用户过滤并按开始时间倒序取前 N 条
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_playback_history_user_start ON playback_history(user_id, start_time)'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_playback_history_username_start ON playback_history(username, start_time)'
+    )
+    # 归属地回填：按占位值查找IP、按 IP + 占位值更新
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_playback_history_location_ip ON playback_history(location, ip_address)'
+    )
+    # get_user_ban_info / get_ban_info_by_username：过滤列与排序列都在索引中，无需回表排序
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_security_log_user_action ON security_log(user_id, action, timestamp)'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_security_log_username_action ON security_log(username, action, timestamp)'
+    )
+    # get_security_logs：按时间排序
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_security_log_timestamp ON security_log(timestamp)')
+
+
+def _add_history_time_indexes(conn):
+    # 保留期归档按开始时间从旧到新分批读取
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_playback_history_start ON playback_history(start_time)')
+
+
+def _add_watch_time_rollups(conn):
+    # 按开始时间所在的日期/小时汇总已结束会话的次数与观看时长（整段时长计入开始的那一天/小时）
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS rollup_user_day (
+            day TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            username TEXT,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            watch_seconds INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id)
+        ) WITHOUT ROWID
+        '''
+    )
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS rollup_media_day (
+            day TEXT NOT NULL,
+            media_name TEXT NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            watch_seconds INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, media_name)
+        ) WITHOUT ROWID
+        '''
+    )
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS rollup_client_day (
+            day TEXT NOT NULL,
+            client_type TEXT NOT NULL,
+            device_name TEXT NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            watch_seconds INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, client_type, device_name)
+        ) WITHOUT ROWID
+        '''
+    )
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS rollup_hour_day (
+            day TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            watch_seconds INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, hour)
+        ) WITHOUT ROWID
+        '''
+    )
+
+    # 会话结束（end_time 由空变为非空）时在同一事务内累加；逐条写入和写后缓冲的批量写入都会触发，
+    # 重复结束同一会话不会匹配 end_time IS NULL，因此不会重复计数。归档删除记录不影响汇总。
+    conn.execute(
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_playback_history_rollup
+        AFTER UPDATE OF end_time ON playback_history
+        WHEN OLD.end_time IS NULL AND NEW.end_time IS NOT NULL
+        BEGIN
+            INSERT INTO rollup_user_day (day, user_id, username, sessions, watch_seconds)
+            VALUES (substr(NEW.start_time, 1, 10), NEW.user_id, NEW.username, 1, MAX(COALESCE(NEW.duration, 0), 0))
+            ON CONFLICT (day, user_id) DO UPDATE SET
+                username = excluded.username,
+                sessions = sessions + 1,
+                watch_seconds = watch_seconds + excluded.watch_seconds;
+
+            INSERT INTO rollup_media_day (day, media_name, sessions, watch_seconds)
+            VALUES (substr(NEW.start_time, 1, 10), COALESCE(NEW.media_name, ''), 1, MAX(COALESCE(NEW.duration, 0), 0))
+            ON CONFLICT (day, media_name) DO UPDATE SET
+                sessions = sessions + 1,
+                watch_seconds = watch_seconds + excluded.watch_seconds;
+
+            INSERT INTO rollup_client_day (day, client_type, device_name, sessions, watch_seconds)
+            VALUES (
+                substr(NEW.start_time, 1, 10), COALESCE(NEW.client_type, ''), COALESCE(NEW.device_name, ''),
+                1, MAX(COALESCE(NEW.duration, 0), 0)
+            )
+            ON CONFLICT (day, client_type, device_name) DO UPDATE SET
+                sessions = sessions + 1,
+                watch_seconds = watch_seconds + excluded.watch_seconds;
+
+            INSERT INTO rollup_hour_day (day, hour, sessions, watch_seconds)
+            VALUES (
+                substr(NEW.start_time, 1, 10), CAST(substr(NEW.start_time, 12, 2) AS INTEGER),
+                1, MAX(COALESCE(NEW.duration, 0), 0)
+            )
+            ON CONFLICT (day, hour) DO UPDATE SET
+                sessions = sessions + 1,
+                watch_seconds = watch_seconds + excluded.watch_seconds;
+        END
+        '''
+    )
+
+    # 用主库中已有的播放记录初始化汇总（此前已归档的记录可通过重建任务补入）
+    conn.execute(
+        '''
+        INSERT OR IGNORE INTO rollup_user_day (day, user_id, username, sessions, watch_seconds)
+        SELECT substr(start_time, 1, 10), user_id, MAX(username), COUNT(*), SUM(MAX(COALESCE(duration, 0), 0))
+        FROM playback_history WHERE end_time IS NOT NULL GROUP BY 1, 2
+        '''
+    )
+    conn.execute(
+        '''
+        INSERT OR IGNORE INTO rollup_media_day (day, media_name, sessions, watch_seconds)
+        SELECT substr(start_time, 1, 10), COALESCE(media_name, ''), COUNT(*), SUM(MAX(COALESCE(duration, 0), 0))
+        FROM playback_history WHERE end_time IS NOT NULL GROUP BY 1, 2
+        '''
+    )
+    conn.execute(
+        '''
+        INSERT OR IGNORE INTO rollup_client_day (day, client_type, device_name, sessions, watch_seconds)
+        SELECT substr(start_time, 1, 10), COALESCE(client_type, ''), COALESCE(device_name, ''),
+               COUNT(*), SUM(MAX(COALESCE(duration, 0), 0))
+        FROM playback_history WHERE end_time IS NOT NULL GROUP BY 1, 2, 3
+        '''
+    )
+    conn.execute(
+        '''
+        INSERT OR IGNORE INTO rollup_hour_day (day, hour, sessions, watch_seconds)
+        SELECT substr(start_time, 1, 10), CAST(substr(start_time, 12, 2) AS INTEGER),
+               COUNT(*), SUM(MAX(COALESCE(duration, 0), 0))
+        FROM playback_history WHERE end_time IS NOT NULL GROUP BY 1, 2
+        '''
+    )
+
+
+MIGRATIONS = [
+    (1, '基础表结构', _create_base_tables),
+    (2, 'security_log 增加 username 列', _add_security_log_username),
+    (3, 'user_expiry 增加 never_expire 列', _add_user_expiry_never_expire),
+    (4, '播放记录与安全日志热点查询索引', _add_hot_path_indexes),
+    (5, '播放记录开始时间索引', _add_history_time_indexes),
+    (6, '观看时长汇总表（用户/影片/客户端/小时 × 天）', _add_watch_time_rollups),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        '''
+    )
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def apply_migrations(connection_manager, target_version=None):
+    """按顺序执行尚未执行的迁移，返回迁移后的版本号"""
+    target_version = LATEST_VERSION if target_version is None else target_version
+    with connection_manager.connect(write=True) as conn:
+        current_version = get_schema_version(conn)
+
+    if current_version > LATEST_VERSION:
+        logger.warning('数据库结构版本(%s)高于程序支持的版本(%s)，可能来自更新的程序版本', current_version, LATEST_VERSION)
+        return current_version
+
+    for version, description, migrate in MIGRATIONS:
+        if version <= current_version or version > target_version:
+            continue
+        started = time.perf_counter()
+        with connection_manager.connect(write=True) as conn:
+            # 已持有写锁，再确认一次，避免多个进程同时启动时重复执行
+            if conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone():
+                continue
+            migrate(conn)
+            conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)', (version, description))
+        logger.info(
+            '数据库结构迁移 v%s 完成: %s，耗时 %.0fms', version, description, (time.perf_counter() - started) * 1000
+        )
+        current_version = version
+
+    return current_version
@@ -19,6 +19,7 @@ class EmbySecurity:
                 policy_url,
                 json={"IsDisabled": True}
             )
+            self.emby_client.invalidate_user(user_id)
 
             if response.status_code in (200, 204):
                 logger.warning('用户已禁用: username=%s, user_id=%s', display_name, user_id)
@@ -42,6 +43,7 @@ class EmbySecurity:
                 policy_url,
                 json={"IsDisabled": False}
             )
+            self.emby_client.invalidate_user(user_id)
 
             if response.status_code in (200, 204):
                 logger.info('用户已启用: username=%s, user_id=%s', display_name, user_id)
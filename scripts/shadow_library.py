@@ -1,16 +1,19 @@
 import logging
 import sqlite3
 
+from sqlite_manager import get_connection_manager
+
 logger = logging.getLogger(__name__)
 
 
 class ShadowLibrary:
     def __init__(self, db_path):
         self.db_path = db_path
+        self._db = get_connection_manager(db_path)
         self._init_db()
 
     def _init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             conn.execute('''
                 CREATE TABLE IF NOT EXISTS shadow_library (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -37,7 +40,7 @@ class ShadowLibrary:
             conn.commit()
 
     def exists_emby_id(self, emby_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             cursor = conn.execute(
                 "SELECT 1 FROM shadow_library WHERE emby_id = ?",
                 (emby_id,)
@@ -45,7 +48,7 @@ class ShadowLibrary:
             return cursor.fetchone() is not None
 
     def exists_season(self, emby_series_id, season_number):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             cursor = conn.execute(
                 "SELECT 1 FROM shadow_library WHERE emby_series_id = ? AND season_number = ? AND media_type = 'Season'",
                 (emby_series_id, season_number)
@@ -53,7 +56,7 @@ class ShadowLibrary:
             return cursor.fetchone() is not None
 
     def get_by_emby_id(self, emby_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             conn.row_factory = sqlite3.Row
             row = conn.execute(
                 "SELECT * FROM shadow_library WHERE emby_id = ?",
@@ -62,7 +65,7 @@ class ShadowLibrary:
             return dict(row) if row else None
 
     def get_season_by_slot(self, emby_series_id, season_number):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             conn.row_factory = sqlite3.Row
             row = conn.execute(
                 "SELECT * FROM shadow_library WHERE emby_series_id = ? AND season_number = ? AND media_type = 'Season'",
@@ -71,7 +74,7 @@ class ShadowLibrary:
             return dict(row) if row else None
 
     def get_all_emby_ids(self, media_type=None):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             if media_type:
                 cursor = conn.execute(
                     "SELECT emby_id FROM shadow_library WHERE media_type = ?",
@@ -98,7 +101,7 @@ class ShadowLibrary:
         return {'synced': synced, 'skipped': skipped, 'errors': errors}
 
     def _upsert_movie(self, movie):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             provider_ids = movie.get('ProviderIds') or {}
             tmdb_id = provider_ids.get('Tmdb') or provider_ids.get('TheMovieDb')
             conn.execute('''
@@ -131,7 +134,7 @@ class ShadowLibrary:
         return {'synced': synced, 'skipped': skipped, 'errors': errors}
 
     def _upsert_series(self, series):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             provider_ids = series.get('ProviderIds') or {}
             tmdb_id = provider_ids.get('Tmdb') or provider_ids.get('TheMovieDb')
             conn.execute('''
@@ -208,7 +211,7 @@ class ShadowLibrary:
         return {'synced': synced, 'skipped': skipped, 'errors': errors}
 
     def _upsert_season(self, emby_series_id, season):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             conn.execute('''
                 INSERT INTO shadow_library (
                     emby_id, name, media_type, year, tmdb_id, emby_series_id, season_number
@@ -224,7 +227,7 @@ class ShadowLibrary:
             conn.commit()
 
     def get_library_stats(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             movie_count = conn.execute(
                 "SELECT COUNT(*) FROM shadow_library WHERE media_type = 'Movie'"
             ).fetchone()[0]
@@ -244,7 +247,7 @@ class ShadowLibrary:
 
     def get_movies(self, page=1, page_size=20):
         offset = (page - 1) * page_size
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             conn.row_factory = sqlite3.Row
             total = conn.execute(
                 "SELECT COUNT(*) FROM shadow_library WHERE media_type = 'Movie'"
@@ -265,7 +268,7 @@ class ShadowLibrary:
 
     def get_series_list(self, page=1, page_size=20):
         offset = (page - 1) * page_size
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             conn.row_factory = sqlite3.Row
             total = conn.execute(
                 "SELECT COUNT(*) FROM shadow_library WHERE media_type = 'Series'"
@@ -285,7 +288,7 @@ class ShadowLibrary:
             }
 
     def get_series_detail(self, emby_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             conn.row_factory = sqlite3.Row
             series = conn.execute(
                 "SELECT * FROM shadow_library WHERE emby_id = ? AND media_type = 'Series'",
@@ -307,7 +310,7 @@ class ShadowLibrary:
             }
 
     def search_library(self, query, media_type=None):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             conn.row_factory = sqlite3.Row
             if media_type:
                 rows = conn.execute('''
@@ -327,7 +330,7 @@ class ShadowLibrary:
             return [dict(row) for row in rows]
 
     def check_tmdb(self, tmdb_id, media_type=None):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             conn.row_factory = sqlite3.Row
             db_media_type = None
             if media_type:
@@ -349,7 +352,7 @@ class ShadowLibrary:
             return [dict(row) for row in rows]
 
     def get_series_seasons_by_tmdb(self, tmdb_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             conn.row_factory = sqlite3.Row
             series = conn.execute('''
                 SELECT emby_id FROM shadow_library
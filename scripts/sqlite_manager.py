@@ -0,0 +1,175 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_connection_manager(db_path, **options):
+    """同一数据库文件共用一个连接管理器（DatabaseManager / ShadowLibrary / WishStore），首次创建时的参数生效"""
+    key = os.path.abspath(db_path)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = SQLiteConnectionManager(db_path, **options)
+        return manager
+
+
+class _ThreadConnection:
+    """线程私有的持久连接；线程退出、本对象被回收或 close_all() 时关闭连接"""
+
+    def __init__(self, conn, manager):
+        self.conn = conn
+        self.depth = 0
+        self.closed = False
+        self._manager = manager
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.conn.close()
+        finally:
+            self._manager._on_close()
+
+    def __del__(self):
+        self.close()
+
+
+class SQLiteConnectionManager:
+    """每个线程复用一个持久连接，并统一设置 WAL 等 pragma
+
+    connect() 的用法与 `with sqlite3.connect(path) as conn:` 相同：最外层 with 正常结束时提交、异常时回滚，
+    嵌套使用时复用同一连接和事务。write=True 时先执行 BEGIN IMMEDIATE 获取写锁，并把等待写锁的耗时计入统计。
+    WAL 模式下读不阻塞写、写也不阻塞读，写与写之间由 busy_timeout 排队等待。
+    """
+
+    def __init__(self, db_path, busy_timeout_ms=5000, mmap_size_mb=256, cache_size_mb=16, wal=True):
+        self.db_path = db_path
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self.mmap_size = int(mmap_size_mb) * 1024 * 1024
+        self.cache_size_kb = int(cache_size_mb) * 1024
+        self.wal = wal
+        self.journal_mode = None
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._lock_waits = LatencyHistogram()
+        self.connections_opened = 0
+        self.open_connections = 0
+        self.busy_errors = 0
+        # 所有线程创建的连接，线程退出后随持有对象回收自动移除
+        self._holders = weakref.WeakSet()
+
+    def _open(self):
+        # 连接只在所属线程中使用；关闭可能发生在线程退出时的其他线程中，因此关闭同线程检查
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.execute(f'PRAGMA busy_timeout = {self.busy_timeout_ms}')
+        if self.wal and self.journal_mode is None:
+            # journal_mode 记录在数据库文件中，只需设置一次
+            self.journal_mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+            logger.info('SQLite 日志模式: %s', self.journal_mode)
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA mmap_size = {self.mmap_size}')
+        conn.execute(f'PRAGMA cache_size = -{self.cache_size_kb}')
+        holder = _ThreadConnection(conn, self)
+        with self._stats_lock:
+            self.connections_opened += 1
+            self.open_connections += 1
+            self._holders.add(holder)
+        return holder
+
+    def _on_close(self):
+        with self._stats_lock:
+            self.open_connections -= 1
+
+    def _thread_connection(self):
+        holder = getattr(self._local, 'holder', None)
+        if holder is None or holder.closed:
+            holder = self._local.holder = self._open()
+        return holder
+
+    def _begin_immediate(self, conn):
+        started = time.perf_counter()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError:
+            with self._stats_lock:
+                self.busy_errors += 1
+            raise
+        finally:
+            waited_ms = (time.perf_counter() - started) * 1000
+            with self._stats_lock:
+                self._lock_waits.observe(waited_ms)
+
+    @contextmanager
+    def connect(self, write=False):
+        holder = self._thread_connection()
+        conn = holder.conn
+        outermost = holder.depth == 0
+        if outermost:
+            # 持久连接会被多个方法复用，每次重置为默认的元组行
+            conn.row_factory = None
+            if write and not conn.in_transaction:
+                self._begin_immediate(conn)
+        holder.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            if outermost and conn.in_transaction:
+                conn.rollback()
+            raise
+        else:
+            if outermost and conn.in_transaction:
+                conn.commit()
+        finally:
+            holder.depth -= 1
+
+    def close(self):
+        """关闭当前线程的连接"""
+        holder = getattr(self._local, 'holder', None)
+        if holder is not None and holder.depth == 0:
+            self._local.holder = None
+
+    def close_all(self):
+        """关闭所有线程创建的连接，返回关闭的连接数；在停止服务、其他线程不再访问数据库后调用
+
+        WAL 模式下先执行一次 TRUNCATE 检查点，把 WAL 写回数据库文件。之后再访问数据库时重新建立连接。
+        """
+        if self.journal_mode == 'wal':
+            try:
+                with self.connect() as conn:
+                    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except sqlite3.Error as e:
+                logger.warning('SQLite WAL 检查点失败: error=%s', e)
+        with self._stats_lock:
+            holders = [holder for holder in self._holders if not holder.closed]
+        for holder in holders:
+            try:
+                holder.close()
+            except sqlite3.Error as e:
+                logger.warning('SQLite 连接关闭失败: error=%s', e)
+        return len(holders)
+
+    def stats(self):
+        with self._stats_lock:
+            lock_waits = self._lock_waits.to_dict()
+            return {
+                'db_path': self.db_path,
+                'journal_mode': self.journal_mode,
+                'connections_opened': self.connections_opened,
+                'open_connections': self.open_connections,
+                'write_transactions': lock_waits['count'],
+                'lock_wait_total_ms': round(self._lock_waits.total_ms, 2),
+                'lock_wait': lock_waits,
+                'busy_errors': self.busy_errors,
+            }
@@ -10,7 +10,11 @@ import yaml
 from flask import Flask, jsonify, request, send_from_directory
 from flask_login import LoginManager, UserMixin, current_user, login_required, login_user, logout_user
 
+from analytics import METRICS as ANALYTICS_METRICS
+from analytics import PlaybackAnalytics
 from config_loader import load_config, save_config
+from ip_utils import cache_stats as ip_cache_stats
+from ip_utils import ip_type_label
 from location_service import LocationService
 from logger import get_logs
 from session_manager import update_proxy_config
@@ -53,6 +57,8 @@ class WebServer:
             )
 
         self.monitor = monitor
+        # 管理后台统计：读取观看时长汇总表，结果短时间缓存
+        self.analytics = PlaybackAnalytics(db_manager, cache_ttl=config.get('web', {}).get('analytics_cache_ttl', 60))
 
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.frontend_dist = os.path.join(base_dir, 'frontend', 'dist')
@@ -652,6 +658,142 @@ class WebServer:
         def admin_logs():
             return jsonify({'logs': get_logs()})
 
+        @self.app.get('/api/admin/scheduler/jobs')
+        @login_required
+        def admin_scheduler_jobs():
+            if not self.monitor:
+                return jsonify({'error': '监控服务未初始化'}), 503
+            return jsonify({'jobs': self.monitor.scheduler.get_stats()})
+
+        @self.app.get('/api/admin/metrics')
+        @login_required
+        def admin_metrics():
+            if not self.monitor:
+                return jsonify({'error': '监控服务未初始化'}), 503
+            return jsonify(
+                {
+                    'stages': self.monitor.metrics.snapshot(),
+                    'sqlite': self.db_manager.connection_stats(),
+                    'analytics_cache': self.analytics.cache_stats(),
+                }
+            )
+
+        @self.app.get('/api/admin/location/stats')
+        @login_required
+        def admin_location_stats():
+            return jsonify({'stats': self.location_service.get_stats()})
+
+        @self.app.post('/api/admin/location/lookup')
+        @login_required
+        def admin_location_lookup():
+            data = request.get_json(silent=True) or {}
+            ips = [str(ip).strip() for ip in data.get('ips') or [] if str(ip).strip()]
+            if not ips:
+                return jsonify({'error': '请提供要查询的IP列表'}), 400
+            if len(ips) > 200:
+                return jsonify({'error': '单次最多查询200个IP'}), 400
+            return jsonify({'results': self.location_service.lookup_many(ips)})
+
+        @self.app.get('/api/admin/ip-cache/stats')
+        @login_required
+        def admin_ip_cache_stats():
+            return jsonify({'stats': ip_cache_stats()})
+
+        @self.app.get('/api/admin/history')
+        @login_required
+        def admin_history():
+            user_id = (request.args.get('user_id') or '').strip() or None
+            username = (request.args.get('username') or '').strip()
+            if not user_id and not username:
+                return jsonify({'error': '请提供 user_id 或 username'}), 400
+            limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+            include_archive = request.args.get('include_archive') in ('1', 'true')
+            records = self._get_user_playback_records(
+                user_id=user_id, username=username, limit=limit, include_archive=include_archive
+            )
+            ban_info = self._get_user_ban_info(user_id=user_id, username=username, include_archive=include_archive)
+            return jsonify(
+                {
+                    'playback_records': self._serialize_playback_records(records),
+                    'ban_info': self._serialize_ban_info(ban_info),
+                }
+            )
+
+        @self.app.get('/api/admin/security-logs')
+        @login_required
+        def admin_security_logs():
+            limit = min(max(request.args.get('limit', 100, type=int), 1), 500)
+            include_archive = request.args.get('include_archive') in ('1', 'true')
+            return jsonify({'logs': self.db_manager.get_security_logs(limit=limit, include_archive=include_archive)})
+
+        @self.app.get('/api/admin/analytics/<metric>')
+        @login_required
+        def admin_analytics(metric):
+            # summary / top-users / top-media / clients / daily / hourly / concurrency
+            metric = metric.replace('-', '_')
+            if metric not in ANALYTICS_METRICS:
+                return jsonify({'error': f'不支持的统计指标: {metric}'}), 404
+            try:
+                return jsonify(
+                    self.analytics.query(
+                        metric,
+                        start=(request.args.get('start') or '').strip() or None,
+                        end=(request.args.get('end') or '').strip() or None,
+                        limit=request.args.get('limit', 10, type=int),
+                    )
+                )
+            except ValueError as exc:
+                return jsonify({'error': str(exc)}), 400
+
+        @self.app.get('/api/admin/archive/stats')
+        @login_required
+        def admin_archive_stats():
+            if not self.monitor:
+                return jsonify({'error': '监控服务未初始化'}), 503
+            return jsonify({'stats': self.monitor.archiver.stats()})
+
+        @self.app.get('/api/admin/rollups/stats')
+        @login_required
+        def admin_rollup_stats():
+            if not self.monitor:
+                return jsonify({'error': '监控服务未初始化'}), 503
+            return jsonify({'stats': self.monitor.rollup_rebuilder.stats()})
+
+        @self.app.post('/api/admin/rollups/rebuild')
+        @login_required
+        def admin_rollup_rebuild():
+            if not self.monitor:
+                return jsonify({'error': '监控服务未初始化'}), 503
+            data = request.get_json(silent=True) or {}
+            try:
+                days = int(data['days']) if data.get('days') else None
+            except (TypeError, ValueError):
+                return jsonify({'error': 'days 必须是整数'}), 400
+            logger.warning('管理员触发观看时长汇总重建: days=%s', days or '全部')
+            try:
+                result = self.monitor.rollup_rebuilder.rebuild(days=days)
+            except Exception as exc:
+                return jsonify({'error': f'重建失败: {exc}'}), 500
+            if result is None:
+                return jsonify({'error': '汇总重建正在进行中'}), 409
+            # 汇总表已重新计算，缓存的统计结果作废
+            self.analytics.clear_cache()
+            return jsonify({'success': True, 'result': result})
+
+        @self.app.post('/api/admin/archive/run')
+        @login_required
+        def admin_archive_run():
+            if not self.monitor:
+                return jsonify({'error': '监控服务未初始化'}), 503
+            logger.warning('管理员触发历史记录归档')
+            try:
+                archived = self.monitor.archiver.run()
+            except Exception as exc:
+                return jsonify({'error': f'归档失败: {exc}'}), 500
+            # 记录已移入归档库，缓存的统计结果作废
+            self.analytics.clear_cache()
+            return jsonify({'success': True, 'archived': archived})
+
         @self.app.get('/api/admin/shadow/stats')
         @login_required
         def admin_shadow_stats():
@@ -935,6 +1077,7 @@ class WebServer:
                     'user_id': session.get('user_id'),
                     'username': session.get('username') or '未知用户',
                     'ip_address': session.get('ip') or '',
+                    'ip_type': ip_type_label(session.get('ip') or ''),
                     'location': session.get('location') or '未知位置',
                     'device': session.get('device') or '未知设备',
                     'client': session.get('client') or '未知客户端',
@@ -959,13 +1102,17 @@ class WebServer:
         user = self.emby_client.get_user_by_name(username)
         return user.get('Id') if user else None
 
-    def _get_user_playback_records(self, user_id=None, username=''):
+    def _get_user_playback_records(self, user_id=None, username='', limit=10, include_archive=False):
         if user_id:
-            records = self.db_manager.get_user_playback_records(user_id, limit=10)
+            records = self.db_manager.get_user_playback_records(
+                user_id, limit=limit, include_archive=include_archive
+            )
             if records:
                 return records
         if username:
-            return self.db_manager.get_playback_records_by_username(username, limit=10)
+            return self.db_manager.get_playback_records_by_username(
+                username, limit=limit, include_archive=include_archive
+            )
         return []
 
     def _serialize_playback_records(self, records):
@@ -975,6 +1122,7 @@ class WebServer:
                 {
                     'session_id': record[0],
                     'ip_address': record[1],
+                    'ip_type': ip_type_label(record[1] or ''),
                     'device_name': record[2],
                     'client_type': record[3],
                     'media_name': record[4],
@@ -986,13 +1134,13 @@ class WebServer:
             )
         return payload
 
-    def _get_user_ban_info(self, user_id=None, username=''):
+    def _get_user_ban_info(self, user_id=None, username='', include_archive=False):
         if user_id:
-            record = self.db_manager.get_user_ban_info(user_id)
+            record = self.db_manager.get_user_ban_info(user_id, include_archive=include_archive)
             if record:
                 return record
         if username:
-            return self.db_manager.get_ban_info_by_username(username)
+            return self.db_manager.get_ban_info_by_username(username, include_archive=include_archive)
         return None
 
     def _serialize_ban_info(self, record):
@@ -2,6 +2,8 @@ from __future__ import annotations
 
 import sqlite3
 
+from sqlite_manager import get_connection_manager
+
 
 class WishStore:
     ALLOWED_STATUSES = {'pending', 'approved', 'rejected'}
@@ -13,10 +15,11 @@ class WishStore:
 
     def __init__(self, db_path):
         self.db_path = db_path
+        self._db = get_connection_manager(db_path)
         self.init_db()
 
     def init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             conn.execute(
                 '''
                 CREATE TABLE IF NOT EXISTS media_requests (
@@ -72,7 +75,7 @@ class WishStore:
         if not payload['title']:
             raise ValueError('标题不能为空')
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             conn.row_factory = sqlite3.Row
             existing = conn.execute(
                 f'''
@@ -170,7 +173,7 @@ class WishStore:
         return record
 
     def get_request(self, request_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             conn.row_factory = sqlite3.Row
             row = conn.execute(
                 f'''
@@ -185,7 +188,7 @@ class WishStore:
             return self._normalize_record(dict(row))
 
     def list_requests(self, status=''):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             conn.row_factory = sqlite3.Row
             if status and status in self.ALLOWED_STATUSES:
                 rows = conn.execute(
@@ -218,7 +221,7 @@ class WishStore:
             page_size = 25
 
         offset = (page - 1) * page_size
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             conn.row_factory = sqlite3.Row
             total_row = conn.execute(
                 '''
@@ -260,7 +263,7 @@ class WishStore:
         if not items:
             return mapping
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect() as conn:
             conn.row_factory = sqlite3.Row
             for item in items:
                 try:
@@ -299,7 +302,7 @@ class WishStore:
         status = (status or '').strip()
         if status not in self.ALLOWED_STATUSES:
             raise ValueError('状态错误')
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             cursor = conn.execute(
                 '''
                 UPDATE media_requests
@@ -314,7 +317,7 @@ class WishStore:
         return self.get_request(request_id)
 
     def delete_request(self, request_id):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._db.connect(write=True) as conn:
             cursor = conn.execute('DELETE FROM media_requests WHERE id = ?', (request_id,))
             conn.commit()
             return cursor.rowcount > 0
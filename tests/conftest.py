@@ -0,0 +1,196 @@
+import copy
+import os
+import sys
+import time
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+from config_loader import DEFAULT_CONFIG  # noqa: E402
+from database import DatabaseManager  # noqa: E402
+from emby_client import EmbyClient  # noqa: E402
+from geocache_client import GeoCacheClient, GeoCacheReporter  # noqa: E402
+from location_service import LocationService  # noqa: E402
+from monitor import EmbyMonitor  # noqa: E402
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'geo_service(**kwargs): 覆盖 geo_service 夹具的 LocationService 构造参数')
+
+
+def wait_for(predicate, timeout=2.0):
+    """等待后台线程使 predicate 成立，超时返回 False"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def db(tmp_path):
+    # 传入绝对路径时数据库位于临时目录，不影响 data 目录
+    db = DatabaseManager(str(tmp_path / 'test.db'))
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def config():
+    return copy.deepcopy(DEFAULT_CONFIG)
+
+
+class FakeEmby:
+    """内存中的 Emby：sessions 为 None 时模拟获取会话失败"""
+
+    server_url = 'http://emby.test'
+    api_key = 'key'
+    parse_media_info = staticmethod(EmbyClient.parse_media_info)
+
+    def __init__(self):
+        self.users = {}
+        self.sessions = {}
+        self.user_lookups = []
+
+    def add_user(self, user_id, name, disabled=False):
+        self.users[user_id] = {'Id': user_id, 'Name': name, 'Policy': {'IsDisabled': disabled}}
+
+    def start_session(self, session_id, user_id, ip='10.0.0.1', media='Movie'):
+        self.sessions[session_id] = {
+            'Id': session_id, 'UserId': user_id, 'RemoteEndPoint': ip, 'DeviceName': 'TV',
+            'Client': 'Emby Theater', 'NowPlayingItem': {'Name': media}, 'PlayState': {},
+        }
+        return self.sessions[session_id]
+
+    def get_active_sessions(self):
+        return None if self.sessions is None else dict(self.sessions)
+
+    def get_user_info(self, user_id):
+        self.user_lookups.append(user_id)
+        return copy.deepcopy(self.users.get(user_id, {}))
+
+    def get_users(self):
+        return copy.deepcopy(list(self.users.values()))
+
+    def prefetch_users(self, user_ids):
+        return 0
+
+
+class FakeSecurity:
+    def __init__(self):
+        self.disabled = []
+
+    def disable_user(self, user_id, username):
+        self.disabled.append(user_id)
+        return True
+
+
+class FakeLocationService:
+    """只提供 EmbyMonitor 注册周期任务和记录会话时用到的接口；uncached 中的IP只能通过外部查询解析"""
+
+    def __init__(self, location='测试位置'):
+        self.location = location
+        self.lookups = []
+        self.uncached = set()
+
+    def retry_pending(self):
+        return 0
+
+    def lookup(self, ip_address):
+        self.lookups.append(ip_address)
+        return {'ip': ip_address, 'provider': 'test', 'formatted': self.location}
+
+    def lookup_many(self, ip_addresses, resolve=True):
+        return [self.lookup(ip) if resolve or ip not in self.uncached else None for ip in ip_addresses]
+
+
+@pytest.fixture
+def emby():
+    return FakeEmby()
+
+
+@pytest.fixture
+def security():
+    return FakeSecurity()
+
+
+@pytest.fixture
+def location_service():
+    return FakeLocationService()
+
+
+@pytest.fixture
+def monitor(db, emby, security, config, location_service):
+    """直接写库（不缓冲）的监控实例；修改 config 后调用 update_runtime_config 生效"""
+    config['monitor']['write_behind'] = False
+    monitor = EmbyMonitor(db, emby, security, config, location_service=location_service)
+    yield monitor
+    monitor._enrich_executor.shutdown(wait=True)
+
+
+def geo_info(ip_address, formatted='广东深圳 | 电信'):
+    """ip138 查询成功时的返回结果"""
+    location, _, isp = formatted.partition(' | ')
+    return {
+        'provider': 'ip138', 'ip': ip_address, 'location': location, 'district': '', 'street': '',
+        'isp': isp, 'latitude': None, 'longitude': None, 'formatted': formatted, 'ts': 0,
+    }
+
+
+@pytest.fixture
+def geo_service(request, db):
+    """使用临时数据库的 LocationService，外部查询替换为 geo_info，查询过的IP记录在 queried 中
+
+    构造参数可用 @pytest.mark.geo_service(...) 覆盖，默认关闭网段匹配。
+    """
+    marker = request.node.get_closest_marker('geo_service')
+    options = {'db_manager': db, 'prefix_match': False, **(marker.kwargs if marker else {})}
+    service = LocationService(**options)
+    service.queried = []
+
+    def query_ip138(ip_address):
+        service.queried.append(ip_address)
+        return geo_info(ip_address)
+
+    service._query_ip138 = query_ip138
+    yield service
+    service.close()
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'HTTP {self.status_code}', response=self)
+
+
+class FakeGeoCacheSession:
+    """GeoCache 上报接口：按 statuses 中的状态码响应（默认 200），上报过的IP记录在 posted 中"""
+
+    def __init__(self):
+        self.statuses = {}
+        self.posted = []
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        self.posted.append(json['ip'])
+        return FakeResponse(self.statuses.get(json['ip'], 200))
+
+
+@pytest.fixture
+def geocache_reporter(db):
+    """写入临时数据库发件箱的上报器；后台线程不会自动上报，由测试调用 flush()"""
+    client = GeoCacheClient(base_url='http://geocache.test', api_key='key', timeout=1)
+    client.session = FakeGeoCacheSession()
+    reporter = GeoCacheReporter(client, db_manager=db, flush_interval=60)
+    yield reporter
+    reporter.stop()
+
+
+def history_rows(db, columns='session_id, end_time'):
+    with db._db.connect() as conn:
+        return conn.execute(f'SELECT {columns} FROM playback_history ORDER BY id').fetchall()
@@ -0,0 +1,22 @@
+import logging
+
+from conftest import history_rows
+from location_service import PENDING_LOCATION
+
+
+def test_alert_resolves_uncached_location(monitor, emby, security, location_service, caplog):
+    webhooks = []
+    monitor._send_webhook_notification = webhooks.append
+    location_service.uncached.add('203.0.113.5')
+    emby.add_user('user-1', 'bob')
+    monitor._record_session_start(emby.start_session('session-1', 'user-1', ip='198.51.100.1'))
+
+    with caplog.at_level(logging.INFO):
+        monitor._record_session_start(emby.start_session('session-2', 'user-1', ip='203.0.113.5'))
+
+    # 会话记录仍按延迟解析先记占位值，告警与 Webhook 则给出实际归属地
+    assert history_rows(monitor.db, 'session_id, location') == [('session-1', '测试位置'), ('session-2', PENDING_LOCATION)]
+    assert '203.0.113.5 (IPv4) (测试位置)' in caplog.text
+    assert security.disabled == ['user-1']
+    assert webhooks[0]['location'] == '测试位置'
+    assert location_service.lookups[-1] == '203.0.113.5'
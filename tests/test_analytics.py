@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from analytics import PlaybackAnalytics
+from conftest import history_rows
+
+
+def _insert(db, session_id, start_time, end_time=None):
+    with db._db.connect(write=True) as conn:
+        conn.execute(
+            '''
+            INSERT INTO playback_history (session_id, user_id, username, ip_address, start_time, end_time, duration)
+            VALUES (?, 'user-1', 'bob', '10.0.0.1', ?, ?, ?)
+            ''',
+            (
+                session_id,
+                start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                end_time.strftime('%Y-%m-%d %H:%M:%S') if end_time else None,
+                int((end_time - start_time).total_seconds()) if end_time else None,
+            ),
+        )
+
+
+def _concurrency(db, now):
+    return PlaybackAnalytics(db).query('concurrency', start=(now - timedelta(days=6)).date().isoformat(),
+                                       end=(now + timedelta(days=1)).date().isoformat())['result']
+
+
+def test_concurrency_ignores_orphaned_open_rows(monitor, db):
+    now = datetime.now().replace(microsecond=0)
+    # 进程异常退出遗留的未结束记录，不在活跃会话检查点中
+    _insert(db, 'orphan', now - timedelta(days=3))
+    _insert(db, 'finished', now - timedelta(days=2), now - timedelta(days=2) + timedelta(hours=1))
+    live_start = now - timedelta(minutes=30)
+    _insert(db, 'live', live_start)
+    db.save_active_sessions([{'session_id': 'live', 'user_id': 'user-1', 'start_time': live_start}],
+                            now - timedelta(minutes=1))
+    # 启动时标记遗留记录结束，检查点中的会话等待对账
+    monitor._restore_active_sessions()
+    new_start = now - timedelta(seconds=10)
+    _insert(db, 'new', new_start)
+
+    result = _concurrency(db, now)
+
+    assert result['peak'] == 2
+    assert result['peak_at'] == new_start.strftime('%Y-%m-%d %H:%M:%S')
+    assert {'day': (now - timedelta(days=3)).date().isoformat(), 'peak': 1} not in result['daily_peaks']
+    assert history_rows(db, 'session_id, duration')[0] == ('orphan', 0)
+
+
+def test_concurrency_counts_open_rows_without_checkpoint(db):
+    now = datetime.now().replace(microsecond=0)
+    # 新进程尚未保存过检查点：未结束的记录都是当前进程正在跟踪的会话
+    _insert(db, 'session-1', now - timedelta(minutes=5))
+    _insert(db, 'session-2', now - timedelta(minutes=2))
+
+    assert _concurrency(db, now)['peak'] == 2
+
+
+def test_concurrency_counts_sessions_missing_from_lagging_checkpoint(db):
+    now = datetime.now().replace(microsecond=0)
+    checkpointed = now - timedelta(minutes=10)
+    _insert(db, 'checkpointed', checkpointed)
+    # 检查点之前开始、但写入检查点之前就已记录的会话（检查点滞后）
+    _insert(db, 'lagging', now - timedelta(minutes=3))
+    db.save_active_sessions([{'session_id': 'checkpointed', 'user_id': 'user-1', 'start_time': checkpointed}],
+                            now - timedelta(minutes=1))
+
+    assert _concurrency(db, now)['peak'] == 2
+
+
+@pytest.mark.parametrize('endpoint', ['/api/admin/rollups/rebuild', '/api/admin/archive/run'])
+def test_admin_maintenance_clears_analytics_cache(monitor, db, emby, security, config, location_service, endpoint):
+    pytest.importorskip('flask')
+    from web_server import WebServer
+
+    server = WebServer(db, emby, security, config, location_service=location_service, monitor=monitor)
+    client = server.app.test_client()
+    assert client.post('/api/auth/login', json={'username': 'admin', 'password': 'admin123'}).status_code == 200
+    assert client.get('/api/admin/analytics/summary').status_code == 200
+    assert server.analytics.cache_stats()['size'] == 1
+
+    response = client.post(endpoint, json={})
+
+    assert response.status_code == 200, response.get_json()
+    assert server.analytics.cache_stats()['size'] == 0
@@ -0,0 +1,49 @@
+from circuit_breaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, AdaptiveTimeout, CircuitBreaker
+
+
+def test_consecutive_failures_trip_and_probe_recovers():
+    breaker = CircuitBreaker('ip138', failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == STATE_CLOSED
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+
+    # 到期后半开：只放行一次试探请求
+    assert breaker.allow()
+    assert breaker.state == STATE_HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.to_dict()['trips'] == 1
+    assert breaker.to_dict()['rejected'] == 1
+
+
+def test_open_breaker_rejects_until_reset_timeout():
+    breaker = CircuitBreaker('ip138', failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    assert not breaker.available()
+    assert not breaker.allow()
+    assert breaker.to_dict()['open_remaining'] > 0
+
+
+def test_failure_rate_trips_without_consecutive_failures():
+    breaker = CircuitBreaker('ip138', failure_threshold=5, window_size=10, failure_rate_threshold=0.5, min_calls=10)
+    for _ in range(5):
+        breaker.record_success()
+        breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert breaker.consecutive_failures == 1
+
+
+def test_adaptive_timeout_follows_p95():
+    timeout = AdaptiveTimeout(min_timeout=3, max_timeout=45, multiplier=3, min_samples=5)
+    # 样本不足时使用最大超时
+    assert timeout.current() == 45
+    for elapsed in (1.0, 1.5, 2.0, 2.0, 4.0):
+        timeout.observe(elapsed)
+    assert timeout.current() == 12.0
+
+    fast = AdaptiveTimeout(min_timeout=3, max_timeout=45, multiplier=3, min_samples=5)
+    for _ in range(5):
+        fast.observe(0.1)
+    assert fast.current() == 3
@@ -0,0 +1,74 @@
+from emby_client import EmbyClient
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f'HTTP {self.status_code}')
+
+
+class FakeSession:
+    def __init__(self, users):
+        self.users = users
+        self.requests = []
+
+    def get(self, url, timeout=None):
+        self.requests.append(url)
+        if url.endswith('/emby/Users'):
+            return FakeResponse(self.users)
+        for user in self.users:
+            if url.endswith(f"/emby/Users/{user['Id']}"):
+                return FakeResponse(user)
+        return FakeResponse({}, status_code=404)
+
+
+def _client(users, ttl=300):
+    client = EmbyClient('http://emby.local', 'key', user_cache_ttl=ttl)
+    client.session = FakeSession(users)
+    return client
+
+
+def test_prefetch_negative_caches_missing_users():
+    client = _client([{'Id': 'user-1', 'Name': 'alice', 'Policy': {'IsDisabled': False}}])
+
+    assert client.prefetch_users(['user-1', 'deleted-user']) == 2
+    assert len(client.session.requests) == 1
+    # 已删除用户的会话仍在列表中：缓存有效期内不再请求全部用户
+    assert client.prefetch_users(['user-1', 'deleted-user']) == 0
+    assert len(client.session.requests) == 1
+
+
+def test_expired_negative_cache_refetches():
+    client = _client([], ttl=0)
+    client.prefetch_users(['deleted-user'])
+    client.prefetch_users(['deleted-user'])
+    assert len(client.session.requests) == 2
+
+
+def test_cached_user_is_returned_as_copy():
+    client = _client([{'Id': 'user-1', 'Name': 'alice', 'Policy': {'IsDisabled': False}}])
+    client.prefetch_users(['user-1'])
+
+    user = client.get_user_info('user-1')
+    user['Policy']['IsDisabled'] = True
+    assert client.get_user_info('user-1')['Policy']['IsDisabled'] is False
+    assert client.session.requests == ['http://emby.local/emby/Users']
+
+
+def test_user_info_is_cached_until_invalidated():
+    client = _client([{'Id': 'user-1', 'Name': 'alice', 'Policy': {'IsDisabled': False}}])
+
+    assert client.get_user_info('user-1')['Name'] == 'alice'
+    assert client.get_user_info('user-1')['Name'] == 'alice'
+    assert client.session.requests == ['http://emby.local/emby/Users/user-1']
+
+    client.invalidate_user('user-1')
+    client.get_user_info('user-1')
+    assert len(client.session.requests) == 2
@@ -0,0 +1,216 @@
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from conftest import history_rows, wait_for
+from emby_websocket import EmbySessionStream
+
+pytest.importorskip('websocket')
+
+WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class FakeEmbyServer:
+    """最小的 WebSocket 服务端：按连接顺序发送预设消息
+
+    scripts[i] 为第 i 个连接的 (消息列表, 发送后是否断开)；None 表示直接断开、不完成握手。
+    超出 scripts 的连接保持打开。
+    """
+
+    def __init__(self, scripts):
+        self.scripts = list(scripts)
+        self.connected_at = []
+        self.received = []
+        self._sock = socket.create_server(('127.0.0.1', 0))
+        self.url = f'ws://127.0.0.1:{self._sock.getsockname()[1]}/embywebsocket'
+        self._closed = False
+        self._conns = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        """停止监听并断开所有连接"""
+        self._closed = True
+        for conn in [self._sock, *self._conns]:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._sock.close()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            if self._closed:
+                conn.close()
+                return
+            self._conns.append(conn)
+            index = len(self.connected_at)
+            self.connected_at.append(time.monotonic())
+            script = self.scripts[index] if index < len(self.scripts) else ([], False)
+            threading.Thread(target=self._serve, args=(conn, script), daemon=True).start()
+
+    def _serve(self, conn, script):
+        with conn:
+            request = b''
+            while b'\r\n\r\n' not in request:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    return
+                request += chunk
+            if script is None:
+                return
+            key = next(
+                line.split(b':', 1)[1].strip() for line in request.split(b'\r\n')
+                if line.lower().startswith(b'sec-websocket-key')
+            )
+            accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+            conn.sendall(
+                b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n'
+            )
+            messages, disconnect = script
+            # 等客户端订阅后再推送事件
+            if self._read_frame(conn) is None:
+                return
+            for message in messages:
+                self._send_frame(conn, 0x1, json.dumps(message).encode())
+            if disconnect:
+                # 收到 KeepAlive 回复后再断开
+                for _ in range(sum(message['MessageType'] == 'ForceKeepAlive' for message in messages)):
+                    self._read_frame(conn)
+                self._send_frame(conn, 0x8, b'')
+                return
+            while self._read_frame(conn) is not None:
+                pass
+
+    def _read_frame(self, conn):
+        header = self._recv_exact(conn, 2)
+        if header is None:
+            return None
+        opcode, length = header[0] & 0x0F, header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', self._recv_exact(conn, 2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self._recv_exact(conn, 8))[0]
+        mask = self._recv_exact(conn, 4) if header[1] & 0x80 else b'\0\0\0\0'
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self._recv_exact(conn, length) or b''))
+        if opcode == 0x8:
+            self._send_frame(conn, 0x8, b'')
+            return None
+        if opcode == 0x1:
+            self.received.append(json.loads(payload))
+        return payload
+
+    @staticmethod
+    def _recv_exact(conn, size):
+        data = b''
+        while len(data) < size:
+            try:
+                chunk = conn.recv(size - len(data))
+            except OSError:
+                return None
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    @staticmethod
+    def _send_frame(conn, opcode, payload):
+        length = len(payload)
+        header = bytes([0x80 | opcode, length]) if length < 126 else bytes([0x80 | opcode, 126]) + struct.pack('!H', length)
+        try:
+            conn.sendall(header + payload)
+        except OSError:
+            pass
+
+
+@pytest.fixture
+def events():
+    return []
+
+
+def _session(session_id):
+    return {'Id': session_id, 'UserId': 'user-1', 'NowPlayingItem': {'Name': 'Movie'}}
+
+
+def test_start_stop_and_reconnect(events):
+    server = FakeEmbyServer([
+        ([
+            {'MessageType': 'PlaybackStart', 'Data': _session('session-1')},
+            {'MessageType': 'ForceKeepAlive', 'Data': 60},
+            {'MessageType': 'PlaybackStopped', 'Data': {'SessionId': 'session-1'}},
+        ], True),
+        ([{'MessageType': 'Sessions', 'Data': [_session('session-2'), {'Id': 'idle'}]}], False),
+    ])
+    stream = EmbySessionStream(
+        'http://emby.test', 'key', lambda *event: events.append(event), ws_url=server.url, reconnect_delay=0.1
+    )
+    stream.start()
+    try:
+        assert wait_for(lambda: any(event_type == 'sessions' for event_type, _ in events))
+        assert stream.connected
+    finally:
+        stream.stop()
+        server.close()
+
+    assert events == [
+        ('refresh', None),
+        ('start', _session('session-1')),
+        ('stop', 'session-1'),
+        # 重连后先全量对账，再接收快照（只保留正在播放的会话）
+        ('refresh', None),
+        ('sessions', {'session-2': _session('session-2')}),
+    ]
+    assert [message['MessageType'] for message in server.received] == ['SessionsStart', 'KeepAlive', 'SessionsStart']
+    assert server.connected_at[1] - server.connected_at[0] >= 0.1
+
+
+def test_reconnect_backs_off_exponentially(events):
+    server = FakeEmbyServer([None, None, None])
+    stream = EmbySessionStream(
+        'http://emby.test', 'key', lambda *event: events.append(event), ws_url=server.url,
+        reconnect_delay=0.1, max_reconnect_delay=1,
+    )
+    stream.start()
+    try:
+        assert wait_for(lambda: stream.connected, timeout=5)
+    finally:
+        stream.stop()
+        server.close()
+
+    gaps = [later - earlier for earlier, later in zip(server.connected_at, server.connected_at[1:])]
+    assert len(gaps) == 3
+    for gap, delay in zip(gaps, (0.1, 0.2, 0.4)):
+        assert gap >= delay
+    assert gaps[2] > gaps[0]
+
+
+def test_stop_during_enrichment_ends_session(monitor, emby):
+    release = threading.Event()
+    get_user_info = emby.get_user_info
+
+    def slow_user_info(user_id):
+        release.wait(2)
+        return get_user_info(user_id)
+
+    emby.get_user_info = slow_user_info
+    emby.add_user('user-1', 'alice')
+    session = emby.start_session('session-1', 'user-1')
+
+    monitor._handle_stream_event('start', session)
+    # stop 先于补全完成到达：记录下来，补全结束后立即结束会话
+    monitor._handle_stream_event('stop', 'session-1')
+    release.set()
+
+    assert wait_for(lambda: not monitor._pending_sessions and not monitor.active_sessions)
+    assert wait_for(lambda: history_rows(monitor.db)[0][1] is not None)
+    assert monitor._stopped_pending_sessions == set()
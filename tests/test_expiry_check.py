@@ -0,0 +1,33 @@
+import logging
+
+
+def test_whitelisted_expired_user_is_logged_and_protected(monitor, db, emby, security, config, caplog):
+    config['security']['whitelist'] = ['admin']
+    monitor.update_runtime_config(config)
+    db.set_user_expiry('user-admin', '2000-01-01')
+    db.set_user_expiry('user-bob', '2000-01-01')
+    emby.add_user('user-admin', 'Admin')
+    emby.add_user('user-bob', 'bob')
+
+    with caplog.at_level(logging.INFO):
+        monitor._check_expired_users()
+
+    assert security.disabled == ['user-bob']
+    assert '白名单用户 [Admin] 到期但受保护，跳过禁用' in caplog.text
+
+
+def test_expiry_check_skips_missing_and_disabled_users(monitor, db, emby, security, config):
+    config['monitor']['expiry_workers'] = 2
+    monitor.update_runtime_config(config)
+    for user_id in ('user-1', 'user-2', 'user-3', 'user-gone'):
+        db.set_user_expiry(user_id, '2000-01-01')
+    emby.add_user('user-1', 'alice')
+    emby.add_user('user-2', 'bob')
+    emby.add_user('user-3', 'carol', disabled=True)
+
+    monitor._check_expired_users()
+
+    assert sorted(security.disabled) == ['user-1', 'user-2']
+    assert monitor.last_expiry_check['missing'] == 1
+    assert monitor.last_expiry_check['already_disabled'] == 1
+    assert monitor.last_expiry_check['disabled'] == 2
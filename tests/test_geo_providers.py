@@ -0,0 +1,39 @@
+import importlib
+
+import pytest
+
+from geo_providers import SubprocessBackend, create_backend
+
+
+def _packages_installed():
+    try:
+        importlib.import_module('qoo_ip138')
+        importlib.import_module('ip_hiofd')
+    except ImportError:
+        return False
+    return True
+
+
+def test_subprocess_backend_parses_cli_output(monkeypatch):
+    backend = SubprocessBackend(timeout_sec=5)
+    output = 'IP：192.0.2.1\n\n归属地：广东深圳\nISP: 电信\n无分隔符的行\n'
+    monkeypatch.setattr(backend, '_run_cmd', lambda cmd: output)
+
+    # 兼容全角/半角冒号，跳过空行与无法解析的行
+    assert backend.query_ip138('192.0.2.1') == [('IP', '192.0.2.1'), ('归属地', '广东深圳'), ('ISP', '电信')]
+
+
+def test_missing_command_raises_before_spawning():
+    backend = SubprocessBackend(timeout_sec=5)
+    with pytest.raises(FileNotFoundError):
+        backend._run_cmd(['emby-monitor-missing-command'])
+
+
+def test_auto_backend_falls_back_to_subprocess():
+    assert create_backend('subprocess').name == 'subprocess'
+    expected = 'inprocess' if _packages_installed() else 'subprocess'
+    assert create_backend('auto').name == expected
+    if expected == 'subprocess':
+        # 明确要求进程内调用时不静默回退
+        with pytest.raises(ImportError):
+            create_backend('inprocess')
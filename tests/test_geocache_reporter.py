@@ -0,0 +1,69 @@
+import threading
+
+
+def _report(reporter, *ips):
+    for ip in ips:
+        reporter.report({'ip': ip, 'location': '广东深圳', 'provider': 'ip138'})
+
+
+def _outbox_ips(db):
+    return [payload['ip'] for _id, payload, _attempts in db.get_geocache_outbox(10)]
+
+
+def test_rejected_record_does_not_block_outbox(geocache_reporter, db):
+    session = geocache_reporter.client.session
+    session.statuses['192.0.2.1'] = 400
+    _report(geocache_reporter, '192.0.2.1', '192.0.2.2', '192.0.2.3')
+
+    assert geocache_reporter.flush() == 2
+    assert session.posted == ['192.0.2.1', '192.0.2.2', '192.0.2.3']
+    assert geocache_reporter.stats()['rejected'] == 1
+    assert geocache_reporter.backoff == 0
+    assert db.count_geocache_outbox() == 0
+
+
+def test_server_error_backs_off_and_keeps_records(geocache_reporter, db):
+    session = geocache_reporter.client.session
+    session.statuses['192.0.2.1'] = 503
+    _report(geocache_reporter, '192.0.2.1', '192.0.2.2', '192.0.2.3')
+
+    assert geocache_reporter.flush() == 0
+    assert session.posted == ['192.0.2.1']
+    assert geocache_reporter.backoff == geocache_reporter.flush_interval
+    assert geocache_reporter.stats()['failed'] == 1
+    assert _outbox_ips(db) == ['192.0.2.1', '192.0.2.2', '192.0.2.3']
+    assert db.get_geocache_outbox(1)[0][2] == 1
+
+    # 服务恢复后按原顺序继续上报
+    session.statuses.clear()
+    assert geocache_reporter.flush() == 3
+    assert geocache_reporter.backoff == 0
+    assert db.count_geocache_outbox() == 0
+
+
+def test_stop_saves_queued_reports_during_slow_request(geocache_reporter, db):
+    session = geocache_reporter.client.session
+    posting, release = threading.Event(), threading.Event()
+    post = session.post
+
+    def slow_post(url, json=None, headers=None, timeout=None):
+        posting.set()
+        release.wait(2)
+        return post(url, json=json, headers=headers, timeout=timeout)
+
+    session.post = slow_post
+    _report(geocache_reporter, '192.0.2.1', '192.0.2.2')
+    flushing = threading.Thread(target=geocache_reporter.flush)
+    flushing.start()
+    assert posting.wait(2)
+    _report(geocache_reporter, '192.0.2.3')
+
+    # 上报请求仍在进行：停止时队列中的记录立即写入发件箱
+    geocache_reporter.stop()
+    assert _outbox_ips(db) == ['192.0.2.1', '192.0.2.2', '192.0.2.3']
+
+    release.set()
+    flushing.join(2)
+    # 停止后不再上报本批剩余记录
+    assert session.posted == ['192.0.2.1']
+    assert _outbox_ips(db) == ['192.0.2.2', '192.0.2.3']
@@ -0,0 +1,50 @@
+import os
+from datetime import datetime, timedelta
+
+from history_archive import HistoryArchiver, list_archives
+
+
+def _played(db, session_id, start_time):
+    db.record_session_start({
+        'session_id': session_id, 'user_id': 'user-1', 'username': 'alice', 'ip': '10.0.0.1',
+        'device': 'TV', 'client': 'Emby Theater', 'media': 'Movie', 'start_time': start_time,
+        'location': '测试位置',
+    })
+    db.record_session_end(session_id, start_time + timedelta(hours=1), 3600)
+
+
+def test_old_rows_move_to_monthly_archives(db):
+    now = datetime.now().replace(microsecond=0)
+    _played(db, 'old-1', datetime(2023, 1, 10, 20, 0, 0))
+    _played(db, 'old-2', datetime(2023, 1, 20, 20, 0, 0))
+    _played(db, 'old-3', datetime(2023, 2, 5, 20, 0, 0))
+    _played(db, 'recent', now - timedelta(days=1))
+    db.log_security_event({
+        'timestamp': datetime(2023, 2, 5, 21, 0, 0), 'user_id': 'user-1', 'username': 'alice',
+        'trigger_ip': '10.0.0.2', 'active_sessions': 2, 'action': 'DISABLE',
+    })
+
+    archiver = HistoryArchiver(db)
+    archiver.configure({'enabled': True, 'playback_retention_days': 30, 'security_retention_days': 30,
+                        'batch_size': 2, 'batch_pause': 0})
+    assert archiver.run() == {'playback_history': 3, 'security_log': 1}
+
+    assert [month for month, _path in list_archives(db.archive_dir)] == ['2023-02', '2023-01']
+    assert [row[0] for row in db.get_user_playback_records('user-1')] == ['recent']
+    # 跨归档查询按时间倒序合并主库与各月归档
+    records = db.get_user_playback_records('user-1', limit=10, include_archive=True)
+    assert [row[0] for row in records] == ['recent', 'old-3', 'old-2', 'old-1']
+    assert db.get_user_ban_info('user-1') is None
+    assert db.get_user_ban_info('user-1', include_archive=True)[1] == '10.0.0.2'
+
+    # 没有新的过期记录时不再归档
+    assert archiver.run() == {'playback_history': 0, 'security_log': 0}
+    assert archiver.stats()['total_archived'] == {'playback_history': 3, 'security_log': 1}
+    assert all(os.path.getsize(path) > 0 for _month, path in list_archives(db.archive_dir))
+
+
+def test_exclusive_blocks_concurrent_run(db):
+    archiver = HistoryArchiver(db)
+    with archiver.exclusive():
+        # 重建汇总等任务持有锁期间，归档直接跳过本轮
+        assert archiver.run() == {}
@@ -0,0 +1,37 @@
+import pytest
+
+from ip_utils import FAMILY_IPV4, FAMILY_IPV6, is_same_network, network_key, parse_endpoint
+
+
+@pytest.mark.parametrize('endpoint, ip, family', [
+    ('192.0.2.10:51234', '192.0.2.10', FAMILY_IPV4),
+    ('[2001:db8::1]:8096', '2001:db8::1', FAMILY_IPV6),
+    ('2001:db8:0:0:0:0:0:1:8096', '2001:db8:0:0:0:0:0:1', FAMILY_IPV6),
+    ('fe80::1%eth0', 'fe80::1', FAMILY_IPV6),
+])
+def test_parse_endpoint(endpoint, ip, family):
+    parsed = parse_endpoint(endpoint, 64)
+    assert (parsed.ip, parsed.family) == (ip, family)
+
+
+def test_network_key_honors_prefix_length():
+    # 同一 /56 委派前缀下的两个 /64 子网
+    first, second = '2001:db8:0:1100::1', '2001:db8:0:11ff::1'
+    assert network_key(first, 56) == network_key(second, 56) == '2001:db8:0:1100::/56'
+    assert is_same_network(first, second, 56)
+    assert not is_same_network(first, second, 64)
+
+    assert network_key('2001:db8:0:12a0::1', 60) == network_key('2001:db8:0:12af::1', 60) == '2001:db8:0:12a0::/60'
+    assert network_key('192.0.2.10', 56) == '192.0.2.10'
+
+
+def test_monitor_uses_configured_prefix_length(monitor, emby, security, config):
+    config['security']['ipv6_prefix_length'] = 56
+    monitor.update_runtime_config(config)
+    emby.add_user('user-1', 'alice')
+    monitor._record_session_start(emby.start_session('session-1', 'user-1', ip='[2001:db8:0:1100::1]:8096'))
+    monitor._record_session_start(emby.start_session('session-2', 'user-1', ip='[2001:db8:0:11ff::1]:8096'))
+
+    # 同一委派前缀内更换子网不算异地登录
+    assert monitor._user_networks == {'user-1': {'2001:db8:0:1100::/56': 2}}
+    assert security.disabled == []
@@ -0,0 +1,64 @@
+import pytest
+
+from conftest import geo_info
+from location_service import PENDING_PROVIDER, LocationCache
+
+
+def _entry(ip_address, provider='ip138'):
+    return {'ip': ip_address, 'provider': provider, 'formatted': '测试位置'}
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LocationCache(maxsize=2)
+    cache.set('10.0.0.1', _entry('10.0.0.1'))
+    cache.set('10.0.0.2', _entry('10.0.0.2'))
+    assert cache.get('10.0.0.1') is not None
+
+    cache.set('10.0.0.3', _entry('10.0.0.3'))
+
+    assert cache.get('10.0.0.2') is None
+    assert cache.get('10.0.0.1') is not None
+    assert cache.stats()['evictions'] == 1
+    assert len(cache) == 2
+
+
+def test_failed_results_use_negative_ttl():
+    cache = LocationCache(ttl=3600, negative_ttl=0)
+    cache.set('10.0.0.1', _entry('10.0.0.1'))
+    cache.set('10.0.0.2', _entry('10.0.0.2', provider='none'))
+    cache.set('10.0.0.3', _entry('10.0.0.3', provider=PENDING_PROVIDER))
+
+    # 解析失败与待补查的结果立即过期，下次查询重新解析
+    assert cache.get('10.0.0.1') is not None
+    assert cache.get('10.0.0.2') is None
+    assert cache.get('10.0.0.3') is None
+    stats = cache.stats()
+    assert (stats['size'], stats['hits'], stats['misses'], stats['expirations']) == (1, 1, 2, 2)
+
+
+def test_warm_does_not_displace_live_entries():
+    cache = LocationCache(maxsize=3)
+    cache.set('10.0.0.1', _entry('10.0.0.1'))
+
+    loaded = cache.warm([_entry('10.0.0.1', provider='自建库'), _entry('10.0.0.2'), _entry('10.0.0.3'), _entry('10.0.0.4')])
+
+    # 已有条目不被覆盖，缓存满即停止；预热条目排在 LRU 最旧的一端
+    assert loaded == 2
+    assert cache.get('10.0.0.1')['provider'] == 'ip138'
+    assert cache.get('10.0.0.4') is None
+    cache.set('10.0.0.5', _entry('10.0.0.5'))
+    assert cache.get('10.0.0.3') is None
+
+
+@pytest.mark.geo_service(warmup_size=10, cache_size=2)
+def test_warm_up_loads_recent_rows_of_current_provider(geo_service, db):
+    for ip_address in ('192.0.2.1', '192.0.2.2', '192.0.2.3'):
+        db.save_ip_location(geo_info(ip_address))
+    db.save_ip_location(dict(geo_info('192.0.2.4'), provider='自建库'))
+
+    assert geo_service.warm_up() == 2
+    assert geo_service.warmup_stats['rows'] == 2
+    assert geo_service.lookup('192.0.2.3')['formatted'] == '广东深圳 | 电信'
+    assert geo_service.lookup('192.0.2.2')['formatted'] == '广东深圳 | 电信'
+    assert geo_service.queried == []
+    assert geo_service.tier_counts['sqlite']['lookups'] == 0
@@ -0,0 +1,36 @@
+import pytest
+
+from conftest import geo_info
+from ip_range_index import IPRangeIndex
+
+
+def test_empty_index_is_truthy():
+    assert len(IPRangeIndex()) == 0
+    assert IPRangeIndex()
+
+
+def test_inconsistent_block_is_not_matched():
+    index = IPRangeIndex(min_samples=2)
+    index.build([geo_info('203.0.113.1'), geo_info('203.0.113.2'), geo_info('198.51.100.1')])
+    assert index.lookup('203.0.113.99')['formatted'] == '广东深圳 | 电信'
+    # 样本不足的网段不参与匹配
+    assert index.lookup('198.51.100.99') is None
+
+    # 同网段出现不同归属地后，该网段不再参与前缀匹配
+    index.add(geo_info('203.0.113.3', formatted='广东广州 | 联通'))
+    assert index.lookup('203.0.113.99') is None
+    assert index.lookup('203.0.113.1') is None
+
+
+@pytest.mark.geo_service(prefix_match=True, prefix_min_samples=2, tiers=['sqlite', 'prefix', 'provider'])
+def test_prefix_index_fills_from_empty_database(geo_service):
+    # 全新数据库：启动时索引为空，运行期的解析结果仍应写入索引并被同网段复用
+    assert len(geo_service.range_index) == 0
+    geo_service.lookup('203.0.113.10')
+    geo_service.lookup('203.0.113.11')
+
+    info = geo_service.lookup('203.0.113.12')
+    assert info['match'] == 'prefix'
+    assert info['formatted'] == '广东深圳 | 电信'
+    assert geo_service.queried == ['203.0.113.10', '203.0.113.11']
+    assert geo_service.get_stats()['range_index']['prefix_hits'] == 1
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from conftest import geo_info
+from geocache_client import GeoCacheClient
+from location_service import PENDING_PROVIDER
+
+
+class BrokenGeoCache:
+    def __init__(self):
+        self.calls = 0
+
+    def query_ip(self, ip_address, timeout=None):
+        self.calls += 1
+        raise AttributeError("'list' object has no attribute 'get'")
+
+
+@pytest.mark.geo_service(tiers=['geocache', 'provider'], geocache_failure_threshold=1, geocache_reset_timeout=0)
+def test_geocache_unexpected_error_releases_probe(geo_service):
+    geo_service.geocache_client = BrokenGeoCache()
+
+    for _ in range(3):
+        assert geo_service._tier_geocache('192.0.2.1', 'ip138') is None
+    # 半开状态的试探请求失败后熔断器重新打开，到期后仍能继续试探
+    assert geo_service.geocache_client.calls == 3
+    assert geo_service.tier_counts['geocache']['errors'] == 3
+    assert geo_service.tier_counts['geocache']['skipped'] == 0
+
+
+def test_geocache_client_rejects_non_object_response():
+    class Response:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return ['unexpected']
+
+    client = GeoCacheClient(base_url='http://geocache.test', api_key='key')
+    client.session.get = lambda url, params=None, timeout=None: Response()
+    with pytest.raises(requests.exceptions.RequestException):
+        client.query_ip('192.0.2.1')
+
+
+@pytest.mark.geo_service(timeout_sec=0.05, adaptive_timeout=False)
+def test_timed_out_provider_result_is_kept(geo_service, db):
+    finished = threading.Event()
+
+    def slow_query(ip_address):
+        time.sleep(0.2)
+        finished.set()
+        return geo_info(ip_address)
+
+    geo_service._query_ip138 = slow_query
+
+    assert geo_service.lookup('192.0.2.7')['provider'] == PENDING_PROVIDER
+    assert '192.0.2.7' in geo_service._pending
+    assert finished.wait(2)
+    geo_service._provider_executor.shutdown(wait=True)
+
+    # 超时后完成的查询结果直接写入缓存和数据库，不必等补查
+    assert geo_service.lookup('192.0.2.7')['formatted'] == '广东深圳 | 电信'
+    assert db.get_ip_location('192.0.2.7')['formatted'] == '广东深圳 | 电信'
+    assert '192.0.2.7' not in geo_service._pending
+
+
+@pytest.mark.geo_service(tiers=['sqlite', 'provider'])
+def test_provider_result_is_written_back_to_faster_tiers(geo_service, db):
+    assert geo_service.lookup('192.0.2.1')['formatted'] == '广东深圳 | 电信'
+    assert db.get_ip_location('192.0.2.1')['formatted'] == '广东深圳 | 电信'
+
+    # 内存缓存失效后由数据库层命中，并回写内存缓存
+    geo_service.cache.clear()
+    geo_service.lookup('192.0.2.1')
+    geo_service.lookup('192.0.2.1')
+    assert geo_service.queried == ['192.0.2.1']
+    assert geo_service.tier_counts['sqlite']['hits'] == 1
+    assert geo_service.tier_counts['provider']['lookups'] == 1
@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+
+from conftest import geo_info
+
+
+@pytest.mark.geo_service(prefix_match=True, prefix_min_samples=2, tiers=['sqlite', 'prefix', 'provider'])
+def test_lookup_many_counts_local_tiers_once(geo_service):
+    geo_service.lookup_many(['198.51.100.1', '198.51.100.2', '198.51.100.1', ''])
+    assert sorted(geo_service.queried) == ['198.51.100.1', '198.51.100.2']
+
+    counts = geo_service.tier_counts
+    # 本地层级只批量查询一次，未命中的IP不再重复查询数据库与网段索引
+    assert counts['sqlite']['lookups'] == 2
+    assert counts['prefix']['lookups'] == 2
+
+    infos = geo_service.lookup_many(['198.51.100.2', '198.51.100.3'])
+    assert infos[0]['provider'] == 'ip138'
+    assert infos[1]['match'] == 'prefix'
+    assert geo_service.queried[2:] == []
+
+
+@pytest.mark.geo_service(prefix_match=True, prefix_min_samples=1, tiers=['provider', 'sqlite'])
+def test_lookup_many_follows_tier_order(geo_service):
+    calls = []
+    geo_service._tier_provider = lambda ip, provider: calls.append(('provider', ip)) or {'provider': provider, 'ip': ip}
+    geo_service._tier_sqlite = lambda ip, provider: calls.append(('sqlite', ip))
+
+    geo_service.lookup_many(['192.0.2.1'])
+    assert calls == [('provider', '192.0.2.1')]
+    assert geo_service.tier_counts['sqlite']['lookups'] == 0
+
+
+def test_lookup_many_resolves_misses_concurrently(geo_service):
+    barrier = threading.Barrier(3, timeout=2)
+
+    def query_ip138(ip_address):
+        # 三个未命中的IP必须同时在查询中，才能全部通过屏障
+        barrier.wait()
+        return geo_info(ip_address)
+
+    geo_service._query_ip138 = query_ip138
+    ips = ['192.0.2.3', '192.0.2.1', '192.0.2.2']
+    assert [info['ip'] for info in geo_service.lookup_many(ips)] == ips
+
+
+def test_lookup_many_without_resolve_returns_local_hits_only(geo_service, db):
+    db.save_ip_location(geo_info('192.0.2.1'))
+
+    infos = geo_service.lookup_many(['192.0.2.1', '192.0.2.2'], resolve=False)
+    assert infos[0]['formatted'] == '广东深圳 | 电信'
+    assert infos[1] is None
+    assert geo_service.queried == []
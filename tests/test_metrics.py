@@ -0,0 +1,34 @@
+import threading
+
+from metrics import LatencyHistogram, StageMetrics
+
+
+def test_histogram_percentiles_use_bucket_bounds():
+    histogram = LatencyHistogram()
+    for elapsed_ms in [1.0] * 90 + [100.0] * 9 + [2000.0]:
+        histogram.observe(elapsed_ms)
+
+    stats = histogram.to_dict()
+    assert stats['count'] == 100
+    # 百分位取所在桶上界：不低于真实值，且不超过最大值
+    assert 1.0 <= stats['p50_ms'] < 1.2
+    assert 100.0 <= stats['p95_ms'] < 120.0
+    assert stats['p99_ms'] < 120.0
+    assert stats['max_ms'] == 2000.0
+    assert LatencyHistogram().to_dict()['p99_ms'] == 0.0
+
+
+def test_cycle_breakdown_only_counts_own_thread():
+    metrics = StageMetrics()
+    metrics.begin_cycle()
+    metrics.observe('emby_sessions', 5.0)
+    metrics.observe('emby_sessions', 3.0)
+    # 其他线程（如补全线程池）的阶段只进入直方图，不计入本轮分解
+    worker = threading.Thread(target=metrics.observe, args=('enrich', 50.0))
+    worker.start()
+    worker.join()
+    _, breakdown = metrics.end_cycle()
+
+    assert breakdown == {'emby_sessions': 8.0}
+    assert set(metrics.snapshot()) == {'cycle', 'emby_sessions', 'enrich'}
+    assert metrics.snapshot()['emby_sessions']['count'] == 2
@@ -0,0 +1,39 @@
+def _start(monitor, emby, session_id, ip):
+    monitor._record_session_start(emby.start_session(session_id, 'user-1', ip=ip))
+
+
+def test_index_counts_sessions_per_network(monitor, emby, security):
+    emby.add_user('user-1', 'alice')
+    _start(monitor, emby, 'session-1', '10.0.0.1')
+    _start(monitor, emby, 'session-2', '10.0.0.1')
+
+    # 同一IP的两个会话只算一个网络，不触发告警
+    assert monitor._user_networks == {'user-1': {'10.0.0.1': 2}}
+    assert list(monitor._user_ip_sessions[('user-1', '10.0.0.1')]) == ['session-1', 'session-2']
+    assert security.disabled == []
+
+    monitor._record_session_end('session-1')
+    assert monitor._user_networks == {'user-1': {'10.0.0.1': 1}}
+    monitor._record_session_end('session-2')
+    assert monitor._user_networks == {}
+    assert monitor._user_ip_sessions == {}
+
+
+def test_second_network_triggers_alert(monitor, emby, security):
+    emby.add_user('user-1', 'alice')
+    _start(monitor, emby, 'session-1', '10.0.0.1')
+    _start(monitor, emby, 'session-2', '10.0.0.2')
+
+    assert monitor._user_networks == {'user-1': {'10.0.0.1': 1, '10.0.0.2': 1}}
+    assert security.disabled == ['user-1']
+
+
+def test_index_is_rebuilt_when_prefix_length_changes(monitor, emby, config):
+    emby.add_user('user-1', 'alice')
+    _start(monitor, emby, 'session-1', '2001:db8:0:1::1')
+    _start(monitor, emby, 'session-2', '2001:db8:0:1::2')
+    assert monitor._user_networks == {'user-1': {'2001:db8:0:1::/64': 2}}
+
+    config['security']['ipv6_prefix_length'] = 48
+    monitor.update_runtime_config(config)
+    assert monitor._user_networks == {'user-1': {'2001:db8::/48': 2}}
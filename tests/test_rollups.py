@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+from history_archive import HistoryArchiver
+from rollups import RollupRebuilder
+
+
+def _played(db, session_id, user_id, start_time, duration):
+    db.record_session_start({
+        'session_id': session_id, 'user_id': user_id, 'username': user_id, 'ip': '10.0.0.1',
+        'device': 'TV', 'client': 'Emby Theater', 'media': 'Movie', 'start_time': start_time,
+        'location': '测试位置',
+    })
+    db.record_session_end(session_id, start_time + timedelta(seconds=duration), duration)
+
+
+def _user_rollup(db):
+    with db._db.connect() as conn:
+        return conn.execute('SELECT day, user_id, sessions, watch_seconds FROM rollup_user_day ORDER BY 1, 2').fetchall()
+
+
+def test_trigger_counts_sessions_when_they_end(db):
+    start_time = datetime(2024, 5, 1, 20, 0, 0)
+    _played(db, 'session-1', 'user-1', start_time, 600)
+    _played(db, 'session-2', 'user-1', start_time + timedelta(hours=1), 900)
+    db.record_session_start({
+        'session_id': 'open', 'user_id': 'user-1', 'username': 'user-1', 'ip': '10.0.0.1', 'device': 'TV',
+        'client': 'Emby Theater', 'media': 'Movie', 'start_time': start_time, 'location': '测试位置',
+    })
+
+    # 未结束的会话不计入汇总
+    assert _user_rollup(db) == [('2024-05-01', 'user-1', 2, 1500)]
+    with db._db.connect() as conn:
+        assert conn.execute('SELECT hour, sessions FROM rollup_hour_day ORDER BY hour').fetchall() == [(20, 1), (21, 1)]
+
+
+def test_rebuild_includes_archived_months(db):
+    recent = datetime.now().replace(hour=12, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    _played(db, 'old', 'user-1', datetime(2023, 1, 10, 20, 0, 0), 600)
+    _played(db, 'recent', 'user-2', recent, 300)
+    expected = _user_rollup(db)
+
+    archiver = HistoryArchiver(db)
+    archiver.configure({'enabled': True, 'playback_retention_days': 30, 'batch_pause': 0})
+    assert archiver.run()['playback_history'] == 1
+    with db._db.connect(write=True) as conn:
+        conn.execute('DELETE FROM rollup_user_day')
+
+    # 全量重建从主库与归档库重新聚合，结果与增量维护的一致
+    result = RollupRebuilder(db, archiver=archiver, segment_pause=0).rebuild()
+    assert result['from_day'] == '2023-01-01'
+    assert _user_rollup(db) == expected
+
+    # 只重建最近几天时不影响更早的汇总
+    RollupRebuilder(db, archiver=archiver, segment_pause=0).rebuild(days=3)
+    assert _user_rollup(db) == expected
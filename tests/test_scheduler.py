@@ -0,0 +1,60 @@
+import threading
+
+from conftest import wait_for
+from scheduler import TaskScheduler
+
+
+def _stats(scheduler):
+    return {job['name']: job for job in scheduler.get_stats()}
+
+
+def test_long_job_does_not_block_other_jobs():
+    scheduler = TaskScheduler()
+    release = threading.Event()
+    ran = {name: threading.Event() for name in ('archive', 'rollup', 'backfill')}
+
+    def slow(name):
+        def run():
+            ran[name].set()
+            release.wait(5)
+        return run
+
+    scheduler.add_job('archive', 60, slow('archive'), initial_delay=0)
+    scheduler.add_job('rollup', 60, slow('rollup'), initial_delay=0)
+    scheduler.add_job('backfill', 60, ran['backfill'].set, initial_delay=0.05)
+    scheduler.start()
+    try:
+        # 两个耗时任务占用线程时，后到期的任务仍能立即执行
+        assert ran['backfill'].wait(2)
+        assert ran['archive'].is_set() and ran['rollup'].is_set()
+    finally:
+        release.set()
+        scheduler.stop()
+
+
+def test_overlapping_run_is_skipped_and_failures_counted():
+    scheduler = TaskScheduler()
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+
+    def broken():
+        raise RuntimeError('boom')
+
+    scheduler.add_job('slow', 0.05, slow, initial_delay=0)
+    scheduler.add_job('broken', 60, broken, initial_delay=0)
+    scheduler.start()
+    try:
+        assert started.wait(2)
+        # 上一次执行未结束：到期的下一次跳过，不并发执行
+        assert wait_for(lambda: _stats(scheduler)['slow']['overlap_skips'] >= 2)
+        assert wait_for(lambda: _stats(scheduler)['broken']['failures'] == 1)
+    finally:
+        release.set()
+        scheduler.stop()
+
+    assert _stats(scheduler)['slow']['runs'] == 1
+    assert _stats(scheduler)['broken']['last_error'] == 'boom'
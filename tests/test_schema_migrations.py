@@ -0,0 +1,71 @@
+import sqlite3
+
+from database import DatabaseManager
+from schema_migrations import LATEST_VERSION, apply_migrations, get_schema_version
+from sqlite_manager import SQLiteConnectionManager
+
+
+def _create_legacy_database(path):
+    """本机制之前的数据库：没有 schema_version，security_log 缺少 username 列"""
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            '''
+            CREATE TABLE security_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME, user_id TEXT,
+                trigger_ip TEXT, active_sessions INTEGER, action TEXT
+            )
+            '''
+        )
+        conn.execute("INSERT INTO security_log (timestamp, user_id, action) VALUES ('2024-05-01 20:00:00', 'user-1', 'DISABLE')")
+    conn.close()
+
+
+def test_legacy_database_is_upgraded_step_by_step(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    _create_legacy_database(path)
+    manager = SQLiteConnectionManager(path)
+
+    assert apply_migrations(manager, target_version=3) == 3
+    with manager.connect() as conn:
+        assert [row[0] for row in conn.execute('SELECT version FROM schema_version')] == [1, 2, 3]
+        assert conn.execute('SELECT user_id, username FROM security_log').fetchall() == [('user-1', None)]
+
+    assert apply_migrations(manager) == LATEST_VERSION
+    # 再次执行不重复迁移
+    assert apply_migrations(manager) == LATEST_VERSION
+    with manager.connect() as conn:
+        assert get_schema_version(conn) == LATEST_VERSION
+        assert conn.execute('SELECT COUNT(*) FROM schema_version').fetchone()[0] == LATEST_VERSION
+    manager.close_all()
+
+
+def test_hot_path_queries_use_indexes(db):
+    queries = [
+        (db.SESSION_END_SQL, ('2024-05-01 20:40:00', 2400, 'session-1'), 'idx_playback_history_open_session'),
+        (
+            'SELECT * FROM playback_history WHERE user_id = ? ORDER BY start_time DESC LIMIT 20',
+            ('user-1',), 'idx_playback_history_user_start',
+        ),
+        (
+            "SELECT * FROM security_log WHERE user_id = ? AND action = 'DISABLE' ORDER BY timestamp DESC LIMIT 1",
+            ('user-1',), 'idx_security_log_user_action',
+        ),
+    ]
+    with db._db.connect() as conn:
+        for sql, params, index in queries:
+            plan = ' '.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params))
+            # 使用对应索引，且不需要临时排序
+            assert index in plan
+            assert 'TEMP B-TREE' not in plan
+
+
+def test_newer_schema_is_left_untouched(tmp_path):
+    path = str(tmp_path / 'newer.db')
+    DatabaseManager(path).close()
+    with sqlite3.connect(path) as conn:
+        conn.execute("INSERT INTO schema_version (version, description) VALUES (?, '未来的迁移')", (LATEST_VERSION + 1,))
+    conn.close()
+
+    manager = SQLiteConnectionManager(path)
+    assert apply_migrations(manager) == LATEST_VERSION + 1
+    manager.close_all()
@@ -0,0 +1,51 @@
+import threading
+
+from conftest import history_rows, wait_for
+
+
+def test_new_sessions_are_recorded_off_the_poll_thread(monitor, emby):
+    emby.add_user('user-1', 'alice')
+    emby.add_user('user-2', 'bob')
+    emby.start_session('session-1', 'user-1', ip='10.0.0.1')
+    emby.start_session('session-2', 'user-2', ip='10.0.0.2')
+
+    monitor.process_sessions()
+
+    assert wait_for(lambda: len(monitor.active_sessions) == 2 and not monitor._pending_sessions)
+    assert monitor.active_sessions['session-2']['username'] == 'bob'
+    assert monitor.active_sessions['session-2']['location'] == '测试位置'
+    assert sorted(history_rows(monitor.db)) == [('session-1', None), ('session-2', None)]
+
+
+def test_full_queue_defers_sessions_to_next_poll(monitor, emby, config):
+    config['monitor']['enrich_workers'] = 1
+    config['monitor']['enrich_queue_size'] = 1
+    monitor.update_runtime_config(config)
+
+    release = threading.Event()
+    get_user_info = emby.get_user_info
+
+    def slow_user_info(user_id):
+        release.wait(2)
+        return get_user_info(user_id)
+
+    emby.get_user_info = slow_user_info
+    emby.add_user('user-1', 'alice')
+    for index in range(3):
+        emby.start_session(f'session-{index}', 'user-1')
+
+    monitor.process_sessions()
+    # 补全仍在进行时再次轮询：排队中的会话不重复提交，其余会话等下一轮
+    monitor.process_sessions()
+    assert len(monitor._pending_sessions) == 1
+    assert monitor.active_sessions == {}
+
+    release.set()
+    assert wait_for(lambda: not monitor._pending_sessions)
+    for _ in range(2):
+        monitor.process_sessions()
+        assert wait_for(lambda: not monitor._pending_sessions)
+
+    assert sorted(monitor.active_sessions) == ['session-0', 'session-1', 'session-2']
+    assert emby.user_lookups.count('user-1') == 3
+    assert len(history_rows(monitor.db)) == 3
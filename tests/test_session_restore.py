@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+from conftest import history_rows
+
+
+def _checkpoint(db, session_id, saved_at):
+    session = {
+        'session_id': session_id, 'user_id': 'user-1', 'username': 'alice', 'ip': '10.0.0.1',
+        'device': 'TV', 'client': 'Emby Theater', 'media': 'Movie',
+        'start_time': saved_at - timedelta(minutes=30), 'location': '测试位置',
+        'playback_duration': 600, 'last_position_ticks': 0,
+    }
+    db.record_session_start(session)
+    db.save_active_sessions([session], saved_at)
+
+
+def test_failed_first_poll_keeps_restored_sessions(monitor, db, emby):
+    _checkpoint(db, 'session-1', datetime.now().replace(microsecond=0))
+    monitor._restore_active_sessions()
+
+    # 首次轮询失败：不对账、不结束任何会话
+    emby.sessions = None
+    monitor.process_sessions()
+    assert monitor._restored_sessions is not None
+    assert history_rows(db) == [('session-1', None)]
+
+    # 成功的快照中会话仍在播放：直接接管，不补写结束、不重复入库
+    emby.add_user('user-1', 'alice')
+    emby.sessions = {}
+    emby.start_session('session-1', 'user-1')
+    monitor.process_sessions()
+    assert monitor._restored_sessions is None
+    assert 'session-1' in monitor.active_sessions
+    assert history_rows(db) == [('session-1', None)]
+    assert emby.user_lookups == []
+
+
+def test_sessions_ended_during_downtime_close_at_checkpoint(monitor, db):
+    saved_at = datetime.now().replace(microsecond=0) - timedelta(minutes=5)
+    _checkpoint(db, 'session-1', saved_at)
+    monitor._restore_active_sessions()
+
+    monitor.process_sessions()
+
+    assert monitor.active_sessions == {}
+    assert history_rows(db, 'session_id, end_time, duration') == [
+        ('session-1', saved_at.strftime('%Y-%m-%d %H:%M:%S'), 600),
+    ]
@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+
+from conftest import geo_info, wait_for
+
+
+def _lookup_concurrently(geo_service, ip_address, count):
+    results = [None] * count
+
+    def lookup(index):
+        try:
+            results[index] = geo_service.lookup(ip_address)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=lookup, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+@pytest.mark.geo_service(tiers=['provider'])
+def test_concurrent_lookups_share_one_query(geo_service):
+    release = threading.Event()
+
+    def query_ip138(ip_address):
+        geo_service.queried.append(ip_address)
+        release.wait(2)
+        return geo_info(ip_address)
+
+    geo_service._query_ip138 = query_ip138
+    threads, results = _lookup_concurrently(geo_service, '192.0.2.1', 5)
+    # 首个请求查询期间，其余请求等待同一结果而不是各自调用外部命令
+    assert wait_for(lambda: geo_service.coalesced_lookups == 4)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert geo_service.queried == ['192.0.2.1']
+    assert {result['formatted'] for result in results} == {'广东深圳 | 电信'}
+    assert geo_service._inflight == {}
+
+
+@pytest.mark.geo_service(tiers=['provider'])
+def test_waiters_receive_the_leaders_error(geo_service):
+    release = threading.Event()
+
+    def failing_resolve(ip_address, current_provider, tiers=None):
+        release.wait(2)
+        raise RuntimeError('解析失败')
+
+    geo_service._resolve = failing_resolve
+    threads, results = _lookup_concurrently(geo_service, '192.0.2.1', 3)
+    assert wait_for(lambda: geo_service.coalesced_lookups == 2)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    # 失败后不残留进行中的记录，下次查询重新解析
+    assert geo_service._inflight == {}
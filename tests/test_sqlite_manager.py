@@ -0,0 +1,42 @@
+import os
+import threading
+
+from sqlite_manager import SQLiteConnectionManager
+
+
+def _use_in_thread(manager):
+    ready, release = threading.Event(), threading.Event()
+
+    def work():
+        with manager.connect(write=True) as conn:
+            conn.execute('INSERT INTO items (name) VALUES (?)', (threading.current_thread().name,))
+        ready.set()
+        release.wait(2)
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    assert ready.wait(2)
+    return thread, release
+
+
+def test_close_all_closes_every_thread_connection(tmp_path):
+    manager = SQLiteConnectionManager(str(tmp_path / 'test.db'))
+    with manager.connect(write=True) as conn:
+        conn.execute('CREATE TABLE items (name TEXT)')
+    workers = [_use_in_thread(manager) for _ in range(2)]
+    assert manager.stats()['open_connections'] == 3
+
+    # 工作线程仍在运行，连接不会随线程退出回收，只能由 close_all 关闭
+    assert manager.close_all() == 3
+    assert manager.stats()['open_connections'] == 0
+    # 最后一个连接关闭时 WAL 已写回数据库文件
+    assert not os.path.exists(str(tmp_path / 'test.db-wal'))
+    for thread, release in workers:
+        release.set()
+        thread.join(2)
+
+    # 关闭后再次访问时重新建立连接
+    with manager.connect() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM items').fetchone()[0] == 2
+    assert manager.stats()['open_connections'] == 1
+    assert manager.close_all() == 1
@@ -0,0 +1,70 @@
+from datetime import datetime
+
+from conftest import history_rows, wait_for
+
+
+def _session(media, start_time):
+    return {
+        'session_id': 'session-a', 'user_id': 'user-1', 'username': 'alice', 'ip': '10.0.0.1',
+        'device': 'TV', 'client': 'Emby Theater', 'media': media, 'start_time': start_time,
+        'location': '测试位置',
+    }
+
+
+def test_reused_session_id_in_one_batch(db):
+    """同一批次内：开始 A/第1集 → 结束 A → 以同一 Id 开始 A/第2集，结束只作用于第1集"""
+    db.set_write_behind(True)
+    db.record_session_start(_session('Show S1E1', datetime(2024, 5, 1, 20, 0, 0)))
+    db.record_session_end('session-a', datetime(2024, 5, 1, 20, 40, 0), 2400)
+    db.record_session_start(_session('Show S1E2', datetime(2024, 5, 1, 20, 40, 0)))
+    assert db.pending_write_count() == 3
+    assert db.flush_writes() == 3
+
+    with db._db.connect() as conn:
+        rows = conn.execute(
+            'SELECT media_name, end_time, duration FROM playback_history ORDER BY id'
+        ).fetchall()
+        rollup = conn.execute('SELECT sessions, watch_seconds FROM rollup_user_day').fetchall()
+    assert rows == [
+        ('Show S1E1', '2024-05-01 20:40:00', 2400),
+        ('Show S1E2', None, None),
+    ]
+    assert rollup == [(1, 2400)]
+
+
+def test_flush_failure_keeps_order_for_retry(db):
+    db.set_write_behind(True)
+    db.record_session_start(_session('Show S1E1', datetime(2024, 5, 1, 20, 0, 0)))
+    db.record_session_end('session-a', datetime(2024, 5, 1, 20, 40, 0), 2400)
+    pending = list(db._pending_writes)
+    with db._db.connect(write=True) as conn:
+        conn.execute('ALTER TABLE playback_history RENAME TO playback_history_tmp')
+    try:
+        db.flush_writes()
+    except Exception:
+        pass
+    else:
+        raise AssertionError('flush_writes 应当失败')
+    assert db._pending_writes == pending
+
+    with db._db.connect(write=True) as conn:
+        conn.execute('ALTER TABLE playback_history_tmp RENAME TO playback_history')
+    assert db.flush_writes() == 2
+    assert history_rows(db) == [('session-a', '2024-05-01 20:40:00')]
+
+
+def test_poll_cycle_writes_once_at_cycle_end(monitor, db, emby):
+    db.set_write_behind(True)
+    emby.add_user('user-1', 'alice')
+    emby.start_session('session-1', 'user-1')
+    emby.start_session('session-2', 'user-1')
+
+    monitor.process_sessions()
+    assert wait_for(lambda: len(monitor.active_sessions) == 2)
+    # 轮询期间只缓冲，不逐条写库
+    assert history_rows(db) == []
+    assert db.pending_write_count() == 2
+
+    monitor._run_periodic_tasks()
+    assert db.pending_write_count() == 0
+    assert sorted(history_rows(db)) == [('session-1', None), ('session-2', None)]